@@ -1,2 +1,2 @@
-from pycoki.pycoki import KeyValueStore, start, get, set
+from pycoki.pycoki import KeyValueStore, start, get, set, register_backend
 from pycoki.version import __version__
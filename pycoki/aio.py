@@ -0,0 +1,271 @@
+"""Pycoki asyncio interface"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import pycoki
+from pycoki.pycoki import DEFAULT_CONNECTION_STR
+
+class AsyncKeyValueStore:
+    def __init__(self, stores, executors=None, batch_gets=True):
+        """Constractor of AsyncKeyValueStore
+        Use pycoki.aio.start() instead
+
+        :param stores: KeyValueStores with their own connections. They work as the connection pool
+        :type stores: list
+        :param executors: Single thread executors for each store. Created if not given
+        :type executors: list
+        :param batch_gets: Fetch values requested by concurrent get calls with one query
+        :type batch_gets: bool
+        """
+        self.stores = list(stores)
+        self.executors = executors if executors else [ThreadPoolExecutor(1, thread_name_prefix="pycoki") for _ in self.stores]
+        self.batch_gets = batch_gets
+        self.namespace = self.stores[0].namespace
+        self.idle_workers = None
+        self.pending_gets = {}
+        self.pinned_worker = contextvars.ContextVar("pinned_worker", default=None)
+
+    async def acquire(self):
+        """Wait for an idle worker
+
+        :return: Index of worker
+        :rtype: int
+        """
+        if self.idle_workers is None:
+            self.idle_workers = asyncio.Queue()
+            for i in range(len(self.stores)):
+                self.idle_workers.put_nowait(i)
+        return await self.idle_workers.get()
+
+    def release(self, index):
+        """Return the worker to idle workers
+
+        :param index: Index of worker
+        :type index: int
+        """
+        self.idle_workers.put_nowait(index)
+
+    async def call(self, index, func, *args, **kwargs):
+        """Call function in the executor of the worker
+
+        :param index: Index of worker
+        :type index: int
+        :param func: Function
+        :type func: function
+        :return: Return value of function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executors[index], functools.partial(func, *args, **kwargs))
+
+    async def run(self, method, *args, **kwargs):
+        """Call method of KeyValueStore on a worker
+
+        :param method: Name of method
+        :type method: str
+        :return: Return value of method
+        """
+        index = self.pinned_worker.get()
+        if index is not None:
+            return await self.call(index, getattr(self.stores[index], method), *args, **kwargs)
+        index = await self.acquire()
+        try:
+            return await self.call(index, getattr(self.stores[index], method), *args, **kwargs)
+        finally:
+            self.release(index)
+
+    @asynccontextmanager
+    async def transaction(self, flush_count=None, flush_interval=None):
+        """Run operations in the block on one connection and commit at the end of the block.
+        See KeyValueStore.transaction
+
+        :param flush_count: Commit every N writes in the block
+        :type flush_count: int
+        :param flush_interval: Commit at the next write when the milliseconds passed since the last commit
+        :type flush_interval: int
+        :return: This instance
+        :rtype: AsyncKeyValueStore
+        """
+        if self.pinned_worker.get() is not None:
+            yield self
+            return
+        index = await self.acquire()
+        token = self.pinned_worker.set(index)
+        context = self.stores[index].transaction(flush_count=flush_count, flush_interval=flush_interval)
+        try:
+            await self.call(index, context.__enter__)
+            try:
+                yield self
+            except BaseException as ex:
+                await self.call(index, context.__exit__, type(ex), ex, ex.__traceback__)
+                raise
+            await self.call(index, context.__exit__, None, None, None)
+        finally:
+            self.pinned_worker.reset(token)
+            self.release(index)
+
+    async def get(self, key=None, namespace=None):
+        """Get value by key or all values in namespace.
+        Concurrent calls with key are fetched together by get_many
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Value or all values in namespace
+        """
+        if key is None or not self.batch_gets or self.pinned_worker.get() is not None:
+            return await self.run("get", key=key, namespace=namespace)
+        ns = namespace if namespace else self.namespace
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.pending_gets:
+            loop.call_soon(self.flush_gets)
+        self.pending_gets.setdefault(ns, {}).setdefault(key, []).append(future)
+        return await future
+
+    def flush_gets(self):
+        """Start fetching values requested by get calls in this loop iteration
+        """
+        pending = self.pending_gets
+        self.pending_gets = {}
+        for ns, futures in pending.items():
+            asyncio.ensure_future(self.fetch_gets(ns, futures))
+
+    async def fetch_gets(self, namespace, futures):
+        """Fetch values and set them to the futures of get calls
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param futures: Futures by key
+        :type futures: dict
+        """
+        try:
+            if len(futures) == 1:
+                key = next(iter(futures))
+                values = {key: await self.run("get", key=key, namespace=namespace)}
+            else:
+                values = await self.run("get_many", list(futures), namespace=namespace) or {}
+        except Exception as ex:
+            for fs in futures.values():
+                for f in fs:
+                    if not f.done():
+                        f.set_exception(ex)
+            return
+        for key, fs in futures.items():
+            for f in fs:
+                if not f.done():
+                    f.set_result(values.get(key))
+
+    async def get_many(self, keys, namespace=None):
+        """Get values by multiple keys at once
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Values by key. Keys not found are not included
+        :rtype: dict
+        """
+        return await self.run("get_many", keys, namespace=namespace)
+
+    async def keys(self, namespace=None, **kwargs):
+        """Get all keys in namespace, or keys in range by prefix, start, end and limit
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: All keys in namespace
+        :rtype: list
+        """
+        return await self.run("keys", namespace=namespace, **kwargs)
+
+    async def items(self, namespace=None, **kwargs):
+        """Get keys and values in range by prefix, start, end and limit in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Tuples of key and value
+        :rtype: list
+        """
+        return await self.run("items", namespace=namespace, **kwargs)
+
+    async def set(self, key, value, namespace=None, **kwargs):
+        """Set value with key
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        return await self.run("set", key, value, namespace=namespace, **kwargs)
+
+    async def set_many(self, values, namespace=None, **kwargs):
+        """Set multiple values and commit once
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        return await self.run("set_many", values, namespace=namespace, **kwargs)
+
+    async def remove(self, key=None, namespace=None):
+        """Remove value by key or all values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        return await self.run("remove", key=key, namespace=namespace)
+
+    async def remove_many(self, keys, namespace=None):
+        """Remove values by multiple keys and commit once
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        return await self.run("remove_many", keys, namespace=namespace)
+
+    async def close(self):
+        """Close connections of all workers and shutdown executors
+        """
+        for i, store in enumerate(self.stores):
+            await self.call(i, store.close)
+        for executor in self.executors:
+            executor.shutdown(wait=False)
+
+
+async def start(connection_str=None, pool_size=4, batch_gets=True, **kwargs):
+    """Get a new instance of AsyncKeyValueStore
+
+    :param connection_str: Connection string
+    :type connection_str: str
+    :param pool_size: Number of connections
+    :type pool_size: int
+    :param batch_gets: Fetch values requested by concurrent get calls with one query
+    :type batch_gets: bool
+    :return: Instance of AsyncKeyValueStore. kwargs are passed to pycoki.start
+    :rtype: AsyncKeyValueStore
+    """
+    loop = asyncio.get_running_loop()
+    connection_str = connection_str if connection_str else DEFAULT_CONNECTION_STR
+    executors = [ThreadPoolExecutor(1, thread_name_prefix="pycoki") for _ in range(pool_size)]
+    # Create table by the first one and connect others concurrently
+    stores = [await loop.run_in_executor(executors[0], functools.partial(pycoki.start, connection_str, **kwargs))]
+    kwargs["init_table"] = False
+    stores += await asyncio.gather(*[loop.run_in_executor(e, functools.partial(pycoki.start, connection_str, **kwargs)) for e in executors[1:]])
+    return AsyncKeyValueStore(stores, executors=executors, batch_gets=batch_gets)
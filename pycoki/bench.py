@@ -0,0 +1,383 @@
+"""Pycoki benchmark
+
+Run workloads against KeyValueStore and report throughput, latency and memory as JSON.
+
+    $ python -m pycoki.bench --workload mixed --operations 10000 --distribution zipf
+    $ python -m pycoki.bench --import-time
+    $ python -m pycoki.bench --scan --keys 1000000
+"""
+
+from bisect import bisect
+import argparse
+import json
+import logging
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import pycoki
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WORKLOADS = {
+    "read-heavy": {"get": 0.95, "set": 0.05},
+    "write-heavy": {"get": 0.1, "set": 0.85, "remove": 0.05},
+    "mixed": {"get": 0.5, "set": 0.45, "remove": 0.04, "keys": 0.01},
+}
+
+class WorkloadGenerator:
+    def __init__(self, keys=1000, namespaces=1, distribution="uniform", zipf_s=1.1, value_size=(100, 100), ratios=None, seed=0):
+        """Constractor of WorkloadGenerator
+        Same parameters and seed always generate the same operations
+
+        :param keys: Number of keys in each namespace
+        :type keys: int
+        :param namespaces: Number of namespaces
+        :type namespaces: int
+        :param distribution: Distribution of key access (uniform or zipf)
+        :type distribution: str
+        :param zipf_s: Exponent of Zipf distribution
+        :type zipf_s: float
+        :param value_size: Min and max bytes of values, 1 or more. Sizes are distributed log-uniformly
+        :type value_size: tuple
+        :param ratios: Ratio of each operation (get, set, remove, keys)
+        :type ratios: dict
+        :param seed: Random seed
+        :type seed: int
+        :raises ValueError: Invalid value_size
+        """
+        if value_size[0] < 1 or value_size[1] < value_size[0]:
+            raise ValueError("Sizes of values must be 1 or more and min must not exceed max: {0}-{1}".format(*value_size))
+        self.keys = keys
+        self.namespaces = namespaces
+        self.distribution = distribution
+        self.value_size = value_size
+        self.ratios = ratios if ratios else WORKLOADS["mixed"]
+        self.random = random.Random(seed)
+        self.cumulative_weights = None
+        if distribution == "zipf":
+            total = 0.0
+            self.cumulative_weights = []
+            for i in range(keys):
+                total += 1.0 / (i + 1) ** zipf_s
+                self.cumulative_weights.append(total)
+        elif distribution != "uniform":
+            raise ValueError("Unknown distribution: " + distribution)
+        self.operations = list(self.ratios)
+        self.cumulative_ratios = []
+        total = 0.0
+        for op in self.operations:
+            total += self.ratios[op]
+            self.cumulative_ratios.append(total)
+        self.value_source = "".join(self.random.choice(string.ascii_letters) for _ in range(min(value_size[1], 65536)))
+
+    def namespace(self):
+        return "bench{}".format(self.random.randrange(self.namespaces))
+
+    def key(self):
+        if self.cumulative_weights is None:
+            index = self.random.randrange(self.keys)
+        else:
+            index = min(bisect(self.cumulative_weights, self.random.random() * self.cumulative_weights[-1]), self.keys - 1)
+        return "key{}".format(index)
+
+    def value(self):
+        low, high = self.value_size
+        size = int(round(low * (high / low) ** self.random.random())) if high > low else low
+        repeat = size // len(self.value_source) + 1
+        return (self.value_source * repeat)[:size]
+
+    def operation(self):
+        """Get next operation
+
+        :return: Tuple of operation name, namespace, key and value
+        :rtype: tuple
+        """
+        op = self.operations[min(bisect(self.cumulative_ratios, self.random.random() * self.cumulative_ratios[-1]), len(self.operations) - 1)]
+        return (op, self.namespace(), self.key(), self.value() if op == "set" else None)
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        """Constractor of ErrorCounter
+        Logging handler to count errors. KeyValueStore logs errors of operations and returns None or False instead of raising
+        """
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(p / 100.0 * (len(sorted_values) - 1)))]
+
+def peak_rss():
+    """Get peak resident set size of this process
+
+    :return: Bytes. None if not available
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def preload(kvs, generator, batch_size=100):
+    """Set values to all keys of all namespaces
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param generator: Workload generator
+    :type generator: WorkloadGenerator
+    :param batch_size: Number of values set at once
+    :type batch_size: int
+    """
+    for n in range(generator.namespaces):
+        ns = "bench{}".format(n)
+        kvs.remove(namespace=ns)
+        for start in range(0, generator.keys, batch_size):
+            kvs.set_many({"key{}".format(i): generator.value() for i in range(start, min(start + batch_size, generator.keys))}, namespace=ns)
+
+def run(kvs, generator, operations=10000):
+    """Run operations and measure them
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param generator: Workload generator
+    :type generator: WorkloadGenerator
+    :param operations: Number of operations
+    :type operations: int
+    :return: Report. Operations which returned failure or logged error are counted as failures
+    :rtype: dict
+    """
+    ops = [generator.operation() for _ in range(operations)]
+    latencies = {}
+    failures = {}
+    counter = ErrorCounter()
+    kvs.logger.addHandler(counter)
+    try:
+        started = time.perf_counter()
+        for op, ns, key, value in ops:
+            errors = counter.count
+            t = time.perf_counter()
+            if op == "get":
+                # None is also returned for missing keys, so only logged errors are failures
+                ok = True
+                kvs.get(key, namespace=ns)
+            elif op == "set":
+                ok = kvs.set(key, value, namespace=ns)
+            elif op == "remove":
+                ok = kvs.remove(key, namespace=ns)
+            elif op == "keys":
+                ok = kvs.keys(namespace=ns) is not None
+            latencies.setdefault(op, []).append(time.perf_counter() - t)
+            if not ok or counter.count > errors:
+                failures[op] = failures.get(op, 0) + 1
+        elapsed = time.perf_counter() - started
+    finally:
+        kvs.logger.removeHandler(counter)
+    return report(latencies, elapsed, failures)
+
+def scan(kvs, generator, repeat=3):
+    """Read whole namespaces by get, keys and iter_items and measure them
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param generator: Workload generator
+    :type generator: WorkloadGenerator
+    :param repeat: Number of times to read each namespace
+    :type repeat: int
+    :return: Report with rows per second of each operation at p50
+    :rtype: dict
+    """
+    operations = {
+        "get_all": lambda ns: len(kvs.get(namespace=ns)),
+        "keys": lambda ns: len(kvs.keys(namespace=ns)),
+        "iter_items": lambda ns: sum(1 for _ in kvs.iter_items(namespace=ns, batch_size=kvs.fetch_size)),
+    }
+    latencies = {}
+    rows = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for n in range(generator.namespaces):
+            ns = "bench{}".format(n)
+            for op, func in operations.items():
+                t = time.perf_counter()
+                rows[op] = func(ns)
+                latencies.setdefault(op, []).append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    ret = report(latencies, elapsed)
+    ret["rows_per_sec"] = {op: rows[op] / (ret["latency_ms"][op]["p50"] / 1000) for op in operations}
+    return ret
+
+def report(latencies, elapsed, failures=None):
+    """Summarize latencies
+
+    :param latencies: Seconds of each call by operation
+    :type latencies: dict
+    :param elapsed: Seconds of whole run
+    :type elapsed: float
+    :param failures: Number of failed calls by operation
+    :type failures: dict
+    :return: Report. ops_per_sec counts only succeeded calls
+    :rtype: dict
+    """
+    failures = failures if failures else {}
+    operations = sum(len(v) for v in latencies.values())
+    ret = {
+        "operations": operations,
+        "failures": sum(failures.values()),
+        "elapsed": elapsed,
+        "ops_per_sec": (operations - sum(failures.values())) / elapsed if elapsed else None,
+        "latency_ms": {},
+        "peak_rss": peak_rss(),
+    }
+    for op, values in sorted(latencies.items()):
+        values = sorted(values)
+        ret["latency_ms"][op] = {
+            "count": len(values),
+            "failures": failures.get(op, 0),
+            "p50": percentile(values, 50) * 1000,
+            "p95": percentile(values, 95) * 1000,
+            "p99": percentile(values, 99) * 1000,
+            "max": values[-1] * 1000,
+        }
+    return ret
+
+def import_time(module="pycoki", repeat=5):
+    """Measure time to import module in new interpreters
+
+    :param module: Module to import
+    :type module: str
+    :param repeat: Number of interpreters to run. Median is reported
+    :type repeat: int
+    :return: Report
+    :rtype: dict
+    """
+    def median_seconds(code):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True)
+            times.append(time.perf_counter() - started)
+        return sorted(times)[len(times) // 2]
+
+    # Microseconds of each imported module by -X importtime
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], check=True, capture_output=True, text=True).stderr
+    modules = {}
+    for line in output.splitlines():
+        cols = line.split("|")
+        if len(cols) == 3 and cols[1].strip().isdigit():
+            modules[cols[2].strip()] = (int(cols[0].split(":")[1]), int(cols[1]))
+    baseline = median_seconds("pass")
+    return {
+        "module": module,
+        "wall_ms": (median_seconds("import " + module) - baseline) * 1000,
+        "cumulative_ms": modules[module][1] / 1000 if module in modules else None,
+        "imported_modules": len(modules),
+        "heaviest_ms": {name: t[0] / 1000 for name, t in sorted(modules.items(), key=lambda m: m[1][0], reverse=True)[:10]},
+        # Modules loaded on demand, which importing pycoki should not load
+        "optional_modules": sorted(m for m in ("pytz", "pickle", "zlib", "inspect", "MySQLdb", "psycopg2", "pyodbc", "orjson", "msgpack", "lz4") if m in modules),
+    }
+
+def parse_size(text):
+    """Parse size like 100, 10-1048576 or 1KB-1MB
+
+    :param text: Size or range of size
+    :type text: str
+    :return: Min and max bytes
+    :rtype: tuple
+    """
+    def to_bytes(t):
+        t = t.strip().upper()
+        for unit, scale in (("KB", 1024), ("MB", 1024 * 1024), ("B", 1)):
+            if t.endswith(unit):
+                return int(float(t[:-len(unit)]) * scale)
+        return int(t)
+    values = [to_bytes(t) for t in text.split("-")]
+    return (values[0], values[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pycoki-bench", description="Benchmark of Pycoki")
+    parser.add_argument("--kvsclass", default=None, help="Backend name (sqlite, tuned_sqlite, mysql, pgsql, sqldb, mmap) or dotted path of KeyValueStore class. SQLite by default")
+    parser.add_argument("--connection-str", default=None, help="Connection string. Temporary SQLite database by default")
+    parser.add_argument("--init-params", default=None, help="Comma separated parameters for init_table")
+    parser.add_argument("--table-name", default="pycoki_bench")
+    parser.add_argument("--workload", default="mixed", choices=sorted(WORKLOADS))
+    parser.add_argument("--operations", type=int, default=10000)
+    parser.add_argument("--keys", type=int, default=1000, help="Number of keys in each namespace")
+    parser.add_argument("--namespaces", type=int, default=1)
+    parser.add_argument("--distribution", default="uniform", choices=["uniform", "zipf"])
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--value-size", default="100", help="Bytes of values or range of them like 10-1MB")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-preload", action="store_true", help="Don't set values to all keys before running")
+    parser.add_argument("--output", default=None, help="File to write JSON report. stdout by default")
+    parser.add_argument("--import-time", action="store_true", help="Measure time to import pycoki instead of running workload")
+    parser.add_argument("--scan", action="store_true", help="Measure reading whole namespaces instead of running workload")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to read each namespace in --scan")
+    args = parser.parse_args(argv)
+    value_size = parse_size(args.value_size)
+    if value_size[0] < 1 or value_size[1] < value_size[0]:
+        parser.error("--value-size must be 1 or more and min must not exceed max")
+    if not args.import_time:
+        max_value_length = pycoki.pycoki.get_backend(args.kvsclass).max_value_length
+        # Values are serialized to JSON strings with quotes
+        if max_value_length is not None and value_size[1] + 2 > max_value_length:
+            parser.error("--value-size must not exceed {0} bytes on this backend. Values longer than max_value_length can't be set".format(max_value_length - 2))
+
+    if args.import_time:
+        ret = {"config": vars(args), "result": import_time()}
+        output(ret, args.output)
+        return ret
+
+    tempdir = None
+    connection_str = args.connection_str
+    if connection_str is None and args.kvsclass in (None, "sqlite", "tuned_sqlite"):
+        tempdir = tempfile.TemporaryDirectory()
+        connection_str = os.path.join(tempdir.name, "bench.db")
+    kvs = pycoki.start(
+        connection_str,
+        kvsclass=args.kvsclass,
+        table_name=args.table_name,
+        init_table=True,
+        init_params=tuple(args.init_params.split(",")) if args.init_params else tuple()
+    )
+    try:
+        generator = WorkloadGenerator(
+            keys=args.keys, namespaces=args.namespaces, distribution=args.distribution, zipf_s=args.zipf_s,
+            value_size=value_size, ratios=WORKLOADS[args.workload], seed=args.seed)
+        if not args.no_preload:
+            preload(kvs, generator, batch_size=kvs.batch_size if args.scan else 100)
+        ret = {"config": vars(args), "result": scan(kvs, generator, args.repeat) if args.scan else run(kvs, generator, args.operations)}
+    finally:
+        kvs.close()
+        if tempdir:
+            tempdir.cleanup()
+    output(ret, args.output)
+    return ret
+
+def output(report, path=None):
+    """Write report as JSON
+
+    :param report: Report
+    :type report: dict
+    :param path: File to write. stdout if None
+    :type path: str
+    """
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
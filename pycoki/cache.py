@@ -0,0 +1,553 @@
+"""Pycoki in-process read-through cache"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import sys
+import time
+import threading
+import traceback
+
+# Number of generation counters. Entries share a counter by hash of namespace and key
+GENERATION_SLOTS = 4096
+
+def estimate_size(value):
+    """Estimate memory size of value roughly
+
+    :param value: Value
+    :type value: object
+    :return: Bytes
+    :rtype: int
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k) + estimate_size(v)
+    elif isinstance(value, (list, tuple, set)):
+        for v in value:
+            size += estimate_size(v)
+    return size
+
+class CachedKeyValueStore:
+    def __init__(self, kvs, max_entries=10000, max_bytes=None, ttl=None, sizeof=None):
+        """Constractor of CachedKeyValueStore
+        Values read from the wrapped store are cached and shared with callers, so don't modify them.
+        Methods not cached (keys, close...) are delegated to the wrapped store.
+        Open transaction by this wrapper, not by the wrapped store, to invalidate entries written in it after commit.
+
+        :param kvs: KeyValueStore to wrap
+        :type kvs: KeyValueStore
+        :param max_entries: Max number of cached entries
+        :type max_entries: int
+        :param max_bytes: Max estimated bytes of cached values. None for no limit
+        :type max_bytes: int
+        :param ttl: Default seconds to keep entries. None for no expiration
+        :type ttl: float
+        :param sizeof: Function to estimate bytes of value
+        :type sizeof: function
+        """
+        self.kvs = kvs
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof if sizeof else estimate_size
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by writes to skip caching values read before them
+        self.generations = [0] * GENERATION_SLOTS
+        self.clears = 0
+        self.lock = threading.RLock()
+        # Writes in transaction of each thread. Entries are invalidated again after commit
+        self.transactions = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.kvs, name)
+
+    def get(self, key=None, namespace=None, connection=None, ttl=None):
+        """Get value by key or all values in namespace from cache or database
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection. Cache is not used when connection is given
+        :type connection: Connection
+        :param ttl: Seconds to keep the entry instead of default
+        :type ttl: float
+        :return: Value or all values in namespace
+        """
+        if connection:
+            return self.kvs.get(key=key, namespace=namespace, connection=connection)
+        ns = namespace if namespace else self.kvs.namespace
+        with self.lock:
+            found, value = self.lookup(ns, key)
+            generation = self.generation(ns, key)
+        if found:
+            return dict(value) if key is None else value
+        ret = self.kvs.get(key=key, namespace=ns)
+        if ret is not None and self.kvs.transaction_state is None:
+            with self.lock:
+                if self.generation(ns, key) == generation:
+                    self.store(ns, key, dict(ret) if key is None else ret, ttl)
+        return ret
+
+    def get_many(self, keys, namespace=None, connection=None, ttl=None):
+        """Get values by multiple keys from cache and database
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection. Cache is not used when connection is given
+        :type connection: Connection
+        :param ttl: Seconds to keep the entries instead of default
+        :type ttl: float
+        :return: Values by key. Keys not found are not included
+        :rtype: dict
+        """
+        if connection:
+            return self.kvs.get_many(keys, namespace=namespace, connection=connection)
+        ns = namespace if namespace else self.kvs.namespace
+        ret = {}
+        missing = {}
+        with self.lock:
+            for k in keys:
+                found, value = self.lookup(ns, k)
+                if found:
+                    if value is not None:
+                        ret[k] = value
+                else:
+                    missing[k] = self.generation(ns, k)
+        if missing:
+            values = self.kvs.get_many(list(missing), namespace=ns)
+            if values:
+                ret.update(values)
+                if self.kvs.transaction_state is None:
+                    with self.lock:
+                        for k, v in values.items():
+                            if v is not None and self.generation(ns, k) == missing.get(k):
+                                self.store(ns, k, v, ttl)
+        return ret
+
+    def set(self, key, value, namespace=None, connection=None, **kwargs):
+        """Set value with key and invalidate cache
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate(key, ns)
+        ret = self.kvs.set(key, value, namespace=ns, connection=connection, **kwargs)
+        self.invalidate(key, ns)
+        self.defer_invalidation([key], ns)
+        return ret
+
+    def set_many(self, values, namespace=None, connection=None, **kwargs):
+        """Set multiple values and invalidate cache
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate_many(values, ns)
+        ret = self.kvs.set_many(values, namespace=ns, connection=connection, **kwargs)
+        self.invalidate_many(values, ns)
+        self.defer_invalidation(list(values), ns)
+        return ret
+
+    def remove(self, key=None, namespace=None, connection=None):
+        """Remove value by key or all values in namespace and invalidate cache
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate(key, ns)
+        ret = self.kvs.remove(key=key, namespace=ns, connection=connection)
+        self.invalidate(key, ns)
+        self.defer_invalidation(None if key is None else [key], ns)
+        return ret
+
+    def remove_many(self, keys, namespace=None, connection=None):
+        """Remove values by multiple keys and invalidate cache
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        keys = list(keys)
+        self.invalidate_many(keys, ns)
+        ret = self.kvs.remove_many(keys, namespace=ns, connection=connection)
+        self.invalidate_many(keys, ns)
+        self.defer_invalidation(keys, ns)
+        return ret
+
+    def incr(self, key, delta=1, namespace=None, connection=None):
+        """Add delta to integer value and invalidate cache
+
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Value after added. None if error occured
+        :rtype: int
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate(key, ns)
+        ret = self.kvs.incr(key, delta=delta, namespace=ns, connection=connection)
+        self.invalidate(key, ns)
+        self.defer_invalidation([key], ns)
+        return ret
+
+    def compare_and_set(self, key, expected, value, namespace=None, connection=None, **kwargs):
+        """Set value only if the current value equals expected and invalidate cache. Values are compared in serialized form
+
+        :param key: Key
+        :type key: str
+        :param expected: Expected current value. None to set only if the key doesn't exist
+        :type expected: object
+        :param value: New value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: True if value is set
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate(key, ns)
+        ret = self.kvs.compare_and_set(key, expected, value, namespace=ns, connection=connection, **kwargs)
+        self.invalidate(key, ns)
+        self.defer_invalidation([key], ns)
+        return ret
+
+    def import_rows(self, rows, namespace=None, connection=None):
+        """Write serialized rows and invalidate all entries in namespace
+
+        :param rows: Tuples of key, serialized value and expiry
+        :type rows: iterable
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Number of rows written. None if failed
+        :rtype: int
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        self.invalidate(None, ns)
+        ret = self.kvs.import_rows(rows, namespace=ns, connection=connection)
+        self.invalidate(None, ns)
+        self.defer_invalidation(None, ns)
+        return ret
+
+    @contextmanager
+    def transaction(self, **kwargs):
+        """Defer commits of the wrapped store until the end of the block.
+        Entries written in the block are invalidated again after commit or rollback,
+        because other threads may cache values read before the writes are visible
+
+        :return: This instance
+        :rtype: CachedKeyValueStore
+        """
+        if getattr(self.transactions, "written", None) is not None:
+            with self.kvs.transaction(**kwargs):
+                yield self
+            return
+        self.transactions.written = []
+        try:
+            with self.kvs.transaction(**kwargs):
+                yield self
+        finally:
+            written = self.transactions.written
+            self.transactions.written = None
+            for ns, keys in written:
+                if keys is None:
+                    self.invalidate(None, ns)
+                else:
+                    self.invalidate_many(keys, ns)
+
+    def defer_invalidation(self, keys, namespace):
+        """Remember entries written in transaction to invalidate them after commit
+
+        :param keys: Keys. None for all entries in namespace
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        """
+        written = getattr(self.transactions, "written", None)
+        if written is not None:
+            written.append((namespace, keys))
+
+    def invalidate(self, key=None, namespace=None):
+        """Remove entry and namespace snapshot from cache.
+        All entries in namespace are removed when key is not given
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        with self.lock:
+            if key is None:
+                self.clears += 1
+                for k in [k for k in self.entries if k[0] == ns]:
+                    self.discard(k)
+            else:
+                self.bump(ns, key)
+                self.discard((ns, key))
+                self.discard((ns, None))
+            self.bump(ns, None)
+
+    def invalidate_many(self, keys, namespace=None):
+        """Remove entries and namespace snapshot from cache
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        with self.lock:
+            for k in keys:
+                self.bump(ns, k)
+                self.discard((ns, k))
+            self.bump(ns, None)
+            self.discard((ns, None))
+
+    def clear(self):
+        """Remove all entries from cache
+        """
+        with self.lock:
+            self.clears += 1
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Get statistics of cache
+
+        :return: Counters and current usage
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+    def generation(self, namespace, key):
+        """Get generation of entry to check that no write happened while reading it. Call with lock acquired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key. None for namespace snapshot
+        :type key: str
+        :return: Counter of entry and counter of clears
+        :rtype: tuple
+        """
+        return (self.generations[hash((namespace, key)) % GENERATION_SLOTS], self.clears)
+
+    def bump(self, namespace, key):
+        """Advance generation of entry. Call with lock acquired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key. None for namespace snapshot
+        :type key: str
+        """
+        self.generations[hash((namespace, key)) % GENERATION_SLOTS] += 1
+
+    def lookup(self, namespace, key):
+        """Find value in cache. Call with lock acquired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key. None for namespace snapshot
+        :type key: str
+        :return: Whether value is found and the value
+        :rtype: tuple
+        """
+        now = time.monotonic()
+        for cache_key in ((namespace, key), (namespace, None)) if key is not None else ((namespace, None), ):
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                continue
+            if entry[1] is not None and entry[1] <= now:
+                self.discard(cache_key)
+                continue
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            if cache_key[1] is None and key is not None:
+                return (True, entry[0].get(key))
+            return (True, entry[0])
+        self.misses += 1
+        return (False, None)
+
+    def store(self, namespace, key, value, ttl=None):
+        """Put value into cache and evict least recently used entries. Call with lock acquired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key. None for namespace snapshot
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param ttl: Seconds to keep the entry instead of default
+        :type ttl: float
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.discard((namespace, key))
+        self.entries[(namespace, key)] = (value, None if ttl is None else time.monotonic() + ttl, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry[2]
+            self.evictions += 1
+
+    def discard(self, cache_key):
+        """Remove entry from cache if exists. Call with lock acquired
+
+        :param cache_key: Tuple of namespace and key
+        :type cache_key: tuple
+        """
+        entry = self.entries.pop(cache_key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+class ChangePoller:
+    def __init__(self, cache, kvs, namespaces, interval=1.0, lag=1.0, refresh=False, full_refresh_interval=None):
+        """Constractor of ChangePoller
+        Poll keys updated by other processes and invalidate or refresh them in cache.
+        Removed keys are not detected by polling, so use ttl of cache or full_refresh_interval for them.
+
+        :param cache: Cache to update
+        :type cache: CachedKeyValueStore
+        :param kvs: KeyValueStore to poll changes. Use a dedicated one because polling runs in another thread
+        :type kvs: KeyValueStore
+        :param namespaces: Namespaces to watch
+        :type namespaces: list
+        :param interval: Seconds between polls
+        :type interval: float
+        :param lag: Seconds to look back for the clock skew between hosts and the timestamp precision of database
+        :type lag: float
+        :param refresh: Reload changed values instead of removing them from cache
+        :type refresh: bool
+        :param full_refresh_interval: Seconds to invalidate whole namespace periodically. None to skip
+        :type full_refresh_interval: float
+        """
+        self.cache = cache
+        self.kvs = kvs
+        self.namespaces = list(namespaces)
+        self.interval = interval
+        self.lag = lag
+        self.refresh = refresh
+        self.full_refresh_interval = full_refresh_interval
+        self.since = None
+        self.seen = {}
+        self.full_refreshed_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start polling in background thread
+        """
+        if self.thread is not None:
+            return
+        self.since = datetime.now(self.kvs.timezone)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="pycoki-change-poller", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop polling and wait for the thread
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Poll changes until stopped
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as ex:
+                self.kvs.logger.error("Error occured in polling changes: " + str(ex) + "\n" + traceback.format_exc())
+
+    def poll(self):
+        """Apply changes since the last poll to cache
+
+        :return: Number of changed keys
+        :rtype: int
+        """
+        polled_at = datetime.now(self.kvs.timezone)
+        since = (self.since if self.since else polled_at) - timedelta(seconds=self.lag)
+        if self.full_refresh_interval is not None and time.monotonic() - self.full_refreshed_at >= self.full_refresh_interval:
+            for ns in self.namespaces:
+                self.cache.invalidate(namespace=ns)
+            self.full_refreshed_at = time.monotonic()
+        count = 0
+        for ns in self.namespaces:
+            changed = []
+            for key, timestamp in self.kvs.changes(since, namespace=ns) or []:
+                if (ns, key, timestamp) not in self.seen:
+                    self.seen[(ns, key, timestamp)] = polled_at
+                    changed.append(key)
+            if changed:
+                with self.cache.lock:
+                    cached = [k for k in changed if (ns, k) in self.cache.entries]
+                self.cache.invalidate_many(changed, ns)
+                if self.refresh and cached:
+                    with self.cache.lock:
+                        generations = {k: self.cache.generation(ns, k) for k in cached}
+                    values = self.kvs.get_many(cached, namespace=ns) or {}
+                    with self.cache.lock:
+                        for k, v in values.items():
+                            if v is not None and self.cache.generation(ns, k) == generations.get(k):
+                                self.cache.store(ns, k, v)
+                count += len(changed)
+        expire = since - timedelta(seconds=self.interval)
+        self.seen = {k: v for k, v in self.seen.items() if v >= expire}
+        self.since = polled_at
+        return count
@@ -0,0 +1,148 @@
+"""Pycoki dump
+
+Export namespace to line-oriented JSON file and import it to any backend with constant memory.
+The first line is header and each of the following lines is [key, serialized value, expiry].
+
+    $ python -m pycoki.dump export --connection-str test.db --namespace users --file users.jsonl.gz
+    $ python -m pycoki.dump import --kvsclass pgsql --connection-str "postgresql://..." --file users.jsonl.gz
+"""
+
+from contextlib import nullcontext
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import traceback
+import pycoki
+
+FORMAT = "pycoki-dump"
+VERSION = 1
+
+def open_dump(path, mode, compress=None):
+    """Open dump file as text
+
+    :param path: Path of file. "-" for stdin or stdout
+    :type path: str
+    :param mode: "r" or "w"
+    :type mode: str
+    :param compress: Compress by gzip. None to decide by the extension .gz
+    :type compress: bool
+    :return: File object
+    :rtype: io.TextIOBase
+    """
+    if compress is None:
+        compress = str(path).endswith(".gz")
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        if not compress:
+            return nullcontext(stream)
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=stream.buffer, mode=mode + "b"), encoding="utf-8")
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def export_namespace(kvs, path, namespace=None, prefix=None, batch_size=1000, compress=None):
+    """Export values in namespace to dump file. Values are written as serialized in database.
+    File is written under temporary name and renamed when all values are written, so no partial dump is left when failed
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param path: Path of file. "-" for stdout
+    :type path: str
+    :param namespace: Namespace of Key-Value
+    :type namespace: str
+    :param prefix: Export only keys starting with prefix
+    :type prefix: str
+    :param batch_size: Number of rows fetched at once
+    :type batch_size: int
+    :param compress: Compress by gzip. None to decide by the extension .gz
+    :type compress: bool
+    :return: Number of rows exported. None if failed
+    :rtype: int
+    """
+    ns = namespace if namespace else kvs.namespace
+    if compress is None:
+        compress = str(path).endswith(".gz")
+    temp_path = path if path == "-" else path + ".tmp"
+    count = 0
+    completed = False
+    try:
+        with open_dump(temp_path, "w", compress) as f:
+            f.write(json.dumps({"format": FORMAT, "version": VERSION, "namespace": ns}) + "\n")
+            for row in kvs.iter_rows(True, ns, batch_size, prefix=prefix, with_expires=True):
+                f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+                count += 1
+        completed = True
+    except RuntimeError as ex:
+        kvs.logger.error("Error occured in exporting data: " + str(ex) + "\n" + traceback.format_exc())
+    finally:
+        if temp_path != path:
+            if completed:
+                os.replace(temp_path, path)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+    return count if completed else None
+
+def import_namespace(kvs, path, namespace=None, compress=None):
+    """Import values from dump file. Existing keys are overwritten
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param path: Path of file. "-" for stdin
+    :type path: str
+    :param namespace: Namespace to import into. None for the namespace in the dump
+    :type namespace: str
+    :param compress: Decompress by gzip. None to decide by the extension .gz
+    :type compress: bool
+    :return: Number of rows imported. None if failed
+    :rtype: int
+    """
+    with open_dump(path, "r", compress) as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != FORMAT:
+            raise ValueError("Not a pycoki dump: " + str(path))
+        if header.get("version", 0) > VERSION:
+            raise ValueError("Unsupported version of dump: " + str(header.get("version")))
+        rows = (json.loads(line) for line in f if line.strip())
+        return kvs.import_rows(rows, namespace=namespace if namespace else header["namespace"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pycoki-dump", description="Export and import namespace of Pycoki")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--kvsclass", default=None, help="Backend name (sqlite, tuned_sqlite, mysql, pgsql, sqldb, mmap) or dotted path of KeyValueStore class. SQLite by default")
+    parser.add_argument("--connection-str", required=True, help="Connection string")
+    parser.add_argument("--table-name", default=None)
+    parser.add_argument("--init-table", action="store_true", help="Create table before import if it doesn't exist")
+    parser.add_argument("--init-params", default=None, help="Comma separated parameters for init_table")
+    parser.add_argument("--namespace", default=None, help="Namespace to export, or to import into instead of the one in the dump")
+    parser.add_argument("--prefix", default=None, help="Export only keys starting with prefix")
+    parser.add_argument("--file", default="-", help="Dump file. Compressed by gzip if it ends with .gz. stdin or stdout by default")
+    parser.add_argument("--gzip", action="store_true", default=None, help="Compress or decompress by gzip regardless of the extension")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of rows fetched or written at once")
+    args = parser.parse_args(argv)
+
+    kvs = pycoki.start(
+        args.connection_str,
+        kvsclass=args.kvsclass,
+        table_name=args.table_name,
+        init_table=args.init_table and args.command == "import",
+        init_params=tuple(args.init_params.split(",")) if args.init_params else tuple()
+    )
+    try:
+        kvs.batch_size = args.batch_size
+        if args.command == "export":
+            count = export_namespace(kvs, args.file, args.namespace, args.prefix, args.batch_size, args.gzip)
+        else:
+            count = import_namespace(kvs, args.file, args.namespace, args.gzip)
+    finally:
+        kvs.close()
+    if count is None:
+        sys.stderr.write("Failed to {0}. See the log for details\n".format(args.command))
+        return 1
+    sys.stderr.write("{0}ed {1} rows\n".format(args.command.capitalize(), count))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Pycoki background sweeper of expired values"""
+
+import threading
+import traceback
+
+class ExpirySweeper:
+    def __init__(self, kvs, interval=60.0, batch_size=None, max_batches=None, pause=0.0):
+        """Constractor of ExpirySweeper
+        Remove expired values periodically in bounded batches.
+        Expired values are never returned by reads even if they are not removed yet.
+
+        :param kvs: KeyValueStore to sweep. Use a dedicated one because sweeping runs in another thread
+        :type kvs: KeyValueStore
+        :param interval: Seconds between sweeps
+        :type interval: float
+        :param batch_size: Max number of values removed by each batch. Default is sweep_batch_size of kvs
+        :type batch_size: int
+        :param max_batches: Max number of batches in each sweep. None to remove all expired values
+        :type max_batches: int
+        :param pause: Seconds to sleep between batches to let other writers in
+        :type pause: float
+        """
+        self.kvs = kvs
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause
+        self.removed = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start sweeping in background thread
+        """
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="pycoki-expiry-sweeper", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sweeping and wait for the thread
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Sweep expired values until stopped
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as ex:
+                self.kvs.logger.error("Error occured in sweeping expired data: " + str(ex) + "\n" + traceback.format_exc())
+
+    def sweep(self):
+        """Remove expired values now
+
+        :return: Number of removed values
+        :rtype: int
+        """
+        count = self.kvs.sweep_expired(batch_size=self.batch_size, max_batches=self.max_batches, pause=self.pause)
+        self.removed += count
+        return count
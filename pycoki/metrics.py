@@ -0,0 +1,217 @@
+"""Pycoki instrumentation and metrics
+
+Set an instance of Instrumentation (or StatsCollector) to KeyValueStore by start(instrumentation=...)
+to measure get, set, keys and remove split by phase (cursor, execute, fetch, decode, encode, commit).
+Nothing is measured when instrumentation is not set.
+"""
+
+from time import perf_counter
+import logging
+import threading
+
+# Upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class OperationTimer:
+    __slots__ = ("instrumentation", "operation", "backend", "namespace", "started", "last", "phases")
+
+    def __init__(self, instrumentation, operation, backend, namespace):
+        self.instrumentation = instrumentation
+        self.operation = operation
+        self.backend = backend
+        self.namespace = namespace
+        self.phases = {}
+        self.started = self.last = perf_counter()
+
+    def phase(self, name):
+        """Add the time since the last mark to the phase
+
+        :param name: Name of phase
+        :type name: str
+        """
+        now = perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def end(self, error=None):
+        """Finish measuring and notify the instrumentation
+
+        :param error: Exception occured in the operation
+        :type error: Exception
+        """
+        self.instrumentation.finish(self.operation, self.backend, self.namespace, self.phases, perf_counter() - self.started, error)
+
+class Instrumentation:
+    def __init__(self, slow_threshold=None, logger=None, callbacks=None):
+        """Constractor of Instrumentation
+
+        :param slow_threshold: Log operations slower than this seconds as warning. None to disable
+        :type slow_threshold: float
+        :param logger: Logger for slow operations
+        :type logger: logging.Logger
+        :param callbacks: Functions called with the same arguments as on_operation
+        :type callbacks: list
+        """
+        self.slow_threshold = slow_threshold
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.callbacks = list(callbacks) if callbacks else []
+
+    def begin(self, operation, backend, namespace):
+        """Start measuring operation
+
+        :param operation: Name of operation
+        :type operation: str
+        :param backend: Name of backend
+        :type backend: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Timer
+        :rtype: OperationTimer
+        """
+        return OperationTimer(self, operation, backend, namespace)
+
+    def finish(self, operation, backend, namespace, phases, elapsed, error):
+        """Called when operation finished
+
+        :param operation: Name of operation
+        :type operation: str
+        :param backend: Name of backend
+        :type backend: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param phases: Seconds by phase
+        :type phases: dict
+        :param elapsed: Seconds of whole operation
+        :type elapsed: float
+        :param error: Exception occured in the operation
+        :type error: Exception
+        """
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            self.logger.warning("Slow operation: {0} on {1} namespace={2} elapsed={3:.6f}s phases={4}".format(
+                operation, backend, namespace, elapsed, ", ".join("{0}={1:.6f}s".format(k, v) for k, v in phases.items())))
+        self.on_operation(operation, backend, namespace, phases, elapsed, error)
+        for callback in self.callbacks:
+            callback(operation, backend, namespace, phases, elapsed, error)
+
+    def on_operation(self, operation, backend, namespace, phases, elapsed, error):
+        """Override to handle measured operation
+        """
+        pass
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class StatsCollector(Instrumentation):
+    def __init__(self, slow_threshold=None, logger=None, callbacks=None, buckets=DEFAULT_BUCKETS):
+        """Constractor of StatsCollector
+        Collect counts and histograms of operations in memory
+
+        :param slow_threshold: Log operations slower than this seconds as warning. None to disable
+        :type slow_threshold: float
+        :param logger: Logger for slow operations
+        :type logger: logging.Logger
+        :param callbacks: Functions called with the same arguments as on_operation
+        :type callbacks: list
+        :param buckets: Upper bounds of histogram buckets in seconds
+        :type buckets: tuple
+        """
+        super().__init__(slow_threshold=slow_threshold, logger=logger, callbacks=callbacks)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.errors = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def on_operation(self, operation, backend, namespace, phases, elapsed, error):
+        labels = (operation, backend, namespace)
+        with self.lock:
+            self.counts[labels] = self.counts.get(labels, 0) + 1
+            if error is not None:
+                self.errors[labels] = self.errors.get(labels, 0) + 1
+            for phase, seconds in list(phases.items()) + [("total", elapsed)]:
+                histogram = self.histograms.get(labels + (phase, ))
+                if histogram is None:
+                    histogram = Histogram(self.buckets)
+                    self.histograms[labels + (phase, )] = histogram
+                histogram.observe(seconds)
+
+    def reset(self):
+        """Clear all collected stats
+        """
+        with self.lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """Get collected stats
+
+        :return: List of stats by operation, backend and namespace
+        :rtype: list
+        """
+        ret = []
+        with self.lock:
+            for labels, count in sorted(self.counts.items()):
+                phases = {}
+                for (op, backend, ns, phase), h in self.histograms.items():
+                    if (op, backend, ns) == labels:
+                        phases[phase] = {"count": h.count, "sum": h.sum, "avg": h.sum / h.count if h.count else 0.0}
+                ret.append({
+                    "operation": labels[0],
+                    "backend": labels[1],
+                    "namespace": labels[2],
+                    "count": count,
+                    "errors": self.errors.get(labels, 0),
+                    "phases": phases,
+                })
+        return ret
+
+    def to_prometheus(self, prefix="pycoki"):
+        """Export collected stats in Prometheus text format
+
+        :param prefix: Prefix of metric names
+        :type prefix: str
+        :return: Metrics text
+        :rtype: str
+        """
+        def label_text(labels, names, extra=""):
+            text = ",".join('{0}="{1}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for n, v in zip(names, labels))
+            return "{" + text + ("," + extra if extra else "") + "}"
+
+        names = ("operation", "backend", "namespace")
+        lines = [
+            "# HELP {0}_operations_total Number of operations".format(prefix),
+            "# TYPE {0}_operations_total counter".format(prefix),
+        ]
+        with self.lock:
+            for labels, count in sorted(self.counts.items()):
+                lines.append("{0}_operations_total{1} {2}".format(prefix, label_text(labels, names), count))
+            lines.append("# HELP {0}_operation_errors_total Number of failed operations".format(prefix))
+            lines.append("# TYPE {0}_operation_errors_total counter".format(prefix))
+            for labels, count in sorted(self.errors.items()):
+                lines.append("{0}_operation_errors_total{1} {2}".format(prefix, label_text(labels, names), count))
+            lines.append("# HELP {0}_operation_duration_seconds Duration of operations by phase".format(prefix))
+            lines.append("# TYPE {0}_operation_duration_seconds histogram".format(prefix))
+            for labels, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, c in zip(h.buckets, h.counts):
+                    cumulative += c
+                    lines.append("{0}_operation_duration_seconds_bucket{1} {2}".format(prefix, label_text(labels, names + ("phase", ), 'le="{0}"'.format(bound)), cumulative))
+                lines.append("{0}_operation_duration_seconds_bucket{1} {2}".format(prefix, label_text(labels, names + ("phase", ), 'le="+Inf"'), h.count))
+                lines.append("{0}_operation_duration_seconds_sum{1} {2}".format(prefix, label_text(labels, names + ("phase", )), h.sum))
+                lines.append("{0}_operation_duration_seconds_count{1} {2}".format(prefix, label_text(labels, names + ("phase", )), h.count))
+        return "\n".join(lines) + "\n"
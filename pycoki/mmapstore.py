@@ -0,0 +1,1283 @@
+"""Pycoki memory-mapped file implement
+
+Values are appended to a log file and looked up by in-process hash index over the memory-mapped file.
+One process writes the file and any number of processes on the host read it through the shared page cache.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import traceback
+from pycoki.pycoki import INTEGER_PATTERN, KeyValueStore, exclusive_write, read_chunks, split_chunks
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"PYCOKIM1"
+# Magic, committed length and flags
+FILE_HEADER = struct.Struct("<8sQQ")
+# Operation, length of namespace, key and value, expiry and timestamp
+RECORD_HEADER = struct.Struct("<BHHIdd")
+OP_SET = 0
+OP_REMOVE = 1
+# Flag set to the old file when it is replaced by compaction
+FLAG_STALE = 1
+NO_EXPIRY = float("nan")
+# Prefix of namespaces keeping binary values apart from values
+BLOB_PREFIX = "\x00blob:"
+# Max bytes of value in a record
+MAX_VALUE_SIZE = 0xFFFFFFFF
+# Writer connections shared in the process by process id and real path of data file
+writers = {}
+writers_lock = threading.Lock()
+
+class MmapConnection:
+    def __init__(self, path, readonly=False, sync=False):
+        """Constractor of MmapConnection
+        Connection-like object of data file. Changes are visible to readers after commit
+
+        :param path: Path of data file. Created if it doesn't exist unless readonly
+        :type path: str
+        :param readonly: Open as reader. Writers are limited to one process by lock file. Use open_writer() to share the writer in the process
+        :type readonly: bool
+        :param sync: fsync at every commit
+        :type sync: bool
+        :raises RuntimeError: Data file is locked by writer of another process
+        """
+        self.path = path
+        self.readonly = readonly
+        self.sync = sync
+        self.lock = threading.RLock()
+        self.lock_file = None
+        self.fd = None
+        self.map = None
+        self.closed = False
+        # Number of users of the connection shared by open_writer
+        self.references = 1
+        # Held by writes and transactions of all instances sharing the writer
+        self.write_lock = threading.RLock()
+        # Instance whose transaction is open
+        self.owner = None
+        try:
+            if not readonly:
+                self.lock_file = open(path + ".lock", "a")
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError as ex:
+                        raise RuntimeError("Data file is locked by the writer of another process: " + path + ". Add ?mode=ro to open it as reader") from ex
+                if not os.path.exists(path):
+                    with open(path, "wb") as f:
+                        f.write(FILE_HEADER.pack(MAGIC, FILE_HEADER.size, 0))
+            self.open()
+        except BaseException:
+            if self.fd is not None:
+                os.close(self.fd)
+            if self.lock_file is not None:
+                self.lock_file.close()
+            raise
+
+    def open(self):
+        """Open data file and build index from committed records
+        """
+        self.fd = os.open(self.path, os.O_RDONLY if self.readonly else os.O_RDWR)
+        self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        magic, committed, _ = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a pycoki data file: " + self.path)
+        if not self.readonly and os.fstat(self.fd).st_size > committed:
+            # Discard records not committed before the last writer stopped
+            self.map.close()
+            os.ftruncate(self.fd, committed)
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        # Entries of offset of record, offset and length of value, expiry and timestamp by key by namespace
+        self.index = {}
+        self.sorted_keys = {}
+        self.undo = []
+        self.garbage = 0
+        self.end = FILE_HEADER.size
+        self.committed = FILE_HEADER.size
+        self.load(committed)
+
+    def load(self, committed):
+        """Add records up to committed length to index
+
+        :param committed: Committed length of file
+        :type committed: int
+        """
+        if committed > len(self.map):
+            self.remap()
+        data = self.map
+        pos = self.end
+        while pos < committed:
+            op, nlen, klen, vlen, expires, timestamp = RECORD_HEADER.unpack_from(data, pos)
+            p = pos + RECORD_HEADER.size
+            ns = data[p:p + nlen].decode("utf-8")
+            key = data[p + nlen:p + nlen + klen].decode("utf-8")
+            entry = (pos, p + nlen + klen, vlen, None if expires != expires else expires, timestamp) if op == OP_SET else None
+            self.apply(ns, key, entry, p + nlen + klen + vlen - pos)
+            pos = p + nlen + klen + vlen
+        self.end = pos
+        self.committed = pos
+
+    def apply(self, namespace, key, entry, size):
+        """Update index by a record
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param entry: Entry of value. None for removal
+        :type entry: tuple
+        :param size: Bytes of record
+        :type size: int
+        :return: Previous entry
+        :rtype: tuple
+        """
+        entries = self.index.get(namespace)
+        if entries is None:
+            entries = self.index[namespace] = {}
+        previous = entries.get(key)
+        if previous is not None:
+            self.garbage += previous[1] + previous[2] - previous[0]
+            if entry is None:
+                del entries[key]
+                self.sorted_keys.pop(namespace, None)
+        elif entry is not None:
+            self.sorted_keys.pop(namespace, None)
+        if entry is None:
+            self.garbage += size
+            if not entries:
+                del self.index[namespace]
+        else:
+            entries[key] = entry
+        return previous
+
+    def remap(self):
+        """Map the whole file again after it grew
+        """
+        self.map.close()
+        self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def refresh(self):
+        """Pick up records committed by writer. Reopen file when it was replaced by compaction
+        """
+        if not self.readonly:
+            return
+        with self.lock:
+            _, committed, flags = FILE_HEADER.unpack_from(self.map, 0)
+            if flags & FLAG_STALE:
+                self.map.close()
+                os.close(self.fd)
+                self.open()
+            elif committed > self.committed:
+                self.load(committed)
+
+    def lookup(self, namespace, key, now):
+        """Get entry which is not expired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param now: Current time in seconds since epoch
+        :type now: float
+        :return: Entry. None if not found
+        :rtype: tuple
+        """
+        entries = self.index.get(namespace)
+        entry = entries.get(key) if entries else None
+        if entry is None or (entry[3] is not None and entry[3] <= now):
+            return None
+        return entry
+
+    def value(self, entry):
+        """Read serialized value of entry
+
+        :param entry: Entry
+        :type entry: tuple
+        :return: Serialized value
+        :rtype: str
+        """
+        if entry[1] + entry[2] > len(self.map):
+            self.remap()
+        return self.map[entry[1]:entry[1] + entry[2]].decode("utf-8")
+
+    def data(self, entry):
+        """Read binary value of entry
+
+        :param entry: Entry
+        :type entry: tuple
+        :return: Binary value
+        :rtype: bytes
+        """
+        if entry[1] + entry[2] > len(self.map):
+            self.remap()
+        return self.map[entry[1]:entry[1] + entry[2]]
+
+    def entries(self, namespace, now):
+        """Iterate entries which are not expired
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param now: Current time in seconds since epoch
+        :type now: float
+        :return: Tuples of key and entry
+        :rtype: generator
+        """
+        for key, entry in list(self.index.get(namespace, {}).items()):
+            if entry[3] is None or entry[3] > now:
+                yield (key, entry)
+
+    def keys_in_order(self, namespace):
+        """Get keys in namespace in order including expired ones
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Sorted keys
+        :rtype: list
+        """
+        keys = self.sorted_keys.get(namespace)
+        if keys is None:
+            keys = self.sorted_keys[namespace] = sorted(self.index.get(namespace, {}))
+        return keys
+
+    def append(self, records):
+        """Append records and update index. They are visible to readers after commit
+
+        :param records: Tuples of operation, namespace, key, serialized value or bytes, expiry and timestamp
+        :type records: iterable
+        """
+        if self.readonly:
+            raise PermissionError("Data file is opened as read only: " + self.path)
+        with self.lock:
+            buffer = bytearray()
+            applied = []
+            pos = self.end
+            for op, ns, key, value, expires, timestamp in records:
+                n = ns.encode("utf-8")
+                k = key.encode("utf-8")
+                v = (value.encode("utf-8") if isinstance(value, str) else bytes(value)) if op == OP_SET else b""
+                buffer += RECORD_HEADER.pack(op, len(n), len(k), len(v), NO_EXPIRY if expires is None else expires, timestamp)
+                buffer += n
+                buffer += k
+                size = RECORD_HEADER.size + len(n) + len(k) + len(v)
+                applied.append((ns, key, (pos, pos + size - len(v), len(v), expires, timestamp) if op == OP_SET else None, size))
+                buffer += v
+                pos += size
+            if not buffer:
+                return
+            os.lseek(self.fd, self.end, os.SEEK_SET)
+            os.write(self.fd, bytes(buffer))
+            if not self.undo:
+                self.undo.append((None, None, self.garbage))
+            for ns, key, entry, size in applied:
+                self.undo.append((ns, key, self.apply(ns, key, entry, size)))
+            self.end = pos
+
+    def commit(self):
+        """Make appended records visible by updating committed length in header
+        """
+        with self.lock:
+            if self.readonly or self.end == self.committed:
+                self.undo = []
+                return
+            if self.sync:
+                os.fsync(self.fd)
+            os.lseek(self.fd, 8, os.SEEK_SET)
+            os.write(self.fd, struct.pack("<Q", self.end))
+            if self.sync:
+                os.fsync(self.fd)
+            self.committed = self.end
+            self.undo = []
+
+    def rollback(self):
+        """Discard records appended after the last commit
+        """
+        with self.lock:
+            if not self.undo:
+                return
+            for ns, key, previous in reversed(self.undo[1:]):
+                entries = self.index.setdefault(ns, {})
+                if previous is None:
+                    entries.pop(key, None)
+                    if not entries:
+                        del self.index[ns]
+                else:
+                    entries[key] = previous
+                self.sorted_keys.pop(ns, None)
+            self.garbage = self.undo[0][2]
+            self.undo = []
+            self.map.close()
+            os.ftruncate(self.fd, self.committed)
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            self.end = self.committed
+
+    def stats(self):
+        """Get size of data file and garbage in it
+
+        :return: Bytes of file, bytes of garbage and number of keys
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "size": self.end,
+                "garbage": self.garbage,
+                "keys": sum(len(e) for e in self.index.values()),
+            }
+
+    def snapshot(self, path):
+        """Write committed values which are not expired to another data file. The file is replaced atomically
+
+        :param path: Path of snapshot
+        :type path: str
+        :return: Number of values
+        :rtype: int
+        """
+        with self.lock:
+            if self.undo:
+                raise RuntimeError("Commit or rollback before snapshot")
+            if self.end > len(self.map):
+                self.remap()
+            now = time.time()
+            count = 0
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, 0, 0))
+                for ns in list(self.index):
+                    for _, entry in self.entries(ns, now):
+                        # Records are copied as they are in the mapped file
+                        f.write(self.map[entry[0]:entry[1] + entry[2]])
+                        count += 1
+                committed = f.tell()
+                f.seek(0)
+                f.write(FILE_HEADER.pack(MAGIC, committed, 0))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            return count
+
+    def compact(self):
+        """Rewrite data file without garbage. Readers reopen the new file at the next refresh
+
+        :return: Number of values
+        :rtype: int
+        """
+        if self.readonly:
+            raise PermissionError("Data file is opened as read only: " + self.path)
+        with self.lock:
+            count = self.snapshot(self.path)
+            os.lseek(self.fd, 16, os.SEEK_SET)
+            os.write(self.fd, struct.pack("<Q", FLAG_STALE))
+            self.map.close()
+            os.close(self.fd)
+            self.open()
+            return count
+
+    def close(self):
+        """Discard uncommitted records and close file. Shared writer is closed when all users closed it
+        """
+        with writers_lock:
+            if self.closed or self.references <= 0:
+                return
+            self.references -= 1
+            if self.references > 0:
+                return
+            for k, conn in list(writers.items()):
+                if conn is self:
+                    del writers[k]
+        with self.lock:
+            self.rollback()
+            self.map.close()
+            os.close(self.fd)
+            if self.lock_file is not None:
+                self.lock_file.close()
+            self.closed = True
+
+def open_writer(path, sync=False):
+    """Open data file as writer. Connection is shared in the process so that threads and instances write the file together
+
+    :param path: Path of data file
+    :type path: str
+    :param sync: fsync at every commit. Applied when the file is opened first in the process
+    :type sync: bool
+    :return: Connection
+    :rtype: MmapConnection
+    """
+    key = (os.getpid(), os.path.realpath(path))
+    with writers_lock:
+        conn = writers.get(key)
+        if conn is not None and not conn.closed:
+            conn.references += 1
+            return conn
+        conn = MmapConnection(path, sync=sync)
+        writers[key] = conn
+        return conn
+
+
+class MmapKeyValueStore(KeyValueStore):
+    """Key-Value store on memory-mapped append-only file without SQL
+
+    Binary values are kept in the data file as one record each, apart from values of the same namespace.
+    MmapConnection is not a DB-API connection, so all methods of KeyValueStore that run SQL are overridden.
+    """
+    # Transactions of threads share the writer connection
+    serialize_writes = True
+    single_writer = True
+
+    @property
+    def write_lock(self):
+        """Write lock of the writer connection. Instances sharing the writer wait for transaction of each other
+        """
+        conn = self.connection
+        return None if conn is None or conn.readonly else conn.write_lock
+
+    @write_lock.setter
+    def write_lock(self, value):
+        # Lock of the connection is used instead
+        pass
+
+    @contextmanager
+    def transaction(self, flush_count=None, flush_interval=None):
+        """Defer commits of writes until the end of the block.
+        Other instances sharing the writer wait until it ends, and fail to write in the same thread
+
+        :param flush_count: Commit every N writes in the block
+        :type flush_count: int
+        :param flush_interval: Commit at the next write when the milliseconds passed since the last commit
+        :type flush_interval: int
+        :return: This instance
+        :rtype: MmapKeyValueStore
+        """
+        if self.transaction_state is not None:
+            yield self
+            return
+        lock = self.write_lock
+        if lock is None:
+            with super().transaction(flush_count, flush_interval):
+                yield self
+            return
+        with lock:
+            conn = self.connection
+            self.check_transaction(conn)
+            conn.owner = self
+            try:
+                with super().transaction(flush_count, flush_interval):
+                    yield self
+            finally:
+                conn.owner = None
+
+    def check_transaction(self, connection):
+        """Check that no other instance has transaction open on the writer
+
+        :param connection: Connection
+        :type connection: MmapConnection
+        :raises RuntimeError: Another instance has transaction open in this thread
+        """
+        if connection.owner is not None and connection.owner is not self:
+            raise RuntimeError("Data file is in transaction of another instance. Write by that instance or after the transaction")
+
+    def init_table(self, query_params=tuple(), connection=None, steps=None):
+        """Nothing to do. Data file is created when connected
+
+        :return: Result
+        :rtype: bool
+        """
+        return True
+
+    def upgrade_table(self, connection=None):
+        """Nothing to do. Data file has no columns to add
+
+        :return: False as nothing is upgraded
+        :rtype: bool
+        """
+        return False
+
+    def get(self, key=None, namespace=None, connection=None):
+        """Get value by key or all values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Value or all values in namespace
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            now = time.time()
+            with conn.lock:
+                if key:
+                    entry = conn.lookup(ns, key, now)
+                    if entry is None:
+                        return None
+                    value = conn.value(entry)
+                    try:
+                        return self.deserialize(value)
+                    except Exception as ex:
+                        self.decode_failed(key, ex)
+                        return None
+                return dict(self.decode_rows((k, conn.value(e)) for k, e in conn.entries(ns, now)))
+        except Exception as ex:
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+
+    def keys(self, namespace=None, connection=None, prefix=None, start=None, end=None, limit=None):
+        """Get all keys in namespace, or keys in range in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of keys
+        :type limit: int
+        :return: All keys in namespace
+        :rtype: list
+        """
+        if prefix or start is not None or end is not None or limit is not None:
+            return [k for k, _ in self.range_rows(False, namespace, prefix, start, end, limit, connection)]
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                return [k for k, _ in conn.entries(ns, time.time())]
+        except Exception as ex:
+            self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
+        return []
+
+    def scan(self, with_values, namespace=None, limit=1000, start=None, end=None, after=None, connection=None, with_expires=False):
+        """Get a page of rows in order of key
+
+        :param with_values: Get serialized values too
+        :type with_values: bool
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param limit: Max number of rows
+        :type limit: int
+        :param start: Keys greater than or equal to start
+        :type start: str
+        :param end: Keys less than end
+        :type end: str
+        :param after: Keys greater than after. Used instead of start for the next page
+        :type after: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :param with_expires: Get serialized values and expiry
+        :type with_expires: bool
+        :return: Tuples of key and serialized value (None if with_values is False), and expiry if with_expires is True
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        ret = []
+        try:
+            conn.refresh()
+            now = time.time()
+            with conn.lock:
+                keys = conn.keys_in_order(ns)
+                if after is not None:
+                    i = bisect.bisect_right(keys, after)
+                elif start is not None:
+                    i = bisect.bisect_left(keys, start)
+                else:
+                    i = 0
+                while i < len(keys) and len(ret) < limit:
+                    k = keys[i]
+                    i += 1
+                    if end is not None and k >= end:
+                        break
+                    entry = conn.lookup(ns, k, now)
+                    if entry is None:
+                        continue
+                    if with_expires:
+                        ret.append((k, conn.value(entry), entry[3]))
+                    else:
+                        ret.append((k, conn.value(entry) if with_values else None))
+        except Exception as ex:
+            self.logger.error("Error occured in scanning data in database: " + str(ex) + "\n" + traceback.format_exc())
+            return
+        return ret
+
+    def changes(self, since, namespace=None, connection=None):
+        """Get keys updated at or after the timestamp. Removed keys are not included
+
+        :param since: Timestamp
+        :type since: datetime
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Tuples of key and timestamp in order of timestamp
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            since_ts = since.timestamp()
+            with conn.lock:
+                rows = sorted((e[4], k) for k, e in conn.index.get(ns, {}).items() if e[4] >= since_ts)
+            return [(k, datetime.fromtimestamp(ts, self.timezone)) for ts, k in rows]
+        except Exception as ex:
+            self.logger.error("Error occured in getting changes from database: " + str(ex) + "\n" + traceback.format_exc())
+        return []
+
+    def namespaces(self, connection=None):
+        """Get all namespaces that have values
+
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Namespaces
+        :rtype: list
+        """
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                return [ns for ns in conn.index if not ns.startswith(BLOB_PREFIX)]
+        except Exception as ex:
+            self.logger.error("Error occured in getting namespaces from database: " + str(ex) + "\n" + traceback.format_exc())
+        return []
+
+    def key_boundaries(self, parts, namespace=None, connection=None):
+        """Get keys that split namespace into parts of about the same number of keys
+
+        :param parts: Number of parts
+        :type parts: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Sorted keys at the start of each part except the first one. Fewer if namespace is small
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                keys = conn.keys_in_order(ns)
+                return sorted(set(keys[len(keys) * i // parts] for i in range(1, parts) if len(keys) * i // parts < len(keys)))
+        except Exception as ex:
+            self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
+
+    def get_many(self, keys, namespace=None, connection=None):
+        """Get values by multiple keys at once
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Values by key. Keys not found are not included
+        :rtype: dict
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        ret = {}
+        try:
+            conn.refresh()
+            now = time.time()
+            with conn.lock:
+                for k in keys:
+                    entry = conn.lookup(ns, k, now)
+                    if entry is not None:
+                        try:
+                            ret[k] = self.deserialize(conn.value(entry))
+                        except Exception as ex:
+                            self.decode_failed(k, ex)
+        except Exception as ex:
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+        return ret
+
+    @exclusive_write
+    def set(self, key, value, namespace=None, connection=None, ttl=None):
+        """Set value with key
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :param ttl: Seconds until the value expires. None to keep it forever
+        :type ttl: float
+        :return: Result
+        :rtype: bool
+        """
+        return self.set_many({key: value}, namespace=namespace, connection=connection, ttl=ttl)
+
+    @exclusive_write
+    def set_many(self, values, namespace=None, connection=None, ttl=None):
+        """Set multiple values and commit once
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :param ttl: Seconds until the values expire. None to keep them forever
+        :type ttl: float
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            expires = self.expires_at(ttl)
+            conn.append((OP_SET, ns, k, self.serialize(v), expires, now) for k, v in values.items())
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
+            self.rollback(conn)
+        return False
+
+    @exclusive_write
+    def import_rows(self, rows, namespace=None, connection=None):
+        """Write serialized rows in batches and commit once. Existing keys are overwritten
+
+        :param rows: Tuples of key, serialized value and expiry
+        :type rows: iterable
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Number of rows written. None if failed
+        :rtype: int
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        count = 0
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            for chunk in split_chunks(rows, self.batch_size):
+                conn.append((OP_SET, ns, k, v, e, now) for k, v, e in chunk)
+                count += len(chunk)
+            self.commit(conn)
+            return count
+        except Exception as ex:
+            self.logger.error("Error occured in importing data: " + str(ex) + "\n" + traceback.format_exc())
+            self.rollback(conn)
+
+    @exclusive_write
+    def remove(self, key=None, namespace=None, connection=None):
+        """Remove value by key or all values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        with conn.lock:
+            keys = [key] if key else list(conn.index.get(ns, {}))
+            return self.remove_many(keys, namespace=ns, connection=conn)
+
+    @exclusive_write
+    def remove_many(self, keys, namespace=None, connection=None):
+        """Remove values by multiple keys and commit once
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            with conn.lock:
+                entries = conn.index.get(ns, {})
+                conn.append((OP_REMOVE, ns, k, None, None, now) for k in dict.fromkeys(keys) if k in entries)
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in removing data: " + str(ex) + "\n" + traceback.format_exc())
+            self.rollback(conn)
+        return False
+
+    @exclusive_write
+    def incr(self, key, delta=1, namespace=None, connection=None):
+        """Add delta to integer value. Missing or expired value is counted from 0.
+        Value that is not an integer is kept as it is
+
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Value after added. None if the value is not an integer or failed
+        :rtype: int
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            with conn.lock:
+                entry = conn.lookup(ns, key, now)
+                current = (conn.value(entry) or "0") if entry is not None else "0"
+                if not INTEGER_PATTERN.fullmatch(current):
+                    self.logger.warning("Value is not an integer: " + str(key))
+                    return
+                value = int(current) + int(delta)
+                conn.append([(OP_SET, ns, key, str(value), entry[3] if entry is not None else None, now)])
+            self.commit(conn)
+            return value
+        except Exception as ex:
+            self.logger.error("Error occured in incrementing data: " + str(ex) + "\n" + traceback.format_exc())
+
+    @exclusive_write
+    def compare_and_set(self, key, expected, value, namespace=None, connection=None, ttl=None):
+        """Set value only if the current value equals expected
+
+        :param key: Key
+        :type key: str
+        :param expected: Expected current value. None to set only if key doesn't exist
+        :type expected: object
+        :param value: New value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :param ttl: Seconds until the value expires. None to keep it forever
+        :type ttl: float
+        :return: True if set
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            serialized_value = self.serialize(value)
+            with conn.lock:
+                entry = conn.lookup(ns, key, now)
+                if expected is None:
+                    if entry is not None:
+                        return False
+                elif entry is None or conn.value(entry) != self.serialize(expected):
+                    return False
+                conn.append([(OP_SET, ns, key, serialized_value, self.expires_at(ttl), now)])
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in comparing and setting data: " + str(ex) + "\n" + traceback.format_exc())
+        return False
+
+    @exclusive_write
+    def remove_expired(self, batch_size=None, connection=None):
+        """Remove expired values up to batch_size and commit
+
+        :param batch_size: Max number of values removed. Default is sweep_batch_size
+        :type batch_size: int
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Number of removed values. None if failed
+        :rtype: int
+        """
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            self.check_transaction(conn)
+            size = int(batch_size if batch_size else self.sweep_batch_size)
+            now = time.time()
+            with conn.lock:
+                expired = []
+                for ns, entries in conn.index.items():
+                    for k, e in entries.items():
+                        if e[3] is not None and e[3] <= now:
+                            expired.append((OP_REMOVE, ns, k, None, None, now))
+                            if len(expired) >= size:
+                                break
+                    if len(expired) >= size:
+                        break
+                conn.append(expired)
+            self.commit(conn)
+            return len(expired)
+        except Exception as ex:
+            self.logger.error("Error occured in removing expired data: " + str(ex) + "\n" + traceback.format_exc())
+
+    def compact(self, connection=None):
+        """Rewrite data file without removed, overwritten and expired values
+
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Number of values in the new file. None if failed
+        :rtype: int
+        """
+        conn = connection if connection else self.connection
+        try:
+            return conn.compact()
+        except Exception as ex:
+            self.logger.error("Error occured in compacting data file: " + str(ex) + "\n" + traceback.format_exc())
+
+    def snapshot(self, path, connection=None):
+        """Write committed values to another data file, which can be opened like start(path + "?mode=ro", kvsclass="mmap")
+
+        :param path: Path of snapshot
+        :type path: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Number of values. None if failed
+        :rtype: int
+        """
+        conn = connection if connection else self.connection
+        try:
+            conn.refresh()
+            return conn.snapshot(path)
+        except Exception as ex:
+            self.logger.error("Error occured in writing snapshot: " + str(ex) + "\n" + traceback.format_exc())
+
+    def init_blob_table(self, query_params=tuple(), connection=None):
+        """Nothing to do. Binary values are kept in the data file
+
+        :return: Result
+        :rtype: bool
+        """
+        return True
+
+    def get_blob(self, key, namespace=None, connection=None):
+        """Get binary value by key
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Binary value. None if not found
+        :rtype: bytes
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                entry = conn.lookup(BLOB_PREFIX + ns, key, time.time())
+                return None if entry is None else conn.data(entry)
+        except Exception as ex:
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+
+    def iter_blob(self, key, namespace=None, connection=None):
+        """Iterate chunks of binary value by key. Value is read from the mapped file as a whole
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Chunks of binary value. Nothing if not found
+        :rtype: generator
+        :raises RuntimeError: Failed to read the value
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                entry = conn.lookup(BLOB_PREFIX + ns, key, time.time())
+                data = None if entry is None else conn.data(entry)
+        except Exception as ex:
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+            raise RuntimeError("Failed to read binary value " + str(key)) from ex
+        if data is None:
+            return
+        view = memoryview(data)
+        for i in range(0, len(view), self.blob_chunk_size):
+            yield view[i:i + self.blob_chunk_size]
+
+    def blob_keys(self, namespace=None, connection=None):
+        """Get all keys of binary values in namespace
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: All keys of binary values in namespace
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        try:
+            conn.refresh()
+            with conn.lock:
+                return [k for k, _ in conn.entries(BLOB_PREFIX + ns, time.time())]
+        except Exception as ex:
+            self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
+        return []
+
+    @exclusive_write
+    def set_blob(self, key, data, namespace=None, connection=None):
+        """Set binary value with key. Value is written in one record up to 4GB
+
+        :param key: Key
+        :type key: str
+        :param data: Binary value or file-like object opened in binary mode to read it
+        :type data: bytes
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        try:
+            self.check_transaction(conn)
+            if hasattr(data, "read"):
+                data = b"".join(read_chunks(data, self.blob_chunk_size))
+            data = memoryview(data).cast("B")
+            if len(data) > MAX_VALUE_SIZE:
+                raise ValueError("Binary value is larger than 4GB")
+            conn.append([(OP_SET, BLOB_PREFIX + ns, key, data, None, time.time())])
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
+        return False
+
+    @exclusive_write
+    def remove_blob(self, key=None, namespace=None, connection=None):
+        """Remove binary value by key or all binary values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        try:
+            self.check_transaction(conn)
+            now = time.time()
+            with conn.lock:
+                entries = conn.index.get(BLOB_PREFIX + ns, {})
+                keys = [key] if key else list(entries)
+                conn.append((OP_REMOVE, BLOB_PREFIX + ns, k, None, None, now) for k in keys if k in entries)
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in removing data: " + str(ex) + "\n" + traceback.format_exc())
+        return False
+
+    @staticmethod
+    def get_connection(connection_str):
+        """Get connection by given connection string
+
+        :param connection_str: Path of data file. Add ?mode=ro to open as reader
+        :type connection_str: str
+        :return: Connection
+        :rtype: MmapConnection
+        """
+        path, _, query = connection_str.partition("?")
+        options = dict(o.split("=", 1) for o in query.split("&") if "=" in o)
+        if options.get("mode") == "ro":
+            return MmapConnection(path, readonly=True)
+        return open_writer(path, sync=options.get("sync") == "1")
+
+    @staticmethod
+    def get_reader_connection_str(connection_str):
+        """Get connection string to open the data file as reader
+
+        :param connection_str: Path of data file with options
+        :type connection_str: str
+        :return: Connection string with ?mode=ro
+        :rtype: str
+        """
+        path, _, query = connection_str.partition("?")
+        options = [o for o in query.split("&") if o and not o.startswith("mode=") and not o.startswith("sync=")]
+        return path + "?" + "&".join(["mode=ro"] + options)
+
+    @staticmethod
+    def check_connection(connection):
+        """Check if connection is alive
+
+        :param connection: Connection
+        :type connection: MmapConnection
+        :return: True if connection is alive
+        :rtype: bool
+        """
+        return not connection.closed
+
+    @staticmethod
+    def get_sqls(table_name):
+        """No SQL is used. Each data file has one table
+
+        :param table_name: Key-Value store table
+        :type table_name: str
+        :return: Empty dictionary
+        :rtype: dict
+        """
+        return {}
+
+
+class Compactor:
+    def __init__(self, kvs, interval=60.0, garbage_ratio=0.5, min_garbage=1024 * 1024, snapshot_path=None):
+        """Constractor of Compactor
+        Compact data file periodically when garbage exceeds the ratio, and write snapshot if snapshot_path is given
+
+        :param kvs: MmapKeyValueStore opened as writer
+        :type kvs: MmapKeyValueStore
+        :param interval: Seconds between checks
+        :type interval: float
+        :param garbage_ratio: Compact when this ratio of the file is garbage
+        :type garbage_ratio: float
+        :param min_garbage: Don't compact until garbage exceeds this bytes
+        :type min_garbage: int
+        :param snapshot_path: Path to write snapshot after each check
+        :type snapshot_path: str
+        """
+        self.kvs = kvs
+        self.interval = interval
+        self.garbage_ratio = garbage_ratio
+        self.min_garbage = min_garbage
+        self.snapshot_path = snapshot_path
+        self.compactions = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start compaction in background thread
+        """
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="pycoki-mmap-compactor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop compaction and wait for the thread
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Check and compact data file until stopped
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as ex:
+                self.kvs.logger.error("Error occured in compacting data file: " + str(ex) + "\n" + traceback.format_exc())
+
+    def check(self):
+        """Compact data file now if garbage exceeds the ratio
+
+        :return: True if compacted
+        :rtype: bool
+        """
+        conn = self.kvs.connection
+        with conn.lock:
+            if conn.undo:
+                # Don't interrupt transaction
+                return False
+            stats = conn.stats()
+            compacted = stats["garbage"] >= self.min_garbage and stats["garbage"] >= stats["size"] * self.garbage_ratio
+            if compacted and self.kvs.compact() is not None:
+                self.compactions += 1
+            if self.snapshot_path:
+                self.kvs.snapshot(self.snapshot_path)
+        return compacted
@@ -2,9 +2,12 @@
 
 from pycoki import KeyValueStore
 import MySQLdb
-from MySQLdb.cursors import DictCursor
 
 class MySQLKeyValueStore(KeyValueStore):
+    param_marker = "%s"
+    max_params = 10000
+    max_value_length = 4000
+
     @staticmethod
     def get_connection(connection_str):
         """Get connection by given connection string
@@ -15,7 +18,7 @@ class MySQLKeyValueStore(KeyValueStore):
         :rtype: Connection
         """
         connection_str = connection_str if connection_str else "host=localhost;user=root;passwd=;db=pycokidb;charset=utf8;"
-        connection_info = {"cursorclass": DictCursor, "charset": "utf8"}
+        connection_info = {"charset": "utf8"}
         param_values = connection_str.split(";")
         for pv in param_values:
             if "=" in pv:
@@ -23,6 +26,25 @@ class MySQLKeyValueStore(KeyValueStore):
                 connection_info[p] = v
         return MySQLdb.connect(**connection_info)
 
+    @staticmethod
+    def edit_incr_params(namespace, key, delta, timestamp, now):
+        """Edit SQL params of incr. Each assignment checks the value because update has no where clause
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param timestamp: Timestamp edited by edit_timestamp
+        :type timestamp: object
+        :param now: Current time in seconds since epoch
+        :type now: float
+        :return: params
+        :rtype: tuple
+        """
+        return (namespace, key, str(delta), timestamp, now, now, now, delta, now, now)
+
     @staticmethod
     def get_sqls(table_name):
         """Get dictionary of SQLs called in methods of KeyValueStore
@@ -34,11 +56,46 @@ class MySQLKeyValueStore(KeyValueStore):
         """
         return {
             "prepare_check": "select * from information_schema.TABLES where TABLE_NAME='{0}' and TABLE_SCHEMA=%s".format(table_name),
-            "prepare_create": "create table {0} (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_value VARCHAR(4000), kv_timestamp DATETIME, primary key(kv_namespace, kv_key))".format(table_name),
-            "get": "select kv_value from {0} where kv_namespace=%s and kv_key=%s".format(table_name),
-            "get_all": "select kv_key, kv_value from {0} where kv_namespace=%s".format(table_name),
-            "keys": "select kv_key from {0} where kv_namespace=%s".format(table_name),
-            "set": "replace into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (%s,%s,%s,%s)".format(table_name),
+            "prepare_create": "create table {0} (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_value VARCHAR(4000), kv_timestamp DATETIME, kv_expires DOUBLE, primary key(kv_namespace, kv_key))".format(table_name),
+            "prepare_check_index": "select * from information_schema.STATISTICS where TABLE_NAME='{0}' and INDEX_NAME='{0}_ts_idx' and TABLE_SCHEMA=%s".format(table_name),
+            "prepare_create_index": "create index {0}_ts_idx on {0} (kv_namespace, kv_timestamp)".format(table_name),
+            "prepare_check_expires": "select * from information_schema.COLUMNS where TABLE_NAME='{0}' and COLUMN_NAME='kv_expires' and TABLE_SCHEMA=%s".format(table_name),
+            "prepare_alter_expires": "alter table {0} add column kv_expires DOUBLE".format(table_name),
+            "prepare_check_expires_index": "select * from information_schema.STATISTICS where TABLE_NAME='{0}' and INDEX_NAME='{0}_exp_idx' and TABLE_SCHEMA=%s".format(table_name),
+            "prepare_create_expires_index": "create index {0}_exp_idx on {0} (kv_expires)".format(table_name),
+            "probe_table": "select kv_key from {0} where 1=0".format(table_name),
+            "probe_expires": "select kv_expires from {0} where 1=0".format(table_name),
+            "get": "select kv_value from {0} where kv_namespace=%s and kv_key=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "get_all": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "keys": "select kv_key from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "changes": "select kv_key, kv_timestamp from {0} where kv_namespace=%s and kv_timestamp>=%s order by kv_timestamp".format(table_name),
+            "namespaces": "select distinct kv_namespace from {0}".format(table_name),
+            "scan_keys": "select kv_key from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_items": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_rows": "select kv_key, kv_value, kv_expires from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "count": "select count(*) as kv_count from {0} where kv_namespace=%s".format(table_name),
+            "key_at": "select kv_key from {0} where kv_namespace=%s order by kv_key limit 1 offset %s".format(table_name),
+            "get_many": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) and kv_key in ({{0}})".format(table_name),
+            "set": "replace into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (%s,%s,%s,%s,%s)".format(table_name),
             "remove": "delete from {0} where kv_namespace=%s and kv_key=%s".format(table_name),
+            "remove_many": "delete from {0} where kv_namespace=%s and kv_key in ({{0}})".format(table_name),
             "remove_all": "delete from {0} where kv_namespace=%s".format(table_name),
+            "remove_expired": "delete from {0} where kv_expires<=%s limit {{0}}".format(table_name),
+            "remove_expired_key": "delete from {0} where kv_namespace=%s and kv_key=%s and kv_expires<=%s".format(table_name),
+            "insert_new": "insert ignore into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (%s,%s,%s,%s,%s)".format(table_name),
+            "compare_and_set": "update {0} set kv_value=%s, kv_timestamp=%s, kv_expires=%s where kv_namespace=%s and kv_key=%s and kv_value=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "incr": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (%s,%s,%s,%s)
+                    on duplicate key update
+                    kv_timestamp=if(kv_expires<=%s or kv_value='' or kv_value regexp '^-?[0-9]+$', values(kv_timestamp), kv_timestamp),
+                    kv_value=if(kv_expires<=%s or kv_value='' or kv_value regexp '^-?[0-9]+$', cast(case when kv_expires<=%s then 0 else cast(coalesce(nullif(kv_value, ''), '0') as signed) end + %s as char), kv_value),
+                    kv_expires=if(kv_expires<=%s or kv_value regexp '^-?[0-9]+$', case when kv_expires<=%s then null else kv_expires end, kv_expires)""".format(table_name),
+            "incr_get": "select kv_value from {0} where kv_namespace=%s and kv_key=%s".format(table_name),
+            "prepare_check_blob": "select * from information_schema.TABLES where TABLE_NAME='{0}_blob' and TABLE_SCHEMA=%s".format(table_name),
+            "prepare_create_blob": "create table {0}_blob (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_chunk INT, kv_data LONGBLOB, kv_timestamp DATETIME, primary key(kv_namespace, kv_key, kv_chunk))".format(table_name),
+            "blob_get": "select kv_data from {0}_blob where kv_namespace=%s and kv_key=%s order by kv_chunk".format(table_name),
+            "blob_get_chunk": "select kv_data from {0}_blob where kv_namespace=%s and kv_key=%s and kv_chunk=%s".format(table_name),
+            "blob_keys": "select kv_key from {0}_blob where kv_namespace=%s and kv_chunk=0".format(table_name),
+            "blob_set": "insert into {0}_blob (kv_namespace, kv_key, kv_chunk, kv_data, kv_timestamp) values (%s,%s,%s,%s,%s)".format(table_name),
+            "blob_remove": "delete from {0}_blob where kv_namespace=%s and kv_key=%s".format(table_name),
+            "blob_remove_all": "delete from {0}_blob where kv_namespace=%s".format(table_name),
         }
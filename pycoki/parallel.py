@@ -0,0 +1,151 @@
+"""Pycoki parallel operations
+
+Split namespace into ranges of key and process them in worker processes, each with its own connection.
+Workers open the store as reader. Results of single writer backends are written back by the parent process.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pycoki
+from pycoki.pycoki import DEFAULT_CONNECTION_STR, get_backend
+
+def key_ranges(kvs, parts, namespace=None):
+    """Split namespace into ranges of key with about the same number of keys
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param parts: Number of ranges
+    :type parts: int
+    :param namespace: Namespace of Key-Value
+    :type namespace: str
+    :return: Tuples of start and end of key. None for unbounded
+    :rtype: list
+    """
+    boundaries = kvs.key_boundaries(parts, namespace=namespace)
+    if boundaries is None:
+        raise RuntimeError("Failed to split namespace " + str(namespace))
+    edges = [None] + boundaries + [None]
+    return [(edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+
+def map_range(task):
+    """Apply function to values in a range of key. Runs in worker process
+
+    :param task: Tuple of start, end, function, write_back, write_in_worker, batch_size, namespace and options of start()
+    :type task: tuple
+    :return: Results by key, tuples of serialized result and expiry by key if write_back is True and write_in_worker is False, or number of values written
+    :raises RuntimeError: Failed to scan the range. Results of the range written before it are kept
+    """
+    start, end, fn, write_back, write_in_worker, batch_size, namespace, options = task
+    kvs = pycoki.start(**options)
+    try:
+        results = {}
+        written = 0
+        rows = kvs.iter_rows(True, namespace, batch_size, start=start, end=end, with_expires=True)
+        while True:
+            try:
+                key, value, expires = next(rows)
+            except StopIteration:
+                break
+            except RuntimeError as ex:
+                raise RuntimeError("Failed to scan range from {0} to {1} of namespace {2}: {3}".format(start, end, namespace, ex)) from ex
+            result = fn(key, kvs.deserialize(value))
+            if result is None:
+                continue
+            if not write_back:
+                results[key] = result
+                continue
+            # Expiry of the original value is kept
+            results[key] = (kvs.serialize(result), expires)
+            if write_in_worker and len(results) >= batch_size:
+                written += write_results(kvs, results, namespace)
+                results = {}
+        if write_in_worker:
+            written += write_results(kvs, results, namespace)
+            return written
+        return results
+    finally:
+        kvs.close()
+
+def write_results(kvs, results, namespace):
+    """Write serialized results back
+
+    :param kvs: KeyValueStore
+    :type kvs: KeyValueStore
+    :param results: Tuples of serialized value and expiry by key
+    :type results: dict
+    :param namespace: Namespace of Key-Value
+    :type namespace: str
+    :return: Number of values written
+    :rtype: int
+    """
+    if not results:
+        return 0
+    count = kvs.import_rows(((k, v, e) for k, (v, e) in results.items()), namespace=namespace)
+    if count is None:
+        raise RuntimeError("Failed to write results back to " + str(namespace))
+    return count
+
+def parallel_map(namespace, fn, workers=None, connection_str=None, kvsclass=None, table_name=None, write_back=False, batch_size=1000, serializer=None, compression=None, compress_threshold=1024, mp_context=None, allow_pickle=False):
+    """Apply function to all values in namespace in worker processes
+    Namespace is split into ranges of key by the number of workers and each worker scans its range with its own connection
+
+    :param namespace: Namespace of Key-Value
+    :type namespace: str
+    :param fn: Function called with key and value. Return None to skip the key. It must be picklable (defined at top level of module)
+    :type fn: function
+    :param workers: Number of worker processes. Default is the number of CPUs
+    :type workers: int
+    :param connection_str: Connection string
+    :type connection_str: str
+    :param kvsclass: Name of backend, dotted path or class. None for SQLite
+    :type kvsclass: str
+    :param table_name: Key-Value store table
+    :type table_name: str
+    :param write_back: Set results as new values instead of returning them. Expiry of values is kept. Workers write them, or the parent process does on single writer backends
+    :type write_back: bool
+    :param batch_size: Number of values fetched or written at once
+    :type batch_size: int
+    :param serializer: Serializer name or instance to write results back. None for JSON
+    :type serializer: str
+    :param compression: Compression name or instance to write results back
+    :type compression: str
+    :param compress_threshold: Compress only values larger than this bytes
+    :type compress_threshold: int
+    :param mp_context: Multiprocessing context for ProcessPoolExecutor
+    :type mp_context: multiprocessing.context.BaseContext
+    :param allow_pickle: Allow pickle serializer
+    :type allow_pickle: bool
+    :return: Results by key, or number of values written if write_back is True
+    :rtype: dict
+    """
+    workers = workers if workers else os.cpu_count() or 1
+    cls = get_backend(kvsclass)
+    connection_str = connection_str if connection_str else DEFAULT_CONNECTION_STR
+    write_in_worker = write_back and not cls.single_writer
+    options = {
+        "connection_str": connection_str if write_in_worker else cls.get_reader_connection_str(connection_str),
+        "namespace": namespace,
+        "table_name": table_name,
+        "kvsclass": cls,
+        "serializer": serializer,
+        "compression": compression,
+        "compress_threshold": compress_threshold,
+        "allow_pickle": allow_pickle,
+    }
+    # Writer of single writer backend stays in the parent process to write results of workers
+    kvs = pycoki.start(**dict(options, connection_str=connection_str)) if write_back and not write_in_worker else pycoki.start(**options)
+    try:
+        ranges = key_ranges(kvs, workers, namespace)
+        tasks = [(start, end, fn, write_back, write_in_worker, batch_size, namespace, options) for start, end in ranges]
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=mp_context) as executor:
+            outputs = executor.map(map_range, tasks)
+            if write_in_worker:
+                return sum(outputs)
+            if write_back:
+                return sum(write_results(kvs, o, namespace) for o in outputs)
+            ret = {}
+            for o in outputs:
+                ret.update(o)
+            return ret
+    finally:
+        kvs.close()
@@ -1,12 +1,54 @@
 """Pycoki PostgreSQL implement"""
 
+import io
 from pycoki import KeyValueStore
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import execute_values
 
 class PgSQLKeyValueStore(KeyValueStore):
+    param_marker = "%s"
+    max_params = 10000
+    max_value_length = 4000
+
+    def write_rows(self, cursor, rows):
+        """Write rows with multi-VALUES upsert in one batch
+
+        :param cursor: Cursor
+        :type cursor: Cursor
+        :param rows: Tuples of namespace, key, serialized value, timestamp and expiry
+        :type rows: list
+        """
+        execute_values(cursor, self.sqls["set_many"], rows, page_size=self.batch_size)
+
+    def copy_rows(self, cursor, rows):
+        """Write rows of import by COPY into temporary table and upsert from it
+
+        :param cursor: Cursor
+        :type cursor: Cursor
+        :param rows: Tuples of namespace, key, serialized value, timestamp and expiry
+        :type rows: list
+        """
+        data = io.StringIO("".join("\t".join(map(self.copy_text, r)) + "\n" for r in rows))
+        cursor.execute(self.sqls["import_create"])
+        cursor.copy_expert(self.sqls["import_copy"], data)
+        cursor.execute(self.sqls["import_merge"])
+        cursor.execute(self.sqls["import_clear"])
+
     @staticmethod
-    def edit_params(namespace, key, value, timestamp):
+    def copy_text(value):
+        """Edit value for text format of COPY
+
+        :param value: Value
+        :type value: object
+        :return: Escaped text
+        :rtype: str
+        """
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    @staticmethod
+    def edit_params(namespace, key, value, timestamp, expires=None):
         """Edit SQL params
 
         :param namespace: Namespace of Key-Value
@@ -17,10 +59,12 @@ class PgSQLKeyValueStore(KeyValueStore):
         :type value: str
         :param timestamp: Timestamp
         :type timestamp: datetime
+        :param expires: Expiry in seconds since epoch
+        :type expires: float
         :return: params
         :rtype: tuple
         """
-        return (namespace, key, value, timestamp, namespace, key, value, timestamp)
+        return (namespace, key, value, timestamp, expires, namespace, key, value, timestamp, expires)
 
     @staticmethod
     def get_connection(connection_str):
@@ -31,7 +75,7 @@ class PgSQLKeyValueStore(KeyValueStore):
         :return: Connection
         :rtype: Connection
         """
-        return psycopg2.connect(dsn=connection_str, cursor_factory=DictCursor)
+        return psycopg2.connect(dsn=connection_str)
 
     @staticmethod
     def get_sqls(table_name):
@@ -44,13 +88,57 @@ class PgSQLKeyValueStore(KeyValueStore):
         """
         return {
             "prepare_check": "SELECT relname FROM pg_class WHERE relkind='r' and relname='{0}';".format(table_name),
-            "prepare_create": "create table {0} (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_value VARCHAR(4000), kv_timestamp timestamp with time zone, primary key(kv_namespace, kv_key))".format(table_name),
-            "get": "select kv_value from {0} where kv_namespace=%s and kv_key=%s".format(table_name),
-            "get_all": "select kv_key, kv_value from {0} where kv_namespace=%s".format(table_name),
-            "keys": "select kv_key from {0} where kv_namespace=%s".format(table_name),
-            "set": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (%s,%s,%s,%s) 
+            "prepare_create": "create table {0} (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_value VARCHAR(4000), kv_timestamp timestamp with time zone, kv_expires double precision, primary key(kv_namespace, kv_key))".format(table_name),
+            "prepare_check_index": "SELECT relname FROM pg_class WHERE relkind='i' and relname='{0}_ts_idx';".format(table_name),
+            "prepare_create_index": "create index {0}_ts_idx on {0} (kv_namespace, kv_timestamp)".format(table_name),
+            "prepare_check_expires": "SELECT column_name FROM information_schema.columns WHERE table_name='{0}' and column_name='kv_expires';".format(table_name),
+            "prepare_alter_expires": "alter table {0} add column kv_expires double precision".format(table_name),
+            "prepare_check_expires_index": "SELECT relname FROM pg_class WHERE relkind='i' and relname='{0}_exp_idx';".format(table_name),
+            "prepare_create_expires_index": "create index {0}_exp_idx on {0} (kv_expires)".format(table_name),
+            "probe_table": "select kv_key from {0} where 1=0".format(table_name),
+            "probe_expires": "select kv_expires from {0} where 1=0".format(table_name),
+            "get": "select kv_value from {0} where kv_namespace=%s and kv_key=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "get_all": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "keys": "select kv_key from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "changes": "select kv_key, kv_timestamp from {0} where kv_namespace=%s and kv_timestamp>=%s order by kv_timestamp".format(table_name),
+            "namespaces": "select distinct kv_namespace from {0}".format(table_name),
+            "scan_keys": "select kv_key from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_items": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_rows": "select kv_key, kv_value, kv_expires from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "count": "select count(*) as kv_count from {0} where kv_namespace=%s".format(table_name),
+            "key_at": "select kv_key from {0} where kv_namespace=%s order by kv_key limit 1 offset %s".format(table_name),
+            "get_many": "select kv_key, kv_value from {0} where kv_namespace=%s and (kv_expires is null or kv_expires>%s) and kv_key in ({{0}})".format(table_name),
+            "set": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (%s,%s,%s,%s,%s) 
+                    on conflict on constraint {0}_pkey
+                    do update set kv_namespace=%s, kv_key=%s, kv_value=%s, kv_timestamp=%s, kv_expires=%s""".format(table_name),
+            "set_many": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values %s
+                    on conflict on constraint {0}_pkey
+                    do update set kv_value=excluded.kv_value, kv_timestamp=excluded.kv_timestamp, kv_expires=excluded.kv_expires""".format(table_name),
+            "import_create": "create temp table if not exists {0}_import (like {0}) on commit drop".format(table_name),
+            "import_copy": "copy {0}_import (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) from stdin".format(table_name),
+            "import_merge": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) select kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires from {0}_import
                     on conflict on constraint {0}_pkey
-                    do update set kv_namespace=%s, kv_key=%s, kv_value=%s, kv_timestamp=%s""".format(table_name),
+                    do update set kv_value=excluded.kv_value, kv_timestamp=excluded.kv_timestamp, kv_expires=excluded.kv_expires""".format(table_name),
+            "import_clear": "truncate {0}_import".format(table_name),
             "remove": "delete from {0} where kv_namespace=%s and kv_key=%s".format(table_name),
+            "remove_many": "delete from {0} where kv_namespace=%s and kv_key in ({{0}})".format(table_name),
             "remove_all": "delete from {0} where kv_namespace=%s".format(table_name),
+            "remove_expired": "delete from {0} where ctid in (select ctid from {0} where kv_expires<=%s limit {{0}})".format(table_name),
+            "remove_expired_key": "delete from {0} where kv_namespace=%s and kv_key=%s and kv_expires<=%s".format(table_name),
+            "insert_new": "insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (%s,%s,%s,%s,%s) on conflict on constraint {0}_pkey do nothing".format(table_name),
+            "compare_and_set": "update {0} set kv_value=%s, kv_timestamp=%s, kv_expires=%s where kv_namespace=%s and kv_key=%s and kv_value=%s and (kv_expires is null or kv_expires>%s)".format(table_name),
+            "incr": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (%s,%s,%s,%s)
+                    on conflict on constraint {0}_pkey do update set
+                    kv_value=cast(case when {0}.kv_expires<=%s then 0 else cast(coalesce(nullif({0}.kv_value, ''), '0') as bigint) end + %s as varchar),
+                    kv_timestamp=excluded.kv_timestamp, kv_expires=case when {0}.kv_expires<=%s then null else {0}.kv_expires end
+                    where {0}.kv_expires<=%s or {0}.kv_value='' or {0}.kv_value ~ '^-?[0-9]+$'
+                    returning kv_value""".format(table_name),
+            "prepare_check_blob": "SELECT relname FROM pg_class WHERE relkind='r' and relname='{0}_blob';".format(table_name),
+            "prepare_create_blob": "create table {0}_blob (kv_namespace VARCHAR(50), kv_key VARCHAR(100), kv_chunk INT, kv_data BYTEA, kv_timestamp timestamp with time zone, primary key(kv_namespace, kv_key, kv_chunk))".format(table_name),
+            "blob_get": "select kv_data from {0}_blob where kv_namespace=%s and kv_key=%s order by kv_chunk".format(table_name),
+            "blob_get_chunk": "select kv_data from {0}_blob where kv_namespace=%s and kv_key=%s and kv_chunk=%s".format(table_name),
+            "blob_keys": "select kv_key from {0}_blob where kv_namespace=%s and kv_chunk=0".format(table_name),
+            "blob_set": "insert into {0}_blob (kv_namespace, kv_key, kv_chunk, kv_data, kv_timestamp) values (%s,%s,%s,%s,%s)".format(table_name),
+            "blob_remove": "delete from {0}_blob where kv_namespace=%s and kv_key=%s".format(table_name),
+            "blob_remove_all": "delete from {0}_blob where kv_namespace=%s".format(table_name),
         }
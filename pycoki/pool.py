@@ -0,0 +1,177 @@
+"""Pycoki connection pool"""
+
+import os
+import time
+import threading
+import logging
+import traceback
+
+class ConnectionPool:
+    def __init__(self, kvsclass, connection_str, max_size=5, idle_timeout=300, health_check_interval=30, logger=None):
+        """Constractor of ConnectionPool
+        Use get_pool() to share the pool in the process
+
+        :param kvsclass: Class of KeyValueStore to create connections
+        :type kvsclass: type
+        :param connection_str: Connection string
+        :type connection_str: str
+        :param max_size: Max number of connections including ones in use
+        :type max_size: int
+        :param idle_timeout: Seconds to keep idle connections. None to keep forever
+        :type idle_timeout: float
+        :param health_check_interval: Check connections idle longer than this seconds before reuse. None to skip checking
+        :type health_check_interval: float
+        :param logger: Logger
+        :type logger: logging.Logger
+        """
+        self.kvsclass = kvsclass
+        self.connection_str = connection_str
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.initialized_tables = set()
+        self.idle_connections = []
+        self.size = 0
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Get a connection from the pool or create new one
+
+        :param timeout: Seconds to wait for a connection when the pool is full. None to wait forever
+        :type timeout: float
+        :return: Connection
+        :rtype: Connection
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn = None
+            with self.condition:
+                self.reset_if_forked()
+                self.discard_idle()
+                while not self.idle_connections and self.size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("No connection is available in the pool")
+                    self.condition.wait(remaining)
+                    self.discard_idle()
+                if self.idle_connections:
+                    conn, released_at = self.idle_connections.pop()
+                else:
+                    self.size += 1
+            if conn is None:
+                try:
+                    return self.kvsclass.get_connection(self.connection_str)
+                except Exception:
+                    self.remove_connection(None)
+                    raise
+            if self.health_check_interval is None or time.monotonic() - released_at < self.health_check_interval or self.kvsclass.check_connection(conn):
+                return conn
+            self.logger.info("Discarded unhealthy connection")
+            self.remove_connection(conn)
+
+    def release(self, connection, discard=False):
+        """Return the connection to the pool
+
+        :param connection: Connection
+        :type connection: Connection
+        :param discard: Close the connection instead of reusing it
+        :type discard: bool
+        """
+        if os.getpid() != self.pid:
+            return
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception as ex:
+                self.logger.warning("Discarded connection failed to rollback: " + str(ex))
+                discard = True
+        if discard:
+            self.remove_connection(connection)
+            return
+        with self.condition:
+            self.idle_connections.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def remove_connection(self, connection):
+        """Close the connection and free its slot
+
+        :param connection: Connection
+        :type connection: Connection
+        """
+        if connection is not None:
+            self.close_connection(connection)
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def discard_idle(self):
+        """Close connections idle longer than idle_timeout. Call with condition acquired
+        """
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        while self.idle_connections and now - self.idle_connections[0][1] > self.idle_timeout:
+            conn, _ = self.idle_connections.pop(0)
+            self.close_connection(conn)
+            self.size -= 1
+
+    def reset_if_forked(self):
+        """Forget connections inherited from the parent process. Call with condition acquired
+        """
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.idle_connections = []
+            self.size = 0
+
+    def clear(self):
+        """Close all idle connections
+        """
+        with self.condition:
+            while self.idle_connections:
+                conn, _ = self.idle_connections.pop()
+                self.close_connection(conn)
+                self.size -= 1
+            self.condition.notify_all()
+
+    def close_connection(self, connection):
+        """Close connection and log the error if occured
+
+        :param connection: Connection
+        :type connection: Connection
+        """
+        try:
+            connection.close()
+        except Exception as ex:
+            self.logger.error("Error occured in closing connection: " + str(ex) + "\n" + traceback.format_exc())
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(kvsclass, connection_str, **kwargs):
+    """Get the pool shared in the process for the class and connection string
+
+    :param kvsclass: Class of KeyValueStore to create connections
+    :type kvsclass: type
+    :param connection_str: Connection string
+    :type connection_str: str
+    :return: Connection pool. kwargs are passed to ConnectionPool when it is created
+    :rtype: ConnectionPool
+    """
+    key = (kvsclass, connection_str)
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(kvsclass, connection_str, **kwargs)
+            pools[key] = pool
+        return pool
+
+def clear_pools():
+    """Close idle connections of all pools and forget them
+    """
+    with pools_lock:
+        for pool in pools.values():
+            pool.clear()
+        pools.clear()
@@ -6,83 +6,1385 @@
 - All data in one table: Same key for different values by using namespace(collection names, categories...)
 """
 
-from datetime import datetime
+from datetime import datetime, timezone
+from contextlib import contextmanager
+import functools
+import importlib
+import itertools
+import operator
+import re
+import threading
+import time
 import logging
 import traceback
 import sqlite3
-import json
-from pytz import timezone
+from pycoki.pool import get_pool
+from pycoki.replica import ReplicaSet
+from pycoki.serializers import DateTimeJSONEncoder, get_serializer, get_compressor, encode, decode
 
 DEFAULT_TABLE_NAME = "pycoki"
 DEFAULT_CONNECTION_STR = "pycoki.db"
+# Values incr adds to. Others are not rewritten
+INTEGER_PATTERN = re.compile(r"-?[0-9]+")
+# Dotted paths of KeyValueStore classes by name. Modules are imported on first use
+BACKENDS = {
+    "sqlite": "pycoki.pycoki.SQLiteKeyValueStore",
+    "tuned_sqlite": "pycoki.pycoki.TunedSQLiteKeyValueStore",
+    "mysql": "pycoki.mysql.MySQLKeyValueStore",
+    "pgsql": "pycoki.pgsql.PgSQLKeyValueStore",
+    "sqldb": "pycoki.sqldb.SQLDBKeyValueStore",
+    "mmap": "pycoki.mmapstore.MmapKeyValueStore",
+}
 
-class DateTimeJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            if obj.tzinfo:
-                return obj.strftime("%Y-%m-%d %H:%M:%S %z")
+def split_chunks(items, size):
+    """Split items into lists of the given size
+
+    :param items: Items
+    :type items: iterable
+    :param size: Max length of each list
+    :type size: int
+    :return: Lists of items
+    :rtype: generator
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def fetch_batches(cursor, size):
+    """Fetch rows from cursor in batches
+
+    :param cursor: Cursor executed query
+    :type cursor: Cursor
+    :param size: Number of rows fetched at once
+    :type size: int
+    :return: Lists of rows
+    :rtype: generator
+    """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+def column_getter(cursor, columns, row):
+    """Build function to pick columns from rows of the cursor by position
+    Rows of dict cursors (e.g. DictCursor of connection given by user) are picked by name
+
+    :param cursor: Cursor executed query
+    :type cursor: Cursor
+    :param columns: Column names
+    :type columns: tuple
+    :param row: A row fetched from the cursor
+    :type row: tuple
+    :return: Function to get a value (single column) or tuple of values from row
+    :rtype: operator.itemgetter
+    """
+    if isinstance(row, dict):
+        return operator.itemgetter(*columns)
+    names = [d[0].lower() for d in cursor.description]
+    return operator.itemgetter(*[names.index(c) for c in columns])
+
+def fetch_columns(cursor, columns, size):
+    """Fetch rows from cursor in batches and pick columns of them
+
+    :param cursor: Cursor executed query
+    :type cursor: Cursor
+    :param columns: Column names
+    :type columns: tuple
+    :param size: Number of rows fetched at once
+    :type size: int
+    :return: Lists of values (single column) or tuples of values
+    :rtype: generator
+    """
+    getter = None
+    for rows in fetch_batches(cursor, size):
+        if getter is None:
+            getter = column_getter(cursor, columns, rows[0])
+        yield list(map(getter, rows))
+
+def fetch_value(cursor, column):
+    """Fetch a row from cursor and pick a column of it
+
+    :param cursor: Cursor executed query
+    :type cursor: Cursor
+    :param column: Column name
+    :type column: str
+    :return: Value. None if no row is fetched
+    """
+    row = cursor.fetchone()
+    return None if row is None else column_getter(cursor, (column, ), row)(row)
+
+def exclusive_write(method):
+    """Decorator to serialize write methods by the write lock of KeyValueStore if it has
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.write_lock is None:
+            return method(self, *args, **kwargs)
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def release_connection(method):
+    """Decorator to return the connection of the thread to the pool after the method in thread safe mode.
+    Connection is kept in transaction and in the outer method. Use release_connection_generator for generator methods
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.pool is None or self.holds_connection():
+            return method(self, *args, **kwargs)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.release_thread_connection()
+    return wrapper
+
+def release_connection_generator(method):
+    """Decorator to return the connection of the thread to the pool when the generator method is exhausted or closed in thread safe mode
+    """
+    @functools.wraps(method)
+    def generator(self, *args, **kwargs):
+        held = self.holds_connection()
+        try:
+            yield from method(self, *args, **kwargs)
+        finally:
+            if not held:
+                self.release_thread_connection()
+    return generator
+
+def retry_read(method):
+    """Decorator to retry read method on the next healthy replica and then on the primary when reading from replica failed.
+    Method must have connection argument
+    """
+    # Position of connection argument after self
+    position = method.__code__.co_varnames.index("connection") - 1
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.replicas is None:
+            return method(self, *args, **kwargs)
+        positional = len(args) > position
+        if args[position] if positional else kwargs.get("connection"):
+            return method(self, *args, **kwargs)
+
+        def call(conn):
+            if positional:
+                return method(self, *args[:position], conn, *args[position + 1:], **kwargs)
+            return method(self, *args, **dict(kwargs, connection=conn))
+
+        for _ in range(len(self.replicas.connection_strs)):
+            conn = self.read_connection()
+            ret = call(conn)
+            if not self.replicas.ejected(conn):
+                return ret
+        return call(self.connection)
+    return wrapper
+
+def read_chunks(stream, size):
+    """Read binary stream by chunks until the end
+
+    :param stream: File-like object opened in binary mode
+    :type stream: io.RawIOBase
+    :param size: Bytes of each chunk
+    :type size: int
+    :return: Chunks
+    :rtype: generator
+    :raises TypeError: Stream returns text
+    """
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        if isinstance(chunk, str):
+            raise TypeError("File-like object must be opened in binary mode")
+        yield chunk
+
+def prefix_end(prefix):
+    """Get the smallest string greater than all strings starting with prefix
+
+    :param prefix: Prefix
+    :type prefix: str
+    :return: Upper bound of range (exclusive). None if there is no upper bound
+    :rtype: str
+    """
+    while prefix:
+        if ord(prefix[-1]) < 0x10ffff:
+            return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        prefix = prefix[:-1]
+    return None
+
+class KeyValueStore:
+    # Parameter marker of the DB-API driver
+    param_marker = "?"
+    # Max number of parameters in one statement (SQLite defaults to 999)
+    max_params = 999
+    # Number of rows sent to the driver at once in batch operations
+    batch_size = 1000
+    # Max length of serialized value the kv_value column holds. None for no limit
+    max_value_length = None
+    # Pairs of SQL to check and SQL to create the table and its indexes
+    init_steps = (
+        ("prepare_check", "prepare_create"),
+        ("prepare_check_index", "prepare_create_index"),
+        ("prepare_check_expires", "prepare_alter_expires"),
+        ("prepare_check_expires_index", "prepare_create_expires_index"),
+    )
+    blob_init_steps = (("prepare_check_blob", "prepare_create_blob"), )
+    # Number of rows fetched from cursor at once
+    fetch_size = 1000
+    # Bytes of each row of binary value
+    blob_chunk_size = 1024 * 1024
+    # Serialize writes from threads in thread safe mode
+    serialize_writes = False
+    # Max number of expired rows removed in one statement
+    sweep_batch_size = 1000
+    # Only one process can open the store for writing
+    single_writer = False
+
+    def __init__(self, namespace=None, logger=None, tzone=None, connection=None, close_connection=False, sqls=None, pool=None, serializer=None, compression=None, compress_threshold=1024, instrumentation=None, connection_factory=None, replicas=None, read_after_write_window=1.0, allow_pickle=False):
+        """Constractor of KeyValueStore
+        Use KeyValueStore.open() method instead
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param logger: Logger
+        :type logger: logging.Logger
+        :param tzone: Timezone
+        :type tzone: timezone
+        :param connection: Connection
+        :type connection: Connection
+        :param close_connection: Close connection when close method called
+        :type close_connection: bool
+        :param table_name: Key-Value store table
+        :type table_name: str
+        :param pool: Pool to return the connection when close method called
+        :type pool: ConnectionPool
+        :param serializer: Serializer name (json, typed_json, orjson, msgpack, pickle) or instance. None for JSON. pickle requires allow_pickle
+        :type serializer: str
+        :param compression: Compression name (zlib, lz4) or instance. None for no compression
+        :type compression: str
+        :param compress_threshold: Compress only values larger than this bytes
+        :type compress_threshold: int
+        :param instrumentation: Instrumentation to measure operations
+        :type instrumentation: pycoki.metrics.Instrumentation
+        :param connection_factory: Function to create connection for each thread. Enables thread safe mode
+        :type connection_factory: function
+        :param replicas: Read replicas to load-balance reads
+        :type replicas: pycoki.replica.ReplicaSet
+        :param read_after_write_window: Seconds to read from primary after the last write
+        :type read_after_write_window: float
+        :param allow_pickle: Allow pickle serializer. Values are loaded by pickle only if it is the serializer
+        :type allow_pickle: bool
+        """
+        self.connection_factory = connection_factory
+        self.local = threading.local() if connection_factory else None
+        self.thread_connections = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.RLock() if connection_factory and self.serialize_writes else None
+        self.sqls = sqls
+        self.namespace = namespace
+        self.logger = logger
+        self.timezone = tzone
+        self.connection = connection
+        self.close_connection=close_connection
+        self.pool = pool
+        self.serializer = get_serializer(serializer, allow_pickle)
+        self.compressor = get_compressor(compression)
+        self.compress_threshold = compress_threshold
+        self.instrumentation = instrumentation
+        self.transaction_state = None
+        self.replicas = replicas
+        self.read_after_write_window = read_after_write_window
+        self.last_write = 0.0
+
+    @property
+    def connection(self):
+        """Connection. Each thread has its own connection in thread safe mode
+        """
+        if self.local is None:
+            return self.shared_connection
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = self.connection_factory()
+            self.local.connection = conn
+            with self.lock:
+                self.thread_connections.append(conn)
+        return conn
+
+    @connection.setter
+    def connection(self, value):
+        if self.local is None:
+            self.shared_connection = value
+        else:
+            self.local.connection = value
+
+    @property
+    def transaction_state(self):
+        """State of transaction. Each thread has its own transaction in thread safe mode
+        """
+        if self.local is None:
+            return self.shared_transaction_state
+        return getattr(self.local, "transaction_state", None)
+
+    @transaction_state.setter
+    def transaction_state(self, value):
+        if self.local is None:
+            self.shared_transaction_state = value
+        else:
+            self.local.transaction_state = value
+
+    @release_connection
+    def init_table(self, query_params=tuple(), connection=None, steps=None):
+        """Create new table and indexes if they don't exist
+
+        :param query_params: Query parameters for checking table
+        :type query_params: tuple
+        :param connection: Connection
+        :type connection: Connection
+        :param steps: Pairs of SQL names to check and create. Default is init_steps
+        :type steps: tuple
+        :return: Result
+        :rtype: bool
+        """
+        conn = connection if connection else self.connection
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            for check, create in steps if steps else self.init_steps:
+                cursor.execute(self.sqls[check], query_params)
+                if cursor.fetchone() is None:
+                    cursor.execute(self.sqls[create])
+                    conn.commit()
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in initializing table: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return False
+
+    def init_blob_table(self, query_params=tuple(), connection=None):
+        """Create new table for binary values if it doesn't exist
+
+        :param query_params: Query parameters for checking table
+        :type query_params: tuple
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        return self.init_table(query_params=query_params, connection=connection, steps=self.blob_init_steps)
+
+    @release_connection
+    def upgrade_table(self, connection=None):
+        """Add kv_expires column and its index to the table created by older versions.
+        Nothing is done if the table doesn't exist yet
+
+        :param connection: Connection
+        :type connection: Connection
+        :return: True if the table was upgraded
+        :rtype: bool
+        :raises RuntimeError: The table has no kv_expires column and it couldn't be added
+        """
+        if "probe_expires" not in self.sqls:
+            return False
+        conn = connection if connection else self.connection
+        cursor = conn.cursor()
+        try:
+            if self.probe(conn, cursor, "probe_expires") or not self.probe(conn, cursor, "probe_table"):
+                return False
+            try:
+                cursor.execute(self.sqls["prepare_alter_expires"])
+                cursor.execute(self.sqls["prepare_create_expires_index"])
+                conn.commit()
+                self.logger.info("Added kv_expires column to the table")
+                return True
+            except Exception as ex:
+                conn.rollback()
+                # Another process may have added it at the same time
+                if self.probe(conn, cursor, "probe_expires"):
+                    return False
+                raise RuntimeError("The table was created by an older version and failed to add kv_expires column. Run init_table by a user who can alter the table: " + str(ex)) from ex
+        finally:
+            cursor.close()
+
+    def probe(self, conn, cursor, name):
+        """Check if the probe SQL runs without error
+
+        :param conn: Connection
+        :type conn: Connection
+        :param cursor: Cursor
+        :type cursor: Cursor
+        :param name: Name of SQL
+        :type name: str
+        :return: True if succeeded
+        :rtype: bool
+        """
+        try:
+            cursor.execute(self.sqls[name])
+            cursor.fetchall()
+            return True
+        except Exception:
+            # Failed statement aborts the transaction on some databases
+            conn.rollback()
+            return False
+
+    @contextmanager
+    def transaction(self, flush_count=None, flush_interval=None):
+        """Defer commits of writes until the end of the block.
+        All changes are rolled back when an exception is raised in the block.
+        Nested blocks join the outermost transaction.
+
+        :param flush_count: Commit every N writes in the block
+        :type flush_count: int
+        :param flush_interval: Commit at the next write when the milliseconds passed since the last commit
+        :type flush_interval: int
+        :return: This instance
+        :rtype: KeyValueStore
+        """
+        if self.transaction_state is not None:
+            yield self
+            return
+        held = self.holds_connection()
+        # Take the write lock before the connection not to wait for the lock while holding a pooled connection
+        if self.write_lock is not None:
+            self.write_lock.acquire()
+        try:
+            conn = self.connection
+        except BaseException:
+            if self.write_lock is not None:
+                self.write_lock.release()
+            raise
+        self.transaction_state = {"flush_count": flush_count, "flush_interval": flush_interval, "count": 0, "flushed_at": time.monotonic()}
+        try:
+            yield self
+            conn.commit()
+            self.last_write = time.monotonic()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.transaction_state = None
+            if self.write_lock is not None:
+                self.write_lock.release()
+            if not held:
+                self.release_thread_connection()
+
+    def commit(self, connection):
+        """Commit changes unless they are deferred by transaction
+
+        :param connection: Connection
+        :type connection: Connection
+        """
+        self.last_write = time.monotonic()
+        state = self.transaction_state
+        if state is None or connection is not self.connection:
+            connection.commit()
+            return
+        state["count"] += 1
+        if (state["flush_count"] and state["count"] >= state["flush_count"]) or \
+                (state["flush_interval"] and (time.monotonic() - state["flushed_at"]) * 1000 >= state["flush_interval"]):
+            connection.commit()
+            state["count"] = 0
+            state["flushed_at"] = time.monotonic()
+
+    def rollback(self, connection):
+        """Roll back changes of the failed write unless they are in transaction.
+        Transaction is rolled back by the exception raised in the block instead
+
+        :param connection: Connection
+        :type connection: Connection
+        """
+        if self.transaction_state is not None and connection is self.connection:
+            return
+        try:
+            connection.rollback()
+        except Exception as ex:
+            self.logger.error("Error occured in rolling back: " + str(ex) + "\n" + traceback.format_exc())
+
+    def read_connection(self):
+        """Connection to read. Replica is used unless in transaction or within read_after_write_window after the last write
+
+        :return: Connection
+        :rtype: Connection
+        """
+        if self.replicas is None or self.transaction_state is not None or \
+                time.monotonic() - self.last_write < self.read_after_write_window:
+            return self.connection
+        conn = self.replicas.acquire()
+        return conn if conn is not None else self.connection
+
+    def read_failed(self, connection):
+        """Eject replica when reading from it failed
+
+        :param connection: Connection
+        :type connection: Connection
+        """
+        if self.replicas is not None and self.replicas.eject(connection):
+            self.logger.warning("Replica is ejected after error")
+
+    def holds_connection(self):
+        """Check if the current thread has its own connection in thread safe mode
+
+        :return: True if the thread has connection
+        :rtype: bool
+        """
+        return self.local is not None and getattr(self.local, "connection", None) is not None
+
+    def release_thread_connection(self):
+        """Return the connection of the current thread to the pool in thread safe mode.
+        Nothing is done in transaction
+        """
+        if self.local is None or self.pool is None or self.transaction_state is not None:
+            return
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            return
+        self.local.connection = None
+        with self.lock:
+            if not any(c is conn for c in self.thread_connections):
+                # Already returned by close()
+                return
+            self.thread_connections = [c for c in self.thread_connections if c is not conn]
+        self.pool.release(conn)
+
+    def close(self):
+        """Close connection if it was created from connection string
+        Connection from pool is returned to the pool instead
+        """
+        if self.replicas is not None:
+            self.replicas.close()
+        if self.local is not None:
+            with self.lock:
+                connections = self.thread_connections
+                self.thread_connections = []
+            for conn in connections:
+                try:
+                    if self.pool:
+                        self.pool.release(conn)
+                    else:
+                        conn.close()
+                except Exception as ex:
+                    self.logger.error("Error occured in closing connection: " + str(ex) + "\n" + traceback.format_exc())
+            self.local = threading.local()
+        elif self.close_connection and self.pool:
+            self.pool.release(self.connection)
+            self.connection = None
+        elif self.close_connection:
+            try:
+                self.connection.close()
+            except Exception as ex:
+                self.logger.error("Error occured in closing connection: " + str(ex) + "\n" + traceback.format_exc())
+        else:
+            self.logger.info("Skipped closing connection")
+
+    @release_connection
+    @retry_read
+    def get(self, key=None, namespace=None, connection=None):
+        """Get value by key or all values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Value or all values in namespace. Value that can't be decoded is read as None and left out of all values
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        ret = None
+        error = None
+        timer = self.instrumentation.begin("get", type(self).__name__, ns) if self.instrumentation else None
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if timer: timer.phase("cursor")
+            if key:
+                cursor.execute(self.sqls["get"], (ns, key, time.time()))
+                if timer: timer.phase("execute")
+                value = fetch_value(cursor, "kv_value")
+                if timer: timer.phase("fetch")
+                try:
+                    ret = self.deserialize(value)
+                except Exception as ex:
+                    self.decode_failed(key, ex)
+                if timer: timer.phase("decode")
             else:
-                return obj.strftime("%Y-%m-%d %H:%M:%S")
-        return super().default(obj)
+                ret = {}
+                cursor.execute(self.sqls["get_all"], (ns, time.time()))
+                if timer: timer.phase("execute")
+                deserialize = self.deserialize
+                for rows in fetch_columns(cursor, ("kv_key", "kv_value"), self.fetch_size):
+                    if timer: timer.phase("fetch")
+                    for k, v in rows:
+                        try:
+                            ret[str(k)] = deserialize(v)
+                        except Exception as ex:
+                            self.decode_failed(k, ex)
+                    if timer: timer.phase("decode")
+        except Exception as ex:
+            error = ex
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if timer: timer.end(error)
+        return ret
+
+    @release_connection
+    @retry_read
+    def keys(self, namespace=None, connection=None, prefix=None, start=None, end=None, limit=None):
+        """Get all keys in namespace, or keys in range in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of keys
+        :type limit: int
+        :return: All keys in namespace
+        :rtype: list
+        """
+        if prefix or start is not None or end is not None or limit is not None:
+            return [k for k, _ in self.range_rows(False, namespace, prefix, start, end, limit, connection)]
+        ret = []
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        error = None
+        timer = self.instrumentation.begin("keys", type(self).__name__, ns) if self.instrumentation else None
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if timer: timer.phase("cursor")
+            cursor.execute(self.sqls["keys"], (ns, time.time()))
+            if timer: timer.phase("execute")
+            for rows in fetch_columns(cursor, ("kv_key", ), self.fetch_size):
+                if timer: timer.phase("fetch")
+                ret.extend(map(str, rows))
+                if timer: timer.phase("decode")
+        except Exception as ex:
+            error = ex
+            self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if timer: timer.end(error)
+        return ret
+
+    def items(self, namespace=None, prefix=None, start=None, end=None, limit=None, connection=None):
+        """Get keys and values in range in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of items
+        :type limit: int
+        :param connection: Connection
+        :type connection: Connection
+        :return: Tuples of key and value. Values that can't be decoded are skipped
+        :rtype: list
+        """
+        return list(self.decode_rows(self.range_rows(True, namespace, prefix, start, end, limit, connection)))
+
+    def range_rows(self, with_values, namespace=None, prefix=None, start=None, end=None, limit=None, connection=None):
+        """Get rows in range on the primary key. Pages are fetched until limit is reached
+
+        :param with_values: Fetch serialized values too
+        :type with_values: bool
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of rows. None for all rows in range
+        :type limit: int
+        :param connection: Connection
+        :type connection: Connection
+        :return: Tuples of key and serialized value (None if with_values is False). Empty if failed
+        :rtype: list
+        """
+        if limit is not None and limit <= 0:
+            return []
+        batch_size = min(limit, self.fetch_size) if limit else self.fetch_size
+        try:
+            return list(itertools.islice(self.iter_rows(with_values, namespace, batch_size, prefix, start, end, connection), limit))
+        except RuntimeError as ex:
+            self.logger.error("Error occured in getting rows in range: " + str(ex))
+        return []
+
+    def iter_keys(self, namespace=None, batch_size=1000, prefix=None, start=None, end=None, connection=None):
+        """Iterate keys in namespace in order of key, fetching them page by page
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param batch_size: Number of keys fetched at once
+        :type batch_size: int
+        :param prefix: Iterate only keys starting with prefix
+        :type prefix: str
+        :param start: Iterate only keys greater than or equal to start
+        :type start: str
+        :param end: Iterate only keys less than end
+        :type end: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Keys
+        :rtype: generator
+        :raises RuntimeError: Failed to get a page
+        """
+        for key, _ in self.iter_rows(False, namespace, batch_size, prefix, start, end, connection):
+            yield key
+
+    def iter_items(self, namespace=None, batch_size=1000, prefix=None, start=None, end=None, connection=None):
+        """Iterate keys and values in namespace in order of key, fetching them page by page
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param batch_size: Number of items fetched at once
+        :type batch_size: int
+        :param prefix: Iterate only keys starting with prefix
+        :type prefix: str
+        :param start: Iterate only keys greater than or equal to start
+        :type start: str
+        :param end: Iterate only keys less than end
+        :type end: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Tuples of key and value. Values that can't be decoded are skipped
+        :rtype: generator
+        :raises RuntimeError: Failed to get a page
+        """
+        yield from self.decode_rows(self.iter_rows(True, namespace, batch_size, prefix, start, end, connection))
+
+    def iter_rows(self, with_values, namespace=None, batch_size=1000, prefix=None, start=None, end=None, connection=None, with_expires=False):
+        """Iterate rows by keyset pagination on kv_key
+
+        :param with_values: Fetch serialized values too
+        :type with_values: bool
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param batch_size: Number of rows fetched at once
+        :type batch_size: int
+        :param prefix: Iterate only keys starting with prefix
+        :type prefix: str
+        :param start: Iterate only keys greater than or equal to start
+        :type start: str
+        :param end: Iterate only keys less than end
+        :type end: str
+        :param connection: Connection
+        :type connection: Connection
+        :param with_expires: Fetch serialized values and expiry
+        :type with_expires: bool
+        :return: Tuples of key and serialized value (None if with_values is False), and expiry if with_expires is True
+        :rtype: generator
+        :raises RuntimeError: Failed to get a page
+        """
+        if prefix:
+            start = prefix if start is None else max(start, prefix)
+            upper = prefix_end(prefix)
+            end = upper if end is None else end if upper is None else min(end, upper)
+        after = None
+        while True:
+            rows = self.scan(with_values, namespace, batch_size, start, end, after, connection=connection, with_expires=with_expires)
+            if rows is None:
+                raise RuntimeError("Failed to scan namespace {0} after key {1}".format(namespace if namespace else self.namespace, after))
+            if not rows:
+                return
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    @release_connection
+    @retry_read
+    def scan(self, with_values, namespace=None, limit=1000, start=None, end=None, after=None, connection=None, with_expires=False):
+        """Get a page of rows in order of key
+
+        :param with_values: Fetch serialized values too
+        :type with_values: bool
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param limit: Max number of rows
+        :type limit: int
+        :param start: Keys greater than or equal to start
+        :type start: str
+        :param end: Keys less than end
+        :type end: str
+        :param after: Keys greater than after. Used instead of start for the next page
+        :type after: str
+        :param connection: Connection
+        :type connection: Connection
+        :param with_expires: Fetch serialized values and expiry
+        :type with_expires: bool
+        :return: Tuples of key and serialized value (None if with_values is False), and expiry if with_expires is True
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        conditions = []
+        params = [ns, time.time()]
+        if after is not None:
+            conditions.append("and kv_key>" + self.param_marker)
+            params.append(after)
+        elif start is not None:
+            conditions.append("and kv_key>=" + self.param_marker)
+            params.append(start)
+        if end is not None:
+            conditions.append("and kv_key<" + self.param_marker)
+            params.append(end)
+        ret = []
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["scan_rows" if with_expires else "scan_items" if with_values else "scan_keys"].format(" ".join(conditions), int(limit)), tuple(params))
+            if with_expires:
+                for rows in fetch_columns(cursor, ("kv_key", "kv_value", "kv_expires"), self.fetch_size):
+                    ret.extend([(str(k), v, e) for k, v, e in rows])
+            elif with_values:
+                for rows in fetch_columns(cursor, ("kv_key", "kv_value"), self.fetch_size):
+                    ret.extend([(str(k), v) for k, v in rows])
+            else:
+                for rows in fetch_columns(cursor, ("kv_key", ), self.fetch_size):
+                    ret.extend([(str(k), None) for k in rows])
+        except Exception as ex:
+            self.logger.error("Error occured in scanning data in database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+            return
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return ret
+
+    @release_connection
+    @retry_read
+    def changes(self, since, namespace=None, connection=None):
+        """Get keys updated at or after the timestamp. Removed keys are not included
+
+        :param since: Timestamp
+        :type since: datetime
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Tuples of key and timestamp in order of timestamp
+        :rtype: list
+        """
+        ret = []
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["changes"], (ns, self.edit_timestamp(since)))
+            for rows in fetch_columns(cursor, ("kv_key", "kv_timestamp"), self.fetch_size):
+                ret.extend([(str(k), ts) for k, ts in rows])
+        except Exception as ex:
+            self.logger.error("Error occured in getting changes from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return ret
+
+    @release_connection
+    @retry_read
+    def namespaces(self, connection=None):
+        """Get all namespaces that have values
+
+        :param connection: Connection
+        :type connection: Connection
+        :return: Namespaces
+        :rtype: list
+        """
+        ret = []
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["namespaces"])
+            for rows in fetch_columns(cursor, ("kv_namespace", ), self.fetch_size):
+                ret.extend(map(str, rows))
+        except Exception as ex:
+            self.logger.error("Error occured in getting namespaces from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return ret
+
+    @release_connection
+    @retry_read
+    def key_boundaries(self, parts, namespace=None, connection=None):
+        """Get keys that split namespace into parts of about the same number of keys
+
+        :param parts: Number of parts
+        :type parts: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Sorted keys at the start of each part except the first one. Fewer if namespace is small
+        :rtype: list
+        """
+        ret = []
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["count"], (ns, ))
+            count = int(fetch_value(cursor, "kv_count") or 0)
+            for i in range(1, parts):
+                cursor.execute(self.sqls["key_at"], (ns, count * i // parts))
+                key = fetch_value(cursor, "kv_key")
+                if key is not None and (not ret or ret[-1] < str(key)):
+                    ret.append(str(key))
+        except Exception as ex:
+            self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+            return
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return ret
+
+    @release_connection
+    @exclusive_write
+    def set(self, key, value, namespace=None, connection=None, ttl=None):
+        """Set value with key.
+        Serialized value longer than max_value_length (4000 characters on MySQL, PostgreSQL and SQL Server) is not set and False is returned.
+        Use set_blob for large values
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :param ttl: Seconds until the value expires. None to keep it forever
+        :type ttl: float
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        error = None
+        timer = self.instrumentation.begin("set", type(self).__name__, ns) if self.instrumentation else None
+        cursor = None
+        try:
+            serialized_value = self.serialize(value)
+            if timer: timer.phase("encode")
+            cursor = conn.cursor()
+            if timer: timer.phase("cursor")
+            cursor.execute(self.sqls["set"], self.edit_params(ns, key, serialized_value, datetime.now(self.timezone), self.expires_at(ttl)))
+            if timer: timer.phase("execute")
+            self.commit(conn)
+            if timer: timer.phase("commit")
+            return True
+        except Exception as ex:
+            error = ex
+            self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if timer: timer.end(error)
+        return False
+
+    @release_connection
+    @exclusive_write
+    def remove(self, key=None, namespace=None, connection=None):
+        """Remove value by key or all values in namespace
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        error = None
+        timer = self.instrumentation.begin("remove", type(self).__name__, ns) if self.instrumentation else None
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            if timer: timer.phase("cursor")
+            if key:
+                cursor.execute(self.sqls["remove"], (ns, key))
+            else:
+                cursor.execute(self.sqls["remove_all"], (ns, ))
+            if timer: timer.phase("execute")
+            self.commit(conn)
+            if timer: timer.phase("commit")
+            return True
+        except Exception as ex:
+            error = ex
+            self.logger.error("Error occured in removing data: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if timer: timer.end(error)
+        return False
+
+    @release_connection
+    @retry_read
+    def get_many(self, keys, namespace=None, connection=None):
+        """Get values by multiple keys at once
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Values by key. Keys not found and values that can't be decoded are not included
+        :rtype: dict
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.read_connection()
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        ret = {}
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            now = time.time()
+            for chunk in split_chunks(dict.fromkeys(keys), self.max_params - 2):
+                cursor.execute(self.sqls["get_many"].format(",".join([self.param_marker] * len(chunk))), (ns, now) + tuple(chunk))
+                for rows in fetch_columns(cursor, ("kv_key", "kv_value"), self.fetch_size):
+                    for k, v in rows:
+                        try:
+                            ret[str(k)] = self.deserialize(v)
+                        except Exception as ex:
+                            self.decode_failed(k, ex)
+        except Exception as ex:
+            self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+            self.read_failed(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return ret
+
+    @release_connection
+    @exclusive_write
+    def set_many(self, values, namespace=None, connection=None, ttl=None):
+        """Set multiple values and commit once. Nothing is set if any serialized value is longer than max_value_length
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :param ttl: Seconds until the values expire. None to keep them forever
+        :type ttl: float
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        cursor = None
+        try:
+            timestamp = datetime.now(self.timezone)
+            expires = self.expires_at(ttl)
+            # Serialize all values first not to write any of them when one fails
+            rows = [(ns, k, self.serialize(v), timestamp, expires) for k, v in values.items()]
+            cursor = conn.cursor()
+            for chunk in split_chunks(rows, self.batch_size):
+                self.write_rows(cursor, chunk)
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
+            if cursor is not None:
+                self.rollback(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return False
+
+    @release_connection
+    @exclusive_write
+    def import_rows(self, rows, namespace=None, connection=None):
+        """Write serialized rows in batches and commit once. Existing keys are overwritten.
+        Batches written before an error are rolled back unless in transaction
+
+        :param rows: Tuples of key, serialized value and expiry
+        :type rows: iterable
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Number of rows written. None if failed
+        :rtype: int
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        count = 0
+        cursor = None
+        try:
+            timestamp = datetime.now(self.timezone)
+            cursor = conn.cursor()
+            for chunk in split_chunks(((ns, k, v, timestamp, e) for k, v, e in rows), self.batch_size):
+                self.copy_rows(cursor, chunk)
+                count += len(chunk)
+            self.commit(conn)
+            return count
+        except Exception as ex:
+            self.logger.error("Error occured in importing data: " + str(ex) + "\n" + traceback.format_exc())
+            if cursor is not None:
+                self.rollback(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
 
-class KeyValueStore:
-    def __init__(self, namespace=None, logger=None, tzone=None, connection=None, close_connection=False, sqls=None):
-        """Constractor of KeyValueStore
-        Use KeyValueStore.open() method instead
+    @release_connection
+    @exclusive_write
+    def remove_many(self, keys, namespace=None, connection=None):
+        """Remove values by multiple keys and commit once. Nothing is removed if failed unless in transaction
 
+        :param keys: Keys
+        :type keys: list
         :param namespace: Namespace of Key-Value
         :type namespace: str
-        :param logger: Logger
-        :type logger: logging.Logger
-        :param tzone: Timezone
-        :type tzone: timezone
         :param connection: Connection
         :type connection: Connection
-        :param close_connection: Close connection when close method called
-        :type close_connection: bool
-        :param table_name: Key-Value store table
-        :type table_name: str
+        :return: Result
+        :rtype: bool
         """
-        self.sqls = sqls
-        self.namespace = namespace
-        self.logger = logger
-        self.timezone = tzone
-        self.connection = connection
-        self.close_connection=close_connection
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            for chunk in split_chunks(dict.fromkeys(keys), self.max_params - 1):
+                cursor.execute(self.sqls["remove_many"].format(",".join([self.param_marker] * len(chunk))), (ns, ) + tuple(chunk))
+            self.commit(conn)
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in removing data: " + str(ex) + "\n" + traceback.format_exc())
+            self.rollback(conn)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return False
 
-    def init_table(self, query_params=tuple(), connection=None):
-        """Create new table if it doesn't exist
+    @release_connection
+    @exclusive_write
+    def incr(self, key, delta=1, namespace=None, connection=None):
+        """Add delta to integer value by one upsert statement. Missing or expired value is counted from 0.
+        Value that is not an integer is kept as it is
 
-        :param query_params: Query parameters for checking table
-        :type query_params: tuple
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
         :param connection: Connection
         :type connection: Connection
+        :return: Value after added. None if the value is not an integer or error occured
+        :rtype: int
         """
+        ns = namespace if namespace else self.namespace
         conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        cursor = None
         try:
+            delta = int(delta)
             cursor = conn.cursor()
-            cursor.execute(self.sqls["prepare_check"], query_params)
-            if cursor.fetchone() is None:
-                cursor.execute(self.sqls["prepare_create"])
-                conn.commit()
+            cursor.execute(self.sqls["incr"], self.edit_incr_params(ns, key, delta, self.edit_timestamp(datetime.now(self.timezone)), time.time()))
+            if "incr_get" in self.sqls:
+                cursor.execute(self.sqls["incr_get"], (ns, key))
+            value = fetch_value(cursor, "kv_value")
+            self.commit(conn)
+            # Upsert doesn't update the row when the value is not an integer
+            if value is None or not INTEGER_PATTERN.fullmatch(str(value)):
+                self.logger.warning("Value is not an integer: " + str(key))
+                return
+            return int(value)
         except Exception as ex:
-            self.logger.error("Error occured in initializing table: " + str(ex) + "\n" + traceback.format_exc())
+            self.logger.error("Error occured in incrementing data: " + str(ex) + "\n" + traceback.format_exc())
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
 
-    def close(self):
-        """Close connection if it was created from connection string
+    @release_connection
+    @exclusive_write
+    def compare_and_set(self, key, expected, value, namespace=None, connection=None, ttl=None):
+        """Set value only if the current value equals expected. Values are compared in serialized form
+
+        :param key: Key
+        :type key: str
+        :param expected: Expected current value. None to set only if the key doesn't exist
+        :type expected: object
+        :param value: New value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :param ttl: Seconds until the value expires. None to keep it forever
+        :type ttl: float
+        :return: True if value is set
+        :rtype: bool
         """
-        if self.close_connection:
-            try:
-                self.connection.close()
-            except Exception as ex:
-                self.logger.error("Error occured in closing connection: " + str(ex) + "\n" + traceback.format_exc())
-        else:
-            self.logger.info("Skipped closing connection")
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return False
+        cursor = None
+        try:
+            serialized_value = self.serialize(value)
+            timestamp = self.edit_timestamp(datetime.now(self.timezone))
+            now = time.time()
+            cursor = conn.cursor()
+            if expected is None:
+                cursor.execute(self.sqls["remove_expired_key"], (ns, key, now))
+                cursor.execute(self.sqls["insert_new"], (ns, key, serialized_value, timestamp, self.expires_at(ttl)))
+            else:
+                serialized_expected = self.serialize(expected)
+                if serialized_expected == serialized_value:
+                    # Nothing to change. Some drivers count only changed rows
+                    cursor.execute(self.sqls["get"], (ns, key, now))
+                    return fetch_value(cursor, "kv_value") == serialized_expected
+                cursor.execute(self.sqls["compare_and_set"], (serialized_value, timestamp, self.expires_at(ttl), ns, key, serialized_expected, now))
+            ret = cursor.rowcount == 1
+            self.commit(conn)
+            return ret
+        except Exception as ex:
+            self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return False
 
-    def get(self, key=None, namespace=None, connection=None):
-        """Get value by key or all values in namespace
+    @release_connection
+    @exclusive_write
+    def remove_expired(self, batch_size=None, connection=None):
+        """Remove one batch of expired values and commit
+
+        :param batch_size: Max number of values removed. Default is sweep_batch_size
+        :type batch_size: int
+        :param connection: Connection
+        :type connection: Connection
+        :return: Number of removed values. None if error occured
+        :rtype: int
+        """
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["remove_expired"].format(int(batch_size if batch_size else self.sweep_batch_size)), (time.time(), ))
+            count = cursor.rowcount
+            self.commit(conn)
+            return count
+        except Exception as ex:
+            self.logger.error("Error occured in removing expired data: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def sweep_expired(self, batch_size=None, max_batches=None, pause=0.0, connection=None):
+        """Remove expired values batch by batch.
+        Each batch is committed separately so the table is never locked for long
+
+        :param batch_size: Max number of values removed by each batch. Default is sweep_batch_size
+        :type batch_size: int
+        :param max_batches: Max number of batches. None to continue until no expired value is left
+        :type max_batches: int
+        :param pause: Seconds to sleep between batches to let other writers in
+        :type pause: float
+        :param connection: Connection
+        :type connection: Connection
+        :return: Number of removed values
+        :rtype: int
+        """
+        size = batch_size if batch_size else self.sweep_batch_size
+        ret = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.remove_expired(size, connection)
+            if not count or count < 0:
+                break
+            ret += count
+            batches += 1
+            if count < size:
+                break
+            if pause:
+                time.sleep(pause)
+        return ret
+
+    @release_connection
+    def get_blob(self, key, namespace=None, connection=None):
+        """Get binary value by key
 
         :param key: Key
         :type key: str
@@ -90,7 +1392,8 @@ class KeyValueStore:
         :type namespace: str
         :param connection: Connection
         :type connection: Connection
-        :return: Value or all values in namespace
+        :return: Binary value. None if not found
+        :rtype: bytes
         """
         ns = namespace if namespace else self.namespace
         conn = connection if connection else self.connection
@@ -98,34 +1401,67 @@ class KeyValueStore:
             self.logger.error("Connection is not available")
             return
         ret = None
+        cursor = None
         try:
             cursor = conn.cursor()
-            if key:
-                cursor.execute(self.sqls["get"], (ns, key))
-                row = cursor.fetchone()
-                if row is not None:
-                    r = self.map_record(row)
-                    ret = None if r["value"] is None or str(r["value"]) == "" else json.loads(str(r["value"]))
-            else:
-                ret = {}
-                cursor.execute(self.sqls["get_all"], (ns, ))
-                for row in cursor:
-                    r = self.map_record(row)
-                    ret[str(r["key"])] = None if r["value"] is None or str(r["value"]) == "" else json.loads(str(r["value"]))
+            cursor.execute(self.sqls["blob_get"], (ns, key))
+            chunks = [data for rows in fetch_columns(cursor, ("kv_data", ), self.fetch_size) for data in rows]
+            if chunks:
+                ret = b"".join(chunks)
         except Exception as ex:
             self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
         return ret
 
-    def keys(self, namespace=None, connection=None):
-        """Get all keys in namespace
+    @release_connection_generator
+    def iter_blob(self, key, namespace=None, connection=None):
+        """Iterate chunks of binary value by key, fetching them one by one
 
+        :param key: Key
+        :type key: str
         :param namespace: Namespace of Key-Value
         :type namespace: str
         :param connection: Connection
         :type connection: Connection
-        :return: All keys in namespace
+        :return: Chunks of binary value. Nothing if not found
+        :rtype: generator
+        :raises RuntimeError: Failed to read a chunk
+        """
+        ns = namespace if namespace else self.namespace
+        conn = connection if connection else self.connection
+        if not conn:
+            self.logger.error("Connection is not available")
+            return
+        index = 0
+        while True:
+            chunk = None
+            cursor = None
+            try:
+                cursor = conn.cursor()
+                cursor.execute(self.sqls["blob_get_chunk"], (ns, key, index))
+                chunk = fetch_value(cursor, "kv_data")
+            except Exception as ex:
+                self.logger.error("Error occured in getting data from database: " + str(ex) + "\n" + traceback.format_exc())
+                raise RuntimeError("Failed to read chunk {0} of binary value {1}".format(index, key)) from ex
+            finally:
+                if cursor is not None:
+                    cursor.close()
+            if chunk is None:
+                return
+            yield memoryview(chunk)
+            index += 1
+
+    @release_connection
+    def blob_keys(self, namespace=None, connection=None):
+        """Get all keys of binary values in namespace
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: All keys of binary values in namespace
         :rtype: list
         """
         ret = []
@@ -134,25 +1470,28 @@ class KeyValueStore:
         if not conn:
             self.logger.error("Connection is not available")
             return
+        cursor = None
         try:
             cursor = conn.cursor()
-            cursor.execute(self.sqls["keys"], (ns, ))
-            for row in cursor:
-                r = self.map_record(row)
-                ret.append(str(r["key"]))
+            cursor.execute(self.sqls["blob_keys"], (ns, ))
+            for rows in fetch_columns(cursor, ("kv_key", ), self.fetch_size):
+                ret.extend(map(str, rows))
         except Exception as ex:
             self.logger.error("Error occured in getting keys from database: " + str(ex) + "\n" + traceback.format_exc())
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
         return ret
 
-    def set(self, key, value, namespace=None, connection=None):
-        """Set value with key
+    @release_connection
+    @exclusive_write
+    def set_blob(self, key, data, namespace=None, connection=None):
+        """Set binary value with key. Value is split into rows of blob_chunk_size bytes
 
         :param key: Key
         :type key: str
-        :param value: Value
-        :type value: object
+        :param data: Binary value or file-like object opened in binary mode to read it
+        :type data: bytes
         :param namespace: Namespace of Key-Value
         :type namespace: str
         :param connection: Connection
@@ -165,20 +1504,36 @@ class KeyValueStore:
         if not conn:
             self.logger.error("Connection is not available")
             return False
+        cursor = None
         try:
-            serialized_value = "" if not value else json.dumps(value, cls=DateTimeJSONEncoder)
+            timestamp = self.edit_timestamp(datetime.now(self.timezone))
             cursor = conn.cursor()
-            cursor.execute(self.sqls["set"], self.edit_params(ns, key, serialized_value, datetime.now(self.timezone)))
-            conn.commit()
+            cursor.execute(self.sqls["blob_remove"], (ns, key))
+            if hasattr(data, "read"):
+                chunks = read_chunks(data, self.blob_chunk_size)
+            else:
+                view = memoryview(data).cast("B")
+                chunks = (view[i:i + self.blob_chunk_size] for i in range(0, len(view), self.blob_chunk_size))
+            count = 0
+            for chunk in chunks:
+                cursor.execute(self.sqls["blob_set"], (ns, key, count, bytes(chunk), timestamp))
+                count += 1
+            if count == 0:
+                # Keep the first row for empty value
+                cursor.execute(self.sqls["blob_set"], (ns, key, 0, b"", timestamp))
+            self.commit(conn)
             return True
         except Exception as ex:
             self.logger.error("Error occured in saving data: " + str(ex) + "\n" + traceback.format_exc())
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
         return False
-    
-    def remove(self, key=None, namespace=None, connection=None):
-        """Remove value by key or all values in namespace
+
+    @release_connection
+    @exclusive_write
+    def remove_blob(self, key=None, namespace=None, connection=None):
+        """Remove binary value by key or all binary values in namespace
 
         :param key: Key
         :type key: str
@@ -194,22 +1549,107 @@ class KeyValueStore:
         if not conn:
             self.logger.error("Connection is not available")
             return False
+        cursor = None
         try:
             cursor = conn.cursor()
             if key:
-                cursor.execute(self.sqls["remove"], (ns, key))
+                cursor.execute(self.sqls["blob_remove"], (ns, key))
             else:
-                cursor.execute(self.sqls["remove_all"], (ns, ))
-            conn.commit()
+                cursor.execute(self.sqls["blob_remove_all"], (ns, ))
+            self.commit(conn)
             return True
         except Exception as ex:
             self.logger.error("Error occured in removing data: " + str(ex) + "\n" + traceback.format_exc())
         finally:
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
         return False
 
+    def write_rows(self, cursor, rows):
+        """Write rows with the set SQL in one batch
+
+        :param cursor: Cursor
+        :type cursor: Cursor
+        :param rows: Tuples of namespace, key, serialized value, timestamp and expiry
+        :type rows: list
+        """
+        cursor.executemany(self.sqls["set"], [self.edit_params(*r) for r in rows])
+
+    def copy_rows(self, cursor, rows):
+        """Write rows of import in one batch. Backends override it to use their bulk loading
+
+        :param cursor: Cursor
+        :type cursor: Cursor
+        :param rows: Tuples of namespace, key, serialized value, timestamp and expiry
+        :type rows: list
+        """
+        self.write_rows(cursor, rows)
+
+    def serialize(self, value):
+        """Serialize value to store in database
+
+        :param value: Value
+        :type value: object
+        :return: Serialized value
+        :rtype: str
+        :raises ValueError: Serialized value is longer than max_value_length
+        """
+        ret = "" if not value else encode(value, self.serializer, self.compressor, self.compress_threshold)
+        if self.max_value_length is not None and len(ret) > self.max_value_length:
+            raise ValueError("Serialized value is longer than {0} characters of kv_value column. Use set_blob for large values".format(self.max_value_length))
+        return ret
+
+    def deserialize(self, value):
+        """Deserialize value stored in database
+
+        :param value: Serialized value
+        :type value: str
+        :return: Value
+        """
+        if value is None:
+            return None
+        value = str(value)
+        return decode(value, self.serializer) if value else None
+
+    def decode_rows(self, rows):
+        """Deserialize values of rows. Values that can't be decoded are logged and skipped
+
+        :param rows: Tuples of key and serialized value
+        :type rows: iterable
+        :return: Tuples of key and value
+        :rtype: generator
+        """
+        for key, value in rows:
+            try:
+                yield (key, self.deserialize(value))
+            except Exception as ex:
+                self.decode_failed(key, ex)
+
+    def decode_failed(self, key, ex):
+        """Log value that can't be decoded. It is not an error of connection, so the replica is not ejected
+
+        :param key: Key
+        :type key: str
+        :param ex: Error raised by deserialize
+        :type ex: Exception
+        """
+        self.logger.error("Error occured in decoding value of " + str(key) + ": " + str(ex))
+
     @staticmethod
-    def edit_params(namespace, key, value, timestamp):
+    def expires_at(ttl):
+        """Get expiry of value stored now
+
+        :param ttl: Seconds until the value expires
+        :type ttl: float
+        :return: Expiry in seconds since epoch. None if ttl is None
+        :rtype: float
+        """
+        if ttl is None:
+            return None
+        return time.time() + (ttl.total_seconds() if hasattr(ttl, "total_seconds") else ttl)
+
+    @staticmethod
+    def edit_params(namespace, key, value, timestamp, expires=None):
         """Edit SQL params
 
         :param namespace: Namespace of Key-Value
@@ -220,10 +1660,41 @@ class KeyValueStore:
         :type value: str
         :param timestamp: Timestamp
         :type timestamp: datetime
+        :param expires: Expiry in seconds since epoch
+        :type expires: float
+        :return: params
+        :rtype: tuple
+        """
+        return (namespace, key, value, timestamp, expires)
+
+    @staticmethod
+    def edit_incr_params(namespace, key, delta, timestamp, now):
+        """Edit SQL params of incr
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param timestamp: Timestamp edited by edit_timestamp
+        :type timestamp: object
+        :param now: Current time in seconds since epoch
+        :type now: float
         :return: params
         :rtype: tuple
         """
-        return (namespace, key, value, timestamp)
+        return (namespace, key, str(delta), timestamp, now, delta, now, now)
+
+    @staticmethod
+    def edit_timestamp(timestamp):
+        """Edit timestamp for SQL params
+
+        :param timestamp: Timestamp
+        :type timestamp: datetime
+        :return: Timestamp for SQL params
+        """
+        return timestamp
 
     @staticmethod
     def get_connection(connection_str):
@@ -236,19 +1707,53 @@ class KeyValueStore:
         """
         return None
 
+    @staticmethod
+    def get_reader_connection_str(connection_str):
+        """Get connection string to open the store only for reading
+
+        :param connection_str: Connection string
+        :type connection_str: str
+        :return: Connection string for reader. Same as connection_str for databases
+        :rtype: str
+        """
+        return connection_str
+
+    @staticmethod
+    def check_connection(connection):
+        """Check if connection is alive
+
+        :param connection: Connection
+        :type connection: Connection
+        :return: True if connection is alive
+        :rtype: bool
+        """
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("select 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
     @staticmethod
     def map_record(row):
-        """Map data from record to dict
+        """Map data from record to dict. Not used by KeyValueStore any more, kept for compatibility
 
-        :param row: A row of record set
-        :type row: sqlite3.Row
+        :param row: A row of dict cursor
+        :type row: dict
         :return: Record
         :rtype: dict
         """
+        cols = row.keys()
         return {
-            "key": None if not "kv_key" in row else row["kv_key"],
-            "value": None if not "kv_value" in row else row["kv_value"],
-            "namespace": None if not "kv_namespace" in row else row["kv_namespace"],
+            "key": None if not "kv_key" in cols else row["kv_key"],
+            "value": None if not "kv_value" in cols else row["kv_value"],
+            "namespace": None if not "kv_namespace" in cols else row["kv_namespace"],
+            "timestamp": None if not "kv_timestamp" in cols else row["kv_timestamp"],
+            "data": None if not "kv_data" in cols else row["kv_data"],
         }
 
     @staticmethod
@@ -263,8 +1768,10 @@ class KeyValueStore:
         return {}
 
 class SQLiteKeyValueStore(KeyValueStore):
+    serialize_writes = True
+
     @staticmethod
-    def edit_params(namespace, key, value, timestamp):
+    def edit_params(namespace, key, value, timestamp, expires=None):
         """Edit SQL params
 
         :param namespace: Namespace of Key-Value
@@ -275,10 +1782,23 @@ class SQLiteKeyValueStore(KeyValueStore):
         :type value: str
         :param timestamp: Timestamp
         :type timestamp: datetime
+        :param expires: Expiry in seconds since epoch
+        :type expires: float
         :return: params
         :rtype: tuple
         """
-        return (namespace, key, value, timestamp.strftime("%Y-%m-%d %H:%M:%S %z") if timestamp.tzinfo else timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+        return (namespace, key, value, SQLiteKeyValueStore.edit_timestamp(timestamp), expires)
+
+    @staticmethod
+    def edit_timestamp(timestamp):
+        """Edit timestamp for SQL params
+
+        :param timestamp: Timestamp
+        :type timestamp: datetime
+        :return: Timestamp for SQL params
+        :rtype: str
+        """
+        return timestamp.strftime("%Y-%m-%d %H:%M:%S %z") if timestamp.tzinfo else timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
     @staticmethod
     def get_connection(connection_str):
@@ -289,13 +1809,12 @@ class SQLiteKeyValueStore(KeyValueStore):
         :return: Connection
         :rtype: Connection
         """
-        conn = sqlite3.connect(connection_str)
-        conn.row_factory = sqlite3.Row
+        conn = sqlite3.connect(connection_str, check_same_thread=False)
         return conn
 
     @staticmethod
     def map_record(row):
-        """Map data from record to dict
+        """Map data from record to dict. Not used by KeyValueStore any more, kept for compatibility
 
         :param row: A row of record set
         :type row: sqlite3.Row
@@ -307,6 +1826,8 @@ class SQLiteKeyValueStore(KeyValueStore):
             "key": None if not "kv_key" in cols else row["kv_key"],
             "value": None if not "kv_value" in cols else row["kv_value"],
             "namespace": None if not "kv_namespace" in cols else row["kv_namespace"],
+            "timestamp": None if not "kv_timestamp" in cols else row["kv_timestamp"],
+            "data": None if not "kv_data" in cols else row["kv_data"],
         }
 
     @staticmethod
@@ -318,19 +1839,186 @@ class SQLiteKeyValueStore(KeyValueStore):
         :return: Dictionary of SQL
         :rtype: dict
         """
-        return {
+        sqls = {
             "prepare_check": "select * from sqlite_master where type='table' and name='{0}'".format(table_name),
-            "prepare_create": "create table {0} (kv_namespace TEXT, kv_key TEXT, kv_value TEXT, kv_timestamp TEXT, primary key(kv_namespace, kv_key))".format(table_name),
-            "get": "select kv_value from {0} where kv_namespace=? and kv_key=?".format(table_name),
-            "get_all": "select kv_key, kv_value from {0} where kv_namespace=?".format(table_name),
-            "keys": "select kv_key from {0} where kv_namespace=?".format(table_name),
-            "set": "replace into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (?,?,?,?)".format(table_name),
+            "prepare_create": "create table {0} (kv_namespace TEXT, kv_key TEXT, kv_value TEXT, kv_timestamp TEXT, kv_expires REAL, primary key(kv_namespace, kv_key))".format(table_name),
+            "prepare_check_index": "select * from sqlite_master where type='index' and name='{0}_ts_idx'".format(table_name),
+            "prepare_create_index": "create index {0}_ts_idx on {0} (kv_namespace, kv_timestamp)".format(table_name),
+            "prepare_check_expires": "select * from pragma_table_info('{0}') where name='kv_expires'".format(table_name),
+            "prepare_alter_expires": "alter table {0} add column kv_expires REAL".format(table_name),
+            "prepare_check_expires_index": "select * from sqlite_master where type='index' and name='{0}_exp_idx'".format(table_name),
+            "prepare_create_expires_index": "create index {0}_exp_idx on {0} (kv_expires)".format(table_name),
+            "probe_table": "select kv_key from {0} where 1=0".format(table_name),
+            "probe_expires": "select kv_expires from {0} where 1=0".format(table_name),
+            "get": "select kv_value from {0} where kv_namespace=? and kv_key=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "get_all": "select kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "keys": "select kv_key from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "changes": "select kv_key, kv_timestamp from {0} where kv_namespace=? and kv_timestamp>=? order by kv_timestamp".format(table_name),
+            "namespaces": "select distinct kv_namespace from {0}".format(table_name),
+            "scan_keys": "select kv_key from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_items": "select kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "scan_rows": "select kv_key, kv_value, kv_expires from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key limit {{1}}".format(table_name),
+            "count": "select count(*) as kv_count from {0} where kv_namespace=?".format(table_name),
+            "key_at": "select kv_key from {0} where kv_namespace=? order by kv_key limit 1 offset ?".format(table_name),
+            "get_many": "select kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) and kv_key in ({{0}})".format(table_name),
+            "set": "replace into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (?,?,?,?,?)".format(table_name),
             "remove": "delete from {0} where kv_namespace=? and kv_key=?".format(table_name),
+            "remove_many": "delete from {0} where kv_namespace=? and kv_key in ({{0}})".format(table_name),
             "remove_all": "delete from {0} where kv_namespace=?".format(table_name),
+            "remove_expired": "delete from {0} where (kv_namespace, kv_key) in (select kv_namespace, kv_key from {0} where kv_expires<=? limit {{0}})".format(table_name),
+            "remove_expired_key": "delete from {0} where kv_namespace=? and kv_key=? and kv_expires<=?".format(table_name),
+            "insert_new": "insert or ignore into {0} (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (?,?,?,?,?)".format(table_name),
+            "compare_and_set": "update {0} set kv_value=?, kv_timestamp=?, kv_expires=? where kv_namespace=? and kv_key=? and kv_value=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "incr": """insert into {0} (kv_namespace, kv_key, kv_value, kv_timestamp) values (?,?,?,?)
+                    on conflict (kv_namespace, kv_key) do update set
+                    kv_value=cast(case when kv_expires<=? then 0 else cast(coalesce(nullif(kv_value, ''), '0') as integer) end + ? as text),
+                    kv_timestamp=excluded.kv_timestamp, kv_expires=case when kv_expires<=? then null else kv_expires end
+                    where kv_expires<=? or kv_value='' or kv_value=cast(cast(kv_value as integer) as text)
+                    returning kv_value""".format(table_name),
+            "prepare_check_blob": "select * from sqlite_master where type='table' and name='{0}_blob'".format(table_name),
+            "prepare_create_blob": "create table {0}_blob (kv_namespace TEXT, kv_key TEXT, kv_chunk INTEGER, kv_data BLOB, kv_timestamp TEXT, primary key(kv_namespace, kv_key, kv_chunk))".format(table_name),
+            "blob_get": "select kv_data from {0}_blob where kv_namespace=? and kv_key=? order by kv_chunk".format(table_name),
+            "blob_get_chunk": "select kv_data from {0}_blob where kv_namespace=? and kv_key=? and kv_chunk=?".format(table_name),
+            "blob_keys": "select kv_key from {0}_blob where kv_namespace=? and kv_chunk=0".format(table_name),
+            "blob_set": "insert into {0}_blob (kv_namespace, kv_key, kv_chunk, kv_data, kv_timestamp) values (?,?,?,?,?)".format(table_name),
+            "blob_remove": "delete from {0}_blob where kv_namespace=? and kv_key=?".format(table_name),
+            "blob_remove_all": "delete from {0}_blob where kv_namespace=?".format(table_name),
         }
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            # RETURNING is not supported
+            sqls["incr"] = sqls["incr"].rsplit("returning", 1)[0]
+            sqls["incr_get"] = "select kv_value from {0} where kv_namespace=? and kv_key=?".format(table_name)
+        return sqls
+
+
+class TunedSQLiteKeyValueStore(SQLiteKeyValueStore):
+    """SQLite with WAL journal, tuned PRAGMAs and WITHOUT ROWID table
+
+    PRAGMAs can be set in connection string like "pycoki.db;synchronous=FULL;mmap_size=0".
+    Call migrate_table to convert the table created by SQLiteKeyValueStore.
+    """
+    # Default PRAGMAs applied to each connection
+    pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+    }
+    # Number of prepared statements cached by each connection
+    cached_statements = 256
+
+    @classmethod
+    def get_connection(cls, connection_str):
+        """Get connection by given connection string
+
+        :param connection_str: Connection string like "pycoki.db;synchronous=NORMAL;cache_size=-65536"
+        :type connection_str: str
+        :return: Connection
+        :rtype: Connection
+        """
+        params = connection_str.split(";")
+        pragmas = dict(cls.pragmas)
+        cached_statements = cls.cached_statements
+        for pv in params[1:]:
+            if "=" in pv:
+                p, v = list(map(str.strip, pv.split("=", 1)))
+                if not (p.replace("_", "").isalnum() and v.replace("-", "").replace("_", "").isalnum()):
+                    raise ValueError("Invalid parameter: " + pv)
+                if p == "cached_statements":
+                    cached_statements = int(v)
+                else:
+                    pragmas[p] = v
+        conn = sqlite3.connect(params[0], check_same_thread=False, cached_statements=cached_statements)
+        for p, v in pragmas.items():
+            conn.execute("pragma {0}={1}".format(p, v)).fetchall()
+        return conn
+
+    @release_connection
+    def migrate_table(self, connection=None):
+        """Convert the table to WITHOUT ROWID table if it is not
 
+        :param connection: Connection
+        :type connection: Connection
+        :return: True if converted
+        :rtype: bool
+        """
+        conn = connection if connection else self.connection
+        # Add the columns of newer versions first to copy rows by "select *"
+        if not self.init_table(connection=conn):
+            return False
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sqls["migrate_check"])
+            row = cursor.fetchone()
+            if row is None or "without rowid" in str(row[0]).lower():
+                return False
+            cursor.execute("begin immediate")
+            try:
+                for name in ("migrate_create", "migrate_copy", "migrate_drop", "migrate_rename", "prepare_create_index", "prepare_create_expires_index"):
+                    cursor.execute(self.sqls[name])
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return True
+        except Exception as ex:
+            self.logger.error("Error occured in migrating table: " + str(ex) + "\n" + traceback.format_exc())
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return False
+
+    @staticmethod
+    def get_sqls(table_name):
+        """Get dictionary of SQLs called in methods of KeyValueStore
+
+        :param table_name: Key-Value store table
+        :type table_name: str
+        :return: Dictionary of SQL
+        :rtype: dict
+        """
+        sqls = SQLiteKeyValueStore.get_sqls(table_name)
+        sqls["prepare_create"] += " without rowid"
+        sqls["migrate_check"] = "select sql from sqlite_master where type='table' and name='{0}'".format(table_name)
+        sqls["migrate_create"] = SQLiteKeyValueStore.get_sqls(table_name + "_migrating")["prepare_create"] + " without rowid"
+        sqls["migrate_copy"] = "insert into {0}_migrating select * from {0}".format(table_name)
+        sqls["migrate_drop"] = "drop table {0}".format(table_name)
+        sqls["migrate_rename"] = "alter table {0}_migrating rename to {0}".format(table_name)
+        return sqls
 
-def start(connection_str=None, namespace=None, logger=None, tzone=None, connection=None, table_name=None, init_table=False, init_params=tuple(), kvsclass=None):
+
+def register_backend(name, path):
+    """Register KeyValueStore class by name to use it like start(kvsclass=name)
+
+    :param name: Name of backend
+    :type name: str
+    :param path: Dotted path of class like mypackage.MyKeyValueStore. Module is imported on first use
+    :type path: str
+    """
+    BACKENDS[name] = path
+
+def get_backend(kvsclass=None):
+    """Get KeyValueStore class by name or dotted path. Module of the class is imported here
+
+    :param kvsclass: Name of backend (sqlite, tuned_sqlite, mysql, pgsql, sqldb, mmap), dotted path or class. None for SQLite
+    :type kvsclass: str
+    :return: Class of KeyValueStore
+    :rtype: type
+    """
+    if kvsclass is None:
+        return SQLiteKeyValueStore
+    if not isinstance(kvsclass, str):
+        return kvsclass
+    path = BACKENDS.get(kvsclass, kvsclass)
+    if "." not in path:
+        raise ValueError("Unknown backend: " + kvsclass)
+    module_name, class_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+def start(connection_str=None, namespace=None, logger=None, tzone=None, connection=None, table_name=None, init_table=False, init_params=tuple(), kvsclass=None, use_pool=False, serializer=None, compression=None, compress_threshold=1024, instrumentation=None, thread_safe=False, replicas=None, read_after_write_window=1.0, health_check_interval=10, eject_interval=30, pool_size=None, pool_timeout=30, allow_pickle=False):
     """Get a new instance of KVS
 
     :param connection_str: Connection string
@@ -347,23 +2035,82 @@ def start(connection_str=None, namespace=None, logger=None, tzone=None, connecti
     :type table_name: str
     :param init_table: Create new table if it doesn't exist
     :type init_table: bool
+    :param kvsclass: Name of backend (sqlite, tuned_sqlite, mysql, pgsql, sqldb, mmap), dotted path or class. None for SQLite
+    :type kvsclass: str
+    :param use_pool: Get connection from the pool shared in the process and return it when closed
+    :type use_pool: bool
+    :param serializer: Serializer name (json, typed_json, orjson, msgpack, pickle) or instance. None for JSON. pickle requires allow_pickle
+    :type serializer: str
+    :param compression: Compression name (zlib, lz4) or instance. None for no compression
+    :type compression: str
+    :param compress_threshold: Compress only values larger than this bytes
+    :type compress_threshold: int
+    :param instrumentation: Instrumentation to measure operations
+    :type instrumentation: pycoki.metrics.Instrumentation
+    :param thread_safe: Use a connection for each thread. connection_str is required. With use_pool, the connection is taken from the pool for each operation or transaction
+    :type thread_safe: bool
+    :param replicas: Connection strings of read replicas. Reads are load-balanced across them
+    :type replicas: list
+    :param read_after_write_window: Seconds to read from primary after the last write
+    :type read_after_write_window: float
+    :param health_check_interval: Seconds between health checks of each replica connection
+    :type health_check_interval: float
+    :param eject_interval: Seconds to stop using replica after it failed
+    :type eject_interval: float
+    :param pool_size: Max number of connections of the pool. Applied when the pool is created in the process. Default is 5
+    :type pool_size: int
+    :param pool_timeout: Seconds to wait for a connection from the pool. TimeoutError is raised when exceeded. None to wait forever
+    :type pool_timeout: float
+    :param allow_pickle: Allow pickle serializer. Values are loaded by pickle only if it is the serializer
+    :type allow_pickle: bool
     :return: Instance of KeyValueStore
     :rtype: KeyValueStore
     """
-    cls = kvsclass if kvsclass else SQLiteKeyValueStore
+    cls = get_backend(kvsclass)
+    pool = None
+    if use_pool and connection_str:
+        pool = get_pool(cls, connection_str, max_size=pool_size) if pool_size else get_pool(cls, connection_str)
+    table_name = table_name if table_name else DEFAULT_TABLE_NAME
+    connection_factory = None
+    if thread_safe and connection_str:
+        connection_factory = functools.partial(pool.acquire, pool_timeout) if pool else functools.partial(cls.get_connection, connection_str)
+    elif connection_str:
+        connection = pool.acquire(pool_timeout) if pool else cls.get_connection(connection_str)
+    replica_set = None
+    if replicas:
+        replica_set = ReplicaSet(cls, replicas, logger=logger, thread_safe=connection_factory is not None, health_check_interval=health_check_interval, eject_interval=eject_interval)
     ret = cls(
         namespace=namespace if namespace else "__",
         logger=logger if logger else logging.getLogger(__name__),
-        tzone=tzone if tzone else timezone("UTC"),
-        connection=connection if not connection_str else cls.get_connection(connection_str),
+        tzone=tzone if tzone else timezone.utc,
+        connection=connection,
         close_connection=False if not connection_str else True,
-        sqls=cls.get_sqls(table_name if table_name else DEFAULT_TABLE_NAME)
+        sqls=cls.get_sqls(table_name),
+        pool=pool,
+        serializer=serializer,
+        compression=compression,
+        compress_threshold=compress_threshold,
+        instrumentation=instrumentation,
+        connection_factory=connection_factory,
+        replicas=replica_set,
+        read_after_write_window=read_after_write_window,
+        allow_pickle=allow_pickle
     )
-    if init_table:
+    if init_table and pool is None:
         ret.init_table(query_params=init_params)
+    elif init_table and table_name not in pool.initialized_tables:
+        if ret.init_table(query_params=init_params):
+            pool.initialized_tables.add(table_name)
+    elif not init_table and (connection_str or connection is not None):
+        # Tables created by older versions have no kv_expires column
+        try:
+            ret.upgrade_table()
+        except Exception:
+            ret.close()
+            raise
     return ret
 
-def get(key=None, namespace=None, connection_str=None, init_table=True, init_params=tuple(), kvsclass=None):
+def get(key=None, namespace=None, connection_str=None, init_table=True, init_params=tuple(), kvsclass=None, use_pool=True):
     """Getter without instancing
 
     :param key: Key
@@ -372,16 +2119,20 @@ def get(key=None, namespace=None, connection_str=None, init_table=True, init_par
     :type namespace: str
     :param connection_str: Connection string
     :type connection_str: str
+    :param use_pool: Use connection pool shared in the process
+    :type use_pool: bool
     :return: Value or all values in namespace
     """
-    cls = kvsclass if kvsclass else SQLiteKeyValueStore
+    cls = get_backend(kvsclass)
+    temp = None
     try:
-        temp = start(connection_str=connection_str if connection_str else DEFAULT_CONNECTION_STR, init_table=init_table, init_params=init_params, kvsclass=cls)
+        temp = start(connection_str=connection_str if connection_str else DEFAULT_CONNECTION_STR, init_table=init_table, init_params=init_params, kvsclass=cls, use_pool=use_pool)
         return temp.get(key=key, namespace=namespace)
     finally:
-        temp.close()
+        if temp is not None:
+            temp.close()
 
-def set(key, value, namespace=None, connection_str=None, init_table=True, init_params=tuple(), kvsclass=None):
+def set(key, value, namespace=None, connection_str=None, init_table=True, init_params=tuple(), kvsclass=None, use_pool=True):
     """Setter without instancing
 
     :param key: Key
@@ -392,13 +2143,17 @@ def set(key, value, namespace=None, connection_str=None, init_table=True, init_p
     :type namespace: str
     :param connection_str: Connection string
     :type connection_str: str
+    :param use_pool: Use connection pool shared in the process
+    :type use_pool: bool
     :return: Result
     :rtype: bool
     """
-    cls = kvsclass if kvsclass else SQLiteKeyValueStore
+    cls = get_backend(kvsclass)
+    temp = None
     try:
-        temp = start(connection_str=connection_str if connection_str else DEFAULT_CONNECTION_STR, init_table=init_table, init_params=init_params, kvsclass=cls)
+        temp = start(connection_str=connection_str if connection_str else DEFAULT_CONNECTION_STR, init_table=init_table, init_params=init_params, kvsclass=cls, use_pool=use_pool)
         return temp.set(key=key, value=value, namespace=namespace)
     finally:
-        temp.close()
+        if temp is not None:
+            temp.close()
     return False
@@ -0,0 +1,142 @@
+"""Pycoki read replicas"""
+
+import itertools
+import threading
+import time
+import logging
+import traceback
+
+class ReplicaSet:
+    def __init__(self, kvsclass, connection_strs, logger=None, thread_safe=False, health_check_interval=10, eject_interval=30):
+        """Constractor of ReplicaSet
+        Connect to replicas lazily and choose healthy one by round robin
+
+        :param kvsclass: Class of KeyValueStore to create connections
+        :type kvsclass: type
+        :param connection_strs: Connection strings of replicas
+        :type connection_strs: list
+        :param logger: Logger
+        :type logger: logging.Logger
+        :param thread_safe: Use a connection for each thread
+        :type thread_safe: bool
+        :param health_check_interval: Seconds between health checks of each connection
+        :type health_check_interval: float
+        :param eject_interval: Seconds to stop using replica after it failed
+        :type eject_interval: float
+        """
+        self.kvsclass = kvsclass
+        self.connection_strs = list(connection_strs)
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.health_check_interval = health_check_interval
+        self.eject_interval = eject_interval
+        self.ejected_until = [0.0] * len(self.connection_strs)
+        self.ejected_at = [0.0] * len(self.connection_strs)
+        self.counter = itertools.count()
+        self.local = threading.local() if thread_safe else None
+        self.shared_states = {}
+        self.all_states = []
+        self.lock = threading.Lock()
+
+    @property
+    def states(self):
+        """Connections and their last checked time by index of replica. Each thread has its own in thread safe mode
+        """
+        if self.local is None:
+            return self.shared_states
+        states = getattr(self.local, "states", None)
+        if states is None:
+            states = {}
+            self.local.states = states
+            with self.lock:
+                self.all_states.append(states)
+        return states
+
+    def acquire(self):
+        """Get connection of a healthy replica
+
+        :return: Connection. None if no replica is available
+        :rtype: Connection
+        """
+        count = len(self.connection_strs)
+        for _ in range(count):
+            index = next(self.counter) % count
+            now = time.monotonic()
+            if self.ejected_until[index] > now:
+                continue
+            state = self.states.get(index)
+            if state is None:
+                try:
+                    state = [self.kvsclass.get_connection(self.connection_strs[index]), now]
+                except Exception as ex:
+                    self.logger.error("Error occured in connecting to replica: " + str(ex) + "\n" + traceback.format_exc())
+                    self.eject_index(index)
+                    continue
+                self.states[index] = state
+            elif now - state[1] >= self.health_check_interval or state[1] < self.ejected_at[index]:
+                if not self.kvsclass.check_connection(state[0]):
+                    self.logger.warning("Replica is unhealthy: " + str(index))
+                    self.eject_index(index)
+                    del self.states[index]
+                    self.close_connection(state[0])
+                    continue
+                state[1] = now
+            return state[0]
+        return None
+
+    def eject(self, connection):
+        """Stop using the replica of connection for eject_interval seconds
+        Connection is kept open and checked before it is used again
+
+        :param connection: Connection of replica
+        :type connection: Connection
+        :return: True if connection is of replica
+        :rtype: bool
+        """
+        for index, state in list(self.states.items()):
+            if state[0] is connection:
+                self.eject_index(index)
+                return True
+        return False
+
+    def ejected(self, connection):
+        """Check if the replica of connection is ejected now
+
+        :param connection: Connection
+        :type connection: Connection
+        :return: True if connection is of ejected replica
+        :rtype: bool
+        """
+        now = time.monotonic()
+        for index, state in list(self.states.items()):
+            if state[0] is connection:
+                return self.ejected_until[index] > now
+        return False
+
+    def eject_index(self, index):
+        """Stop using replica for eject_interval seconds
+
+        :param index: Index of replica
+        :type index: int
+        """
+        now = time.monotonic()
+        self.ejected_until[index] = now + self.eject_interval
+        self.ejected_at[index] = now
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception as ex:
+            self.logger.error("Error occured in closing connection: " + str(ex) + "\n" + traceback.format_exc())
+
+    def close(self):
+        """Close connections of all threads
+        """
+        with self.lock:
+            all_states = [self.shared_states] + self.all_states
+            self.all_states = []
+        for states in all_states:
+            for state in list(states.values()):
+                self.close_connection(state[0])
+            states.clear()
+        if self.local is not None:
+            self.local = threading.local()
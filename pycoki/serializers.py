@@ -0,0 +1,234 @@
+"""Pycoki serializers and compressors
+
+Values are stored as JSON text without tag by default.
+Values serialized by other serializers or compressed are stored as "~{serializer tag}{compression tag}:{payload}"
+and payload is encoded by base64 if it is binary.
+Only untagged values and values of the configured serializer are read, so that values written by others can't choose the deserializer.
+"""
+
+from datetime import datetime
+import base64
+import json
+
+TAG_PREFIX = "~"
+
+class DateTimeJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            if obj.tzinfo:
+                return obj.strftime("%Y-%m-%d %H:%M:%S %z")
+            else:
+                return obj.strftime("%Y-%m-%d %H:%M:%S")
+        return super().default(obj)
+
+class TypedJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return {"__datetime__": obj.isoformat()}
+        return super().default(obj)
+
+def typed_json_hook(obj):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+class JSONSerializer:
+    """JSON by json module. Datetimes are stored as string"""
+    name = "json"
+    tag = "j"
+    binary = False
+
+    def dumps(self, value):
+        return json.dumps(value, cls=DateTimeJSONEncoder)
+
+    def loads(self, data):
+        return json.loads(data)
+
+class TypedJSONSerializer:
+    """JSON by json module. Datetimes are restored as datetime"""
+    name = "typed_json"
+    tag = "t"
+    binary = False
+
+    def dumps(self, value):
+        return json.dumps(value, cls=TypedJSONEncoder)
+
+    def loads(self, data):
+        return json.loads(data, object_hook=typed_json_hook)
+
+class OrjsonSerializer:
+    """JSON by orjson. Datetimes are stored as string"""
+    name = "orjson"
+    tag = "o"
+    binary = False
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, value):
+        return self.orjson.dumps(value, option=self.orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+class MsgpackSerializer:
+    """MessagePack by msgpack. Timezone aware datetimes are restored as datetime"""
+    name = "msgpack"
+    tag = "m"
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, value):
+        return self.msgpack.packb(value, datetime=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, timestamp=3)
+
+class PickleSerializer:
+    """Pickle. Any picklable objects are restored. Enabled only by allow_pickle because loading runs arbitrary code"""
+    name = "pickle"
+    tag = "p"
+    binary = True
+
+    def __init__(self):
+        import pickle
+        self.pickle = pickle
+
+    def dumps(self, value):
+        return self.pickle.dumps(value, protocol=self.pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return self.pickle.loads(data)
+
+class ZlibCompressor:
+    name = "zlib"
+    tag = "z"
+
+    def __init__(self, level=6):
+        import zlib
+        self.zlib = zlib
+        self.level = level
+
+    def compress(self, data):
+        return self.zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return self.zlib.decompress(data)
+
+class LZ4Compressor:
+    name = "lz4"
+    tag = "l"
+
+    def __init__(self):
+        import lz4.frame
+        self.lz4 = lz4.frame
+
+    def compress(self, data):
+        return self.lz4.compress(data)
+
+    def decompress(self, data):
+        return self.lz4.decompress(data)
+
+
+serializer_classes = [JSONSerializer, TypedJSONSerializer, OrjsonSerializer, MsgpackSerializer, PickleSerializer]
+compressor_classes = [ZlibCompressor, LZ4Compressor]
+instances = {}
+
+def get_instance(classes, name_or_tag, by_tag=False):
+    """Get shared instance of serializer or compressor
+
+    :param classes: Classes to search
+    :type classes: list
+    :param name_or_tag: Name or tag
+    :type name_or_tag: str
+    :param by_tag: Search by tag instead of name
+    :type by_tag: bool
+    :return: Instance
+    """
+    for cls in classes:
+        if (cls.tag if by_tag else cls.name) == name_or_tag:
+            if cls not in instances:
+                instances[cls] = cls()
+            return instances[cls]
+    raise ValueError("Unknown serializer or compression: " + str(name_or_tag))
+
+def get_serializer(serializer, allow_pickle=False):
+    """Get serializer by name or instance
+
+    :param serializer: Name of serializer or instance. None for default JSON
+    :type serializer: str
+    :param allow_pickle: Allow pickle serializer
+    :type allow_pickle: bool
+    :return: Serializer
+    :raises ValueError: Pickle serializer is given without allow_pickle
+    """
+    if isinstance(serializer, str):
+        serializer = get_instance(serializer_classes, serializer)
+    if serializer is not None and serializer.tag == PickleSerializer.tag and not allow_pickle:
+        raise ValueError("Pickle serializer runs arbitrary code when loading values. Set allow_pickle=True only if all writers are trusted")
+    return serializer
+
+def get_compressor(compression):
+    """Get compressor by name or instance
+
+    :param compression: Name of compression or instance. None for no compression
+    :type compression: str
+    :return: Compressor
+    """
+    if compression is None or not isinstance(compression, str):
+        return compression
+    return get_instance(compressor_classes, compression)
+
+def encode(value, serializer=None, compressor=None, compress_threshold=0):
+    """Serialize and compress value to text
+
+    :param value: Value
+    :type value: object
+    :param serializer: Serializer. None for default JSON
+    :type serializer: object
+    :param compressor: Compressor. None for no compression
+    :type compressor: object
+    :param compress_threshold: Compress only when serialized data is larger than this bytes
+    :type compress_threshold: int
+    :return: Text to store
+    :rtype: str
+    """
+    if serializer is None and compressor is None:
+        return json.dumps(value, cls=DateTimeJSONEncoder)
+    serializer = serializer if serializer else get_instance(serializer_classes, "json")
+    data = serializer.dumps(value)
+    if compressor is not None and len(data) > compress_threshold:
+        data = compressor.compress(data if serializer.binary else data.encode("utf-8"))
+        return TAG_PREFIX + serializer.tag + compressor.tag + ":" + base64.b64encode(data).decode("ascii")
+    if serializer.binary:
+        return TAG_PREFIX + serializer.tag + ":" + base64.b64encode(data).decode("ascii")
+    if serializer.tag == "j":
+        return data
+    return TAG_PREFIX + serializer.tag + ":" + data
+
+def decode(text, serializer=None):
+    """Decompress and deserialize text stored by encode
+
+    :param text: Stored text
+    :type text: str
+    :param serializer: Configured serializer. None for default JSON
+    :type serializer: object
+    :return: Value
+    :raises ValueError: Value is tagged with other serializer
+    """
+    if not text.startswith(TAG_PREFIX):
+        return json.loads(text)
+    tags, payload = text[1:].split(":", 1)
+    serializer = serializer if serializer else get_instance(serializer_classes, "json")
+    if tags[:1] != serializer.tag:
+        raise ValueError("Value is serialized by other serializer than " + serializer.name + ": " + tags[:1])
+    if len(tags) > 1:
+        data = get_instance(compressor_classes, tags[1], by_tag=True).decompress(base64.b64decode(payload))
+        return serializer.loads(data if serializer.binary else data.decode("utf-8"))
+    if serializer.binary:
+        return serializer.loads(base64.b64decode(payload))
+    return serializer.loads(payload)
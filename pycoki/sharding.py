@@ -0,0 +1,463 @@
+"""Pycoki sharding
+
+Spread values over multiple KeyValueStores (any mix of backends) by consistent hashing of namespace and key.
+"""
+
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import hashlib
+import heapq
+import itertools
+import time
+from pycoki.pycoki import split_chunks
+
+class HashRing:
+    def __init__(self, nodes, vnodes=100):
+        """Constractor of HashRing
+        Each node is placed at vnodes points on the ring, so only about 1/N of keys move when a node is added
+
+        :param nodes: Names of nodes
+        :type nodes: list
+        :param vnodes: Number of points of each node
+        :type vnodes: int
+        """
+        self.nodes = list(nodes)
+        self.vnodes = vnodes
+        points = sorted((self.hash("{0}#{1}".format(node, i)), node) for node in self.nodes for i in range(vnodes))
+        self.hashes = [p[0] for p in points]
+        self.owners = [p[1] for p in points]
+
+    @staticmethod
+    def hash(text):
+        return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "big")
+
+    def node(self, namespace, key):
+        """Get node for namespace and key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :return: Name of node
+        :rtype: str
+        """
+        index = bisect(self.hashes, self.hash(str(namespace) + "\0" + str(key)))
+        return self.owners[index % len(self.owners)]
+
+
+class ShardedKeyValueStore:
+    def __init__(self, shards, vnodes=100, parallel=True, migrate_batch_size=1000):
+        """Constractor of ShardedKeyValueStore
+        Values of a namespace are spread over all shards. Transactions are not atomic across shards.
+
+        :param shards: KeyValueStores by name of shard, or list of them named by index. Names decide the placement of keys, so keep them stable
+        :type shards: dict
+        :param vnodes: Number of points of each shard on the hash ring
+        :type vnodes: int
+        :param parallel: Query shards in parallel threads when reading whole namespace
+        :type parallel: bool
+        :param migrate_batch_size: Number of values moved at once in rebalancing
+        :type migrate_batch_size: int
+        """
+        self.shards = dict(shards) if isinstance(shards, dict) else {str(i): s for i, s in enumerate(shards)}
+        self.vnodes = vnodes
+        self.parallel = parallel
+        self.migrate_batch_size = migrate_batch_size
+        self.ring = HashRing(self.shards, vnodes)
+        self.executor = None
+        # Tuples of shard, namespace and keys moved to other shards and failed to remove from it
+        self.stale = []
+        first = next(iter(self.shards.values()))
+        self.namespace = first.namespace
+        self.logger = first.logger
+
+    def shard(self, key, namespace=None):
+        """Get the shard of key
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Shard
+        :rtype: KeyValueStore
+        """
+        return self.shards[self.ring.node(namespace if namespace else self.namespace, key)]
+
+    def group(self, keys, namespace):
+        """Group keys by shard
+
+        :param keys: Keys
+        :type keys: iterable
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Lists of keys by name of shard
+        :rtype: dict
+        """
+        ret = {}
+        for k in keys:
+            ret.setdefault(self.ring.node(namespace, k), []).append(k)
+        return ret
+
+    def fan_out(self, func, shards=None):
+        """Call function with each shard
+
+        :param func: Function called with shard
+        :type func: function
+        :param shards: Shards to call. All shards by default
+        :type shards: list
+        :return: Return values in order of shards
+        :rtype: list
+        """
+        shards = list(shards if shards is not None else self.shards.values())
+        if not self.parallel or len(shards) < 2:
+            return [func(s) for s in shards]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(len(self.shards), thread_name_prefix="pycoki-shard")
+        return list(self.executor.map(func, shards))
+
+    def get(self, key=None, namespace=None):
+        """Get value by key or all values in namespace from all shards
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Value or all values in namespace
+        """
+        ns = namespace if namespace else self.namespace
+        if key:
+            return self.shard(key, ns).get(key, namespace=ns)
+        ret = {}
+        for values in self.fan_out(lambda s: s.get(namespace=ns)):
+            ret.update(values or {})
+        return ret
+
+    def keys(self, namespace=None, prefix=None, start=None, end=None, limit=None):
+        """Get all keys in namespace from all shards, or keys in range in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of keys
+        :type limit: int
+        :return: Keys
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        results = self.fan_out(lambda s: s.keys(namespace=ns, prefix=prefix, start=start, end=end, limit=limit) or [])
+        if not (prefix or start is not None or end is not None or limit is not None):
+            return list(itertools.chain.from_iterable(results))
+        return list(itertools.islice(heapq.merge(*results), limit))
+
+    def items(self, namespace=None, prefix=None, start=None, end=None, limit=None):
+        """Get keys and values in range in order of key from all shards
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param prefix: Get only keys starting with prefix
+        :type prefix: str
+        :param start: Get only keys greater than or equal to start
+        :type start: str
+        :param end: Get only keys less than end
+        :type end: str
+        :param limit: Max number of items
+        :type limit: int
+        :return: Tuples of key and value
+        :rtype: list
+        """
+        ns = namespace if namespace else self.namespace
+        results = self.fan_out(lambda s: s.items(namespace=ns, prefix=prefix, start=start, end=end, limit=limit) or [])
+        return list(itertools.islice(heapq.merge(*results, key=lambda kv: kv[0]), limit))
+
+    def iter_keys(self, namespace=None, batch_size=1000, prefix=None, start=None, end=None):
+        """Iterate keys in namespace of all shards in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param batch_size: Number of keys fetched from each shard at once
+        :type batch_size: int
+        :param prefix: Iterate only keys starting with prefix
+        :type prefix: str
+        :param start: Iterate only keys greater than or equal to start
+        :type start: str
+        :param end: Iterate only keys less than end
+        :type end: str
+        :return: Keys
+        :rtype: generator
+        """
+        ns = namespace if namespace else self.namespace
+        return heapq.merge(*[s.iter_keys(namespace=ns, batch_size=batch_size, prefix=prefix, start=start, end=end) for s in self.shards.values()])
+
+    def iter_items(self, namespace=None, batch_size=1000, prefix=None, start=None, end=None):
+        """Iterate keys and values in namespace of all shards in order of key
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param batch_size: Number of items fetched from each shard at once
+        :type batch_size: int
+        :param prefix: Iterate only keys starting with prefix
+        :type prefix: str
+        :param start: Iterate only keys greater than or equal to start
+        :type start: str
+        :param end: Iterate only keys less than end
+        :type end: str
+        :return: Tuples of key and value
+        :rtype: generator
+        """
+        ns = namespace if namespace else self.namespace
+        return heapq.merge(*[s.iter_items(namespace=ns, batch_size=batch_size, prefix=prefix, start=start, end=end) for s in self.shards.values()], key=lambda kv: kv[0])
+
+    def namespaces(self):
+        """Get all namespaces that have values in any shard
+
+        :return: Namespaces
+        :rtype: list
+        """
+        ret = set()
+        for nss in self.fan_out(lambda s: s.namespaces() or []):
+            ret.update(nss)
+        return sorted(ret)
+
+    def get_many(self, keys, namespace=None):
+        """Get values by multiple keys with one query for each shard
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Values by key. Keys not found are not included
+        :rtype: dict
+        """
+        ns = namespace if namespace else self.namespace
+        ret = {}
+        for name, ks in self.group(keys, ns).items():
+            ret.update(self.shards[name].get_many(ks, namespace=ns) or {})
+        return ret
+
+    def set(self, key, value, namespace=None, **kwargs):
+        """Set value with key to its shard
+
+        :param key: Key
+        :type key: str
+        :param value: Value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        return self.shard(key, ns).set(key, value, namespace=ns, **kwargs)
+
+    def set_many(self, values, namespace=None, **kwargs):
+        """Set multiple values with one batch for each shard
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        ret = True
+        for name, ks in self.group(values, ns).items():
+            ret = self.shards[name].set_many({k: values[k] for k in ks}, namespace=ns, **kwargs) and ret
+        return ret
+
+    def remove(self, key=None, namespace=None):
+        """Remove value by key or all values in namespace from all shards
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        if key:
+            return self.shard(key, ns).remove(key, namespace=ns)
+        return all(self.fan_out(lambda s: s.remove(namespace=ns)))
+
+    def remove_many(self, keys, namespace=None):
+        """Remove values by multiple keys with one batch for each shard
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        ret = True
+        for name, ks in self.group(keys, ns).items():
+            ret = self.shards[name].remove_many(ks, namespace=ns) and ret
+        return ret
+
+    def incr(self, key, delta=1, namespace=None):
+        """Add delta to integer value in its shard. See KeyValueStore.incr
+
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Value after added. None if error occured
+        :rtype: int
+        """
+        ns = namespace if namespace else self.namespace
+        return self.shard(key, ns).incr(key, delta, namespace=ns)
+
+    def compare_and_set(self, key, expected, value, namespace=None, **kwargs):
+        """Set value only if the current value equals expected. See KeyValueStore.compare_and_set
+
+        :param key: Key
+        :type key: str
+        :param expected: Expected current value. None to set only if the key doesn't exist
+        :type expected: object
+        :param value: New value
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: True if value is set
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.namespace
+        return self.shard(key, ns).compare_and_set(key, expected, value, namespace=ns, **kwargs)
+
+    def sweep_expired(self, **kwargs):
+        """Remove expired values in all shards
+
+        :return: Number of removed values
+        :rtype: int
+        """
+        return sum(self.fan_out(lambda s: s.sweep_expired(**kwargs)))
+
+    @contextmanager
+    def transaction(self, **kwargs):
+        """Defer commits of all shards until the end of the block.
+        Shards are committed one by one, so some of them may be committed when another fails
+
+        :return: This instance
+        :rtype: ShardedKeyValueStore
+        """
+        with ExitStack() as stack:
+            for s in self.shards.values():
+                stack.enter_context(s.transaction(**kwargs))
+            yield self
+
+    def add_shard(self, name, kvs, migrate=True):
+        """Add shard and move the keys that belong to it from other shards.
+        Pause writes while migrating, because writes to moving keys may be lost
+
+        :param name: Name of shard
+        :type name: str
+        :param kvs: KeyValueStore of the new shard
+        :type kvs: KeyValueStore
+        :param migrate: Move keys. Set False if the new shard is filled by other way
+        :type migrate: bool
+        :return: Number of moved values
+        :rtype: int
+        """
+        if name in self.shards:
+            raise ValueError("Shard already exists: " + str(name))
+        shards = dict(self.shards)
+        shards[name] = kvs
+        return self.rebalance(shards, migrate)
+
+    def remove_shard(self, name, migrate=True):
+        """Remove shard and move its keys to other shards.
+        Pause writes while migrating, because writes to moving keys may be lost
+
+        :param name: Name of shard
+        :type name: str
+        :param migrate: Move keys
+        :type migrate: bool
+        :return: Number of moved values
+        :rtype: int
+        """
+        shards = dict(self.shards)
+        del shards[name]
+        if not shards:
+            raise ValueError("Can't remove the last shard")
+        return self.rebalance(shards, migrate, sources=[self.shards[name]])
+
+    def rebalance(self, shards, migrate=True, sources=None):
+        """Switch to new set of shards. Keys are copied to the new owners, then ring is switched and they are removed from the old ones
+
+        :param shards: KeyValueStores by name of shard
+        :type shards: dict
+        :param migrate: Move keys
+        :type migrate: bool
+        :param sources: Shards to move keys from. All current shards by default
+        :type sources: list
+        :return: Number of moved values
+        :rtype: int
+        :raises RuntimeError: Failed to migrate values, or to remove moved values from the old shards. Those are removed by remove_stale()
+        """
+        if self.remove_stale():
+            raise RuntimeError("Values moved by the last rebalance are left in old shards. Call remove_stale() before rebalancing")
+        ring = HashRing(shards, self.vnodes)
+        moved = []
+        for source in (sources if sources is not None else list(self.shards.values())) if migrate else []:
+            for ns in source.namespaces() or []:
+                for batch in split_chunks(source.iter_rows(True, ns, self.migrate_batch_size, with_expires=True), self.migrate_batch_size):
+                    targets = {}
+                    for row in batch:
+                        target = shards[ring.node(ns, row[0])]
+                        if target is not source:
+                            targets.setdefault(id(target), (target, []))[1].append(row)
+                    for target, rows in targets.values():
+                        if target.import_rows(rows, namespace=ns) is None:
+                            raise RuntimeError("Failed to migrate values in " + str(ns))
+                        moved.append((source, ns, [r[0] for r in rows]))
+        self.shards = shards
+        self.ring = ring
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.stale.extend(moved)
+        left = self.remove_stale()
+        if left:
+            raise RuntimeError("Failed to remove {0} moved values from old shards. Call remove_stale() to retry".format(left))
+        return sum(len(m[2]) for m in moved)
+
+    def remove_stale(self, retries=3, interval=0.5):
+        """Remove values left in old shards after they were moved by rebalancing
+
+        :param retries: Times to retry failed removals
+        :type retries: int
+        :param interval: Seconds to wait before retrying
+        :type interval: float
+        :return: Number of values still left
+        :rtype: int
+        """
+        for attempt in range(retries + 1):
+            if not self.stale:
+                break
+            if attempt:
+                time.sleep(interval)
+            self.stale = [(source, ns, keys) for source, ns, keys in self.stale if not source.remove_many(keys, namespace=ns)]
+        left = sum(len(m[2]) for m in self.stale)
+        if left:
+            self.logger.error("Failed to remove {0} moved values from old shards".format(left))
+        return left
+
+    def close(self):
+        """Close all shards
+        """
+        for s in self.shards.values():
+            s.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
@@ -4,6 +4,21 @@ from pycoki import KeyValueStore
 import pyodbc
 
 class SQLDBKeyValueStore(KeyValueStore):
+    # SQL Server accepts up to 2100 parameters
+    max_params = 2000
+    max_value_length = 4000
+
+    def write_rows(self, cursor, rows):
+        """Write rows with parameter arrays in one batch
+
+        :param cursor: Cursor
+        :type cursor: pyodbc.Cursor
+        :param rows: Tuples of namespace, key, serialized value, timestamp and expiry
+        :type rows: list
+        """
+        cursor.fast_executemany = True
+        super().write_rows(cursor, rows)
+
     @staticmethod
     def get_connection(connection_str):
         """Get connection by given connection string
@@ -15,9 +30,28 @@ class SQLDBKeyValueStore(KeyValueStore):
         """
         return pyodbc.connect(connection_str)
 
+    @staticmethod
+    def edit_incr_params(namespace, key, delta, timestamp, now):
+        """Edit SQL params of incr
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param delta: Number to add
+        :type delta: int
+        :param timestamp: Timestamp edited by edit_timestamp
+        :type timestamp: object
+        :param now: Current time in seconds since epoch
+        :type now: float
+        :return: params
+        :rtype: tuple
+        """
+        return (namespace, key, str(delta), timestamp, now, now, delta, now)
+
     @staticmethod
     def map_record(row):
-        """Map data from record to dict
+        """Map data from record to dict. Not used by KeyValueStore any more, kept for compatibility
 
         :param row: A row of record set
         :type row: pyodbc.Row
@@ -29,6 +63,8 @@ class SQLDBKeyValueStore(KeyValueStore):
             "key": None if not "kv_key" in cols else row[cols.index("kv_key")],
             "value": None if not "kv_value" in cols else row[cols.index("kv_value")],
             "namespace": None if not "kv_namespace" in cols else row[cols.index("kv_namespace")],
+            "timestamp": None if not "kv_timestamp" in cols else row[cols.index("kv_timestamp")],
+            "data": None if not "kv_data" in cols else row[cols.index("kv_data")],
         }
 
     @staticmethod
@@ -63,19 +99,65 @@ class SQLDBKeyValueStore(KeyValueStore):
         """
         return {
             "prepare_check": "select id from dbo.sysobjects where id = object_id('{0}')".format(table_name),
-            "prepare_create": "create table {0} (kv_namespace NVARCHAR(50), kv_key NVARCHAR(100), kv_value NVARCHAR(4000), kv_timestamp DATETIME2, primary key(kv_namespace, kv_key))".format(table_name),
-            "get": "select kv_value from {0} where kv_namespace=? and kv_key=?".format(table_name),
-            "get_all": "select kv_key, kv_value from {0} where kv_namespace=?".format(table_name),
-            "keys": "select kv_key from {0} where kv_namespace=?".format(table_name),
+            "prepare_create": "create table {0} (kv_namespace NVARCHAR(50), kv_key NVARCHAR(100), kv_value NVARCHAR(4000), kv_timestamp DATETIME2, kv_expires FLOAT, primary key(kv_namespace, kv_key))".format(table_name),
+            "prepare_check_index": "select name from sys.indexes where object_id = object_id('{0}') and name = '{0}_ts_idx'".format(table_name),
+            "prepare_create_index": "create index {0}_ts_idx on {0} (kv_namespace, kv_timestamp)".format(table_name),
+            "prepare_check_expires": "select name from sys.columns where object_id = object_id('{0}') and name = 'kv_expires'".format(table_name),
+            "prepare_alter_expires": "alter table {0} add kv_expires FLOAT".format(table_name),
+            "prepare_check_expires_index": "select name from sys.indexes where object_id = object_id('{0}') and name = '{0}_exp_idx'".format(table_name),
+            "prepare_create_expires_index": "create index {0}_exp_idx on {0} (kv_expires)".format(table_name),
+            "probe_table": "select kv_key from {0} where 1=0".format(table_name),
+            "probe_expires": "select kv_expires from {0} where 1=0".format(table_name),
+            "get": "select kv_value from {0} where kv_namespace=? and kv_key=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "get_all": "select kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "keys": "select kv_key from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "changes": "select kv_key, kv_timestamp from {0} where kv_namespace=? and kv_timestamp>=? order by kv_timestamp".format(table_name),
+            "namespaces": "select distinct kv_namespace from {0}".format(table_name),
+            "scan_keys": "select top ({{1}}) kv_key from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key".format(table_name),
+            "scan_items": "select top ({{1}}) kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key".format(table_name),
+            "scan_rows": "select top ({{1}}) kv_key, kv_value, kv_expires from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) {{0}} order by kv_key".format(table_name),
+            "count": "select count(*) as kv_count from {0} where kv_namespace=?".format(table_name),
+            "key_at": "select kv_key from {0} where kv_namespace=? order by kv_key offset ? rows fetch next 1 rows only".format(table_name),
+            "get_many": "select kv_key, kv_value from {0} where kv_namespace=? and (kv_expires is null or kv_expires>?) and kv_key in ({{0}})".format(table_name),
             "set": """
                     merge into {0} as A
-                    using (select ? as kv_namespace, ? as kv_key, ? as kv_value, ? as kv_timestamp) as B
+                    using (select ? as kv_namespace, ? as kv_key, ? as kv_value, ? as kv_timestamp, ? as kv_expires) as B
                     on (A.kv_namespace = B.kv_namespace and A.kv_key = B.kv_key)
                     when matched then
-                    update set kv_value=B.kv_value, kv_timestamp=B.kv_timestamp
+                    update set kv_value=B.kv_value, kv_timestamp=B.kv_timestamp, kv_expires=B.kv_expires
                     when not matched then 
-                    insert (kv_namespace, kv_key, kv_value, kv_timestamp) values (B.kv_namespace, B.kv_key, B.kv_value, B.kv_timestamp);
+                    insert (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (B.kv_namespace, B.kv_key, B.kv_value, B.kv_timestamp, B.kv_expires);
                     """.format(table_name),
             "remove": "delete from {0} where kv_namespace=? and kv_key=?".format(table_name),
+            "remove_many": "delete from {0} where kv_namespace=? and kv_key in ({{0}})".format(table_name),
             "remove_all": "delete from {0} where kv_namespace=?".format(table_name),
+            "remove_expired": "delete top ({{0}}) from {0} where kv_expires<=?".format(table_name),
+            "remove_expired_key": "delete from {0} where kv_namespace=? and kv_key=? and kv_expires<=?".format(table_name),
+            "insert_new": """
+                    merge into {0} with (holdlock) as A
+                    using (select ? as kv_namespace, ? as kv_key, ? as kv_value, ? as kv_timestamp, ? as kv_expires) as B
+                    on (A.kv_namespace = B.kv_namespace and A.kv_key = B.kv_key)
+                    when not matched then
+                    insert (kv_namespace, kv_key, kv_value, kv_timestamp, kv_expires) values (B.kv_namespace, B.kv_key, B.kv_value, B.kv_timestamp, B.kv_expires);
+                    """.format(table_name),
+            "compare_and_set": "update {0} set kv_value=?, kv_timestamp=?, kv_expires=? where kv_namespace=? and kv_key=? and kv_value=? and (kv_expires is null or kv_expires>?)".format(table_name),
+            "incr": """
+                    merge into {0} with (holdlock) as A
+                    using (select ? as kv_namespace, ? as kv_key, ? as kv_value, ? as kv_timestamp) as B
+                    on (A.kv_namespace = B.kv_namespace and A.kv_key = B.kv_key)
+                    when matched and (A.kv_expires<=? or A.kv_value='' or cast(try_cast(A.kv_value as bigint) as nvarchar(4000))=A.kv_value) then
+                    update set kv_value=cast(case when A.kv_expires<=? then 0 else cast(coalesce(nullif(A.kv_value, ''), '0') as bigint) end + ? as nvarchar(4000)),
+                    kv_timestamp=B.kv_timestamp, kv_expires=case when A.kv_expires<=? then null else A.kv_expires end
+                    when not matched then
+                    insert (kv_namespace, kv_key, kv_value, kv_timestamp) values (B.kv_namespace, B.kv_key, B.kv_value, B.kv_timestamp)
+                    output inserted.kv_value;
+                    """.format(table_name),
+            "prepare_check_blob": "select id from dbo.sysobjects where id = object_id('{0}_blob')".format(table_name),
+            "prepare_create_blob": "create table {0}_blob (kv_namespace NVARCHAR(50), kv_key NVARCHAR(100), kv_chunk INT, kv_data VARBINARY(MAX), kv_timestamp DATETIME2, primary key(kv_namespace, kv_key, kv_chunk))".format(table_name),
+            "blob_get": "select kv_data from {0}_blob where kv_namespace=? and kv_key=? order by kv_chunk".format(table_name),
+            "blob_get_chunk": "select kv_data from {0}_blob where kv_namespace=? and kv_key=? and kv_chunk=?".format(table_name),
+            "blob_keys": "select kv_key from {0}_blob where kv_namespace=? and kv_chunk=0".format(table_name),
+            "blob_set": "insert into {0}_blob (kv_namespace, kv_key, kv_chunk, kv_data, kv_timestamp) values (?,?,?,?,?)".format(table_name),
+            "blob_remove": "delete from {0}_blob where kv_namespace=? and kv_key=?".format(table_name),
+            "blob_remove_all": "delete from {0}_blob where kv_namespace=?".format(table_name),
         }
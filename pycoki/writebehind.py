@@ -0,0 +1,391 @@
+"""Pycoki write-behind mode
+
+Writes are queued in memory and written to database in batches by a background thread.
+"""
+
+from collections import OrderedDict
+from contextlib import nullcontext
+import atexit
+import functools
+import threading
+import traceback
+
+# Marker of removed key in the queue
+REMOVED = object()
+
+class WriteBehindKeyValueStore:
+    def __init__(self, kvs, max_pending=10000, flush_interval=0.1, flush_size=1000, block=True, put_timeout=10.0, retry_interval=1.0, flush_at_exit=True):
+        """Constractor of WriteBehindKeyValueStore
+        set and remove return after queuing, and repeated writes to the same key are coalesced into one.
+        Values are serialized when queued to reject values that can't be written.
+        Pending writes are lost if the process is killed, so don't use it for data that must survive crashes.
+        Other methods (keys, iter_items, incr...) are delegated to the wrapped store after flushing pending writes.
+
+        :param kvs: KeyValueStore to wrap
+        :type kvs: KeyValueStore
+        :param max_pending: Max number of pending keys. Writes of new keys wait for flush when exceeded
+        :type max_pending: int
+        :param flush_interval: Max seconds to keep writes in the queue
+        :type flush_interval: float
+        :param flush_size: Flush without waiting for flush_interval when this number of keys are pending
+        :type flush_size: int
+        :param block: Wait when the queue is full. Writes fail immediately if False
+        :type block: bool
+        :param put_timeout: Max seconds to wait when the queue is full. None to wait forever
+        :type put_timeout: float
+        :param retry_interval: Seconds to wait before retrying flush failed by connection error
+        :type retry_interval: float
+        :param flush_at_exit: Flush pending writes when the interpreter exits
+        :type flush_at_exit: bool
+        """
+        self.kvs = kvs
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.block = block
+        self.put_timeout = put_timeout
+        self.retry_interval = retry_interval
+        self.flush_at_exit = flush_at_exit
+        self.pending = OrderedDict()
+        self.flushing = {}
+        self.written = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.flush_lock = threading.RLock()
+        # Connection is shared by the caller and the background thread unless kvs is thread safe
+        self.kvs_lock = threading.RLock() if getattr(kvs, "local", None) is None else nullcontext()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="pycoki-write-behind", daemon=True)
+        self.thread.start()
+        if flush_at_exit:
+            atexit.register(self.flush)
+
+    def __getattr__(self, name):
+        attr = getattr(self.kvs, name)
+        if not callable(attr):
+            return attr
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            self.flush()
+            with self.kvs_lock:
+                return attr(*args, **kwargs)
+        return wrapper
+
+    def get(self, key=None, namespace=None, connection=None):
+        """Get value by key or all values in namespace. Pending writes are returned without database access
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Value or all values in namespace
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        if key:
+            found, value = self.lookup(ns, key)
+            if found:
+                return None if value is REMOVED else value
+        else:
+            self.flush()
+        with self.kvs_lock:
+            return self.kvs.get(key=key, namespace=ns, connection=connection)
+
+    def get_many(self, keys, namespace=None, connection=None):
+        """Get values by multiple keys from pending writes and database
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param connection: Connection
+        :type connection: Connection
+        :return: Values by key. Keys not found are not included
+        :rtype: dict
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        ret = {}
+        missing = []
+        for k in keys:
+            found, value = self.lookup(ns, k)
+            if not found:
+                missing.append(k)
+            elif value is not REMOVED:
+                ret[k] = value
+        if missing:
+            with self.kvs_lock:
+                values = self.kvs.get_many(missing, namespace=ns, connection=connection)
+            if values:
+                ret.update(values)
+        return ret
+
+    def set(self, key, value, namespace=None, ttl=None):
+        """Queue value to set. Expiry is counted from when it is written to database
+
+        :param key: Key
+        :type key: str
+        :param value: Value. Don't modify it after set
+        :type value: object
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param ttl: Seconds until the value expires. None to keep it forever
+        :type ttl: float
+        :return: True if queued
+        :rtype: bool
+        """
+        return self.put(namespace if namespace else self.kvs.namespace, key, value, ttl)
+
+    def set_many(self, values, namespace=None, ttl=None):
+        """Queue multiple values to set
+
+        :param values: Values by key
+        :type values: dict
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param ttl: Seconds until the values expire. None to keep them forever
+        :type ttl: float
+        :return: True if all values are queued
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        ret = True
+        for k, v in values.items():
+            ret = self.put(ns, k, v, ttl) and ret
+        return ret
+
+    def remove(self, key=None, namespace=None):
+        """Queue removing value by key. Removing all values in namespace is done immediately
+
+        :param key: Key
+        :type key: str
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: Result
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        if key:
+            return self.put(ns, key, REMOVED, None)
+        with self.flush_lock:
+            with self.lock:
+                for k in [k for k in self.pending if k[0] == ns]:
+                    del self.pending[k]
+                self.not_full.notify_all()
+            with self.kvs_lock:
+                return self.kvs.remove(namespace=ns)
+
+    def remove_many(self, keys, namespace=None):
+        """Queue removing values by multiple keys
+
+        :param keys: Keys
+        :type keys: list
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :return: True if all keys are queued
+        :rtype: bool
+        """
+        ns = namespace if namespace else self.kvs.namespace
+        ret = True
+        for k in keys:
+            ret = self.put(ns, k, REMOVED, None) and ret
+        return ret
+
+    def put(self, namespace, key, value, ttl):
+        """Put write into the queue. Previous pending write to the same key is replaced
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :param value: Value or REMOVED
+        :type value: object
+        :param ttl: Seconds until the value expires
+        :type ttl: float
+        :return: True if queued. False if value can't be serialized or the queue is full
+        :rtype: bool
+        """
+        if value is not REMOVED:
+            try:
+                self.kvs.serialize(value)
+            except Exception as ex:
+                self.kvs.logger.error("Error occured in queuing data: " + str(ex) + "\n" + traceback.format_exc())
+                return False
+        with self.lock:
+            if (namespace, key) in self.pending:
+                self.coalesced += 1
+            elif len(self.pending) >= self.max_pending:
+                self.wakeup.set()
+                if not self.block or not self.not_full.wait_for(lambda: len(self.pending) < self.max_pending, self.put_timeout):
+                    self.kvs.logger.error("Write-behind queue is full. Failed to queue: " + str(key))
+                    return False
+            self.pending[(namespace, key)] = (value, ttl)
+            if len(self.pending) >= self.flush_size:
+                self.wakeup.set()
+        return True
+
+    def lookup(self, namespace, key):
+        """Find pending write
+
+        :param namespace: Namespace of Key-Value
+        :type namespace: str
+        :param key: Key
+        :type key: str
+        :return: Whether write is pending and the value as read from database after flush. REMOVED if removed
+        :rtype: tuple
+        """
+        with self.lock:
+            entry = self.pending.get((namespace, key))
+            if entry is None:
+                entry = self.flushing.get((namespace, key))
+        if entry is None:
+            return (False, None)
+        # Falsy values are stored as empty and read as None
+        return (True, entry[0] if entry[0] is REMOVED or entry[0] else None)
+
+    def run(self):
+        """Flush pending writes periodically until stopped
+        """
+        while not self.stop_event.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if not self.write_pending():
+                self.stop_event.wait(self.retry_interval)
+
+    def flush(self):
+        """Write all pending writes now
+
+        :return: Result
+        :rtype: bool
+        """
+        return self.write_pending()
+
+    def write_pending(self):
+        """Write pending writes in one transaction.
+        When it failed, they are queued again if the connection is lost. Otherwise they are written one by one and failed ones are dropped
+
+        :return: True if all writes are written
+        :rtype: bool
+        """
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return True
+                batch = self.pending
+                self.pending = OrderedDict()
+                self.flushing = batch
+                self.not_full.notify_all()
+            written = 0
+            dropped = 0
+            retry = {}
+            try:
+                self.write_batch(batch)
+                written = len(batch)
+            except Exception as ex:
+                self.kvs.logger.error("Error occured in writing pending data: " + str(ex) + "\n" + traceback.format_exc())
+                if self.is_connected():
+                    written, retry = self.write_each(batch)
+                    dropped = len(batch) - written - len(retry)
+                else:
+                    retry = batch
+            with self.lock:
+                self.flushing = {}
+                self.written += written
+                self.dropped += dropped
+                if written < len(batch):
+                    self.failures += 1
+                for k, v in retry.items():
+                    if k not in self.pending:
+                        self.pending[k] = v
+            return written == len(batch)
+
+    def write_each(self, batch):
+        """Write pending writes one by one after writing them together failed.
+        Writes failed while the connection is alive are dropped
+
+        :param batch: Tuples of value and ttl by tuple of namespace and key
+        :type batch: dict
+        :return: Number of writes written and writes to queue again by connection error
+        :rtype: tuple
+        """
+        written = 0
+        retry = OrderedDict()
+        for k, v in batch.items():
+            if retry:
+                # Connection is lost
+                retry[k] = v
+                continue
+            try:
+                self.write_batch({k: v})
+                written += 1
+            except Exception as ex:
+                if self.is_connected():
+                    self.kvs.logger.error("Dropped pending write of " + str(k[1]) + " in " + str(k[0]) + ": " + str(ex))
+                else:
+                    retry[k] = v
+        return (written, retry)
+
+    def is_connected(self):
+        """Check if the connection of the wrapped store is alive
+
+        :return: True if alive. False if it can't be checked
+        :rtype: bool
+        """
+        try:
+            with self.kvs_lock:
+                with self.kvs.transaction() as kvs:
+                    return kvs.check_connection(kvs.connection)
+        except Exception:
+            return False
+
+    def write_batch(self, batch):
+        """Write coalesced writes by set_many and remove_many
+
+        :param batch: Tuples of value and ttl by tuple of namespace and key
+        :type batch: dict
+        """
+        values = {}
+        removes = {}
+        for (ns, key), (value, ttl) in batch.items():
+            if value is REMOVED:
+                removes.setdefault(ns, []).append(key)
+            else:
+                values.setdefault((ns, ttl), {})[key] = value
+        with self.kvs_lock:
+            with self.kvs.transaction():
+                for ns, keys in removes.items():
+                    if not self.kvs.remove_many(keys, namespace=ns):
+                        raise RuntimeError("Failed to remove pending keys in " + str(ns))
+                for (ns, ttl), vals in values.items():
+                    if not self.kvs.set_many(vals, namespace=ns, ttl=ttl):
+                        raise RuntimeError("Failed to set pending values in " + str(ns))
+
+    def stats(self):
+        """Get statistics of write-behind queue
+
+        :return: Counters and current usage
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "pending": len(self.pending) + len(self.flushing),
+                "written": self.written,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    def close(self):
+        """Stop background thread, write pending writes and close the wrapped store
+        """
+        self.stop_event.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        if self.flush_at_exit:
+            atexit.unregister(self.flush)
+        self.kvs.close()
@@ -13,7 +13,16 @@ setup(
     maintainer_email="uezo@uezo.net",
     description="Pycoki - Python Compatible Key-value-store Interface for databases",
     packages=find_packages(exclude=["examples*", "tests*"]),
-    install_requires=["pytz"],
+    install_requires=[],
+    extras_require={
+        "mysql": ["mysqlclient"],
+        "pgsql": ["psycopg2"],
+        "sqldb": ["pyodbc"],
+        "pytz": ["pytz"],
+    },
+    entry_points={
+        "console_scripts": ["pycoki-bench=pycoki.bench:main", "pycoki-dump=pycoki.dump:main"]
+    },
     license="Apache v2",
     classifiers=[
         "Programming Language :: Python :: 3"
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pycoki
+
+# Table created by versions before kv_expires column
+OLD_SCHEMA = "create table pycoki (kv_namespace TEXT, kv_key TEXT, kv_value TEXT, kv_timestamp TEXT, primary key(kv_namespace, kv_key))"
+
+class TestUpgradeTable(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "old.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute(OLD_SCHEMA)
+        conn.execute("insert into pycoki values ('__', 'a', '1', '2020-01-01 00:00:00')")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def columns(self, conn):
+        return [row[1] for row in conn.execute("pragma table_info(pycoki)")]
+
+    def test_connection_str(self):
+        kvs = pycoki.start(self.path)
+        try:
+            self.assertIn("kv_expires", self.columns(kvs.connection))
+            self.assertEqual(kvs.get("a"), 1)
+            self.assertEqual(kvs.keys(), ["a"])
+        finally:
+            kvs.close()
+
+    def test_connection(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            kvs = pycoki.start(connection=conn)
+            self.assertIn("kv_expires", self.columns(conn))
+            self.assertEqual(kvs.get("a"), 1)
+            self.assertEqual(kvs.keys(), ["a"])
+            self.assertTrue(kvs.set("b", 2, ttl=60))
+            self.assertEqual(kvs.get("b"), 2)
+            kvs.close()
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    unittest.main()